@@ -2,26 +2,30 @@
 from __future__ import annotations
 
 import os
-from typing import List, Tuple
+from typing import AsyncIterator, List, Tuple
 
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 
-from normalizer import normalize_text
+from normalizer import GENERATION_STYLE_RULES, normalize_text
 
 from state import (
     SessionState,
     Message,
     add_message,
-    save_session_state,
-    DEFAULT_CONTEXT_LIMIT_TURNS,
-    DEFAULT_KEEP_LAST_TURNS,
+    asave_session_state,
+)
+from memory import (
+    CONTEXT_WINDOW,
+    USER_AGENT_LABELS,
+    enforce_history_ceiling,
+    format_messages,
+    render_history,
+    schedule_background_summary,
 )
 from prompts import (
     BASE_PERSONALITY_PROMPT,
-    SUMMARY_SYSTEM_PROMPT,
-    SUMMARY_USER_PROMPT,
     CONVERSATION_USER_TEMPLATE,
 )
 
@@ -33,12 +37,8 @@ load_dotenv()
 # Modelo principal (para responder al usuario)
 MAIN_MODEL = os.getenv("OPENAI_MODEL_NAME", "gpt-4o-mini")
 
-# Modelo de resumen (puede ser más pequeño/barato)
-SUMMARY_MODEL = os.getenv("SUMMARY_MODEL_NAME", "gpt-4o-mini")
-
 # Temperaturas con posibilidad de override por .env
 MAIN_TEMPERATURE = float(os.getenv("MAIN_TEMPERATURE", "0.7"))
-SUMMARY_TEMPERATURE = float(os.getenv("SUMMARY_TEMPERATURE", "0.2"))
 
 # Modelo principal del agente (Daniel)
 llm = ChatOpenAI(
@@ -46,29 +46,8 @@ llm = ChatOpenAI(
     temperature=MAIN_TEMPERATURE,
 )
 
-# Modelo para resumir (memoria comprimida de sesión)
-summary_llm = ChatOpenAI(
-    model=SUMMARY_MODEL,
-    temperature=SUMMARY_TEMPERATURE,
-)
-
-# Parámetros de memoria (inspirados en trimming + summarizing)
-CONTEXT_LIMIT_TURNS: int = int(
-    os.getenv("CONTEXT_LIMIT_TURNS", DEFAULT_CONTEXT_LIMIT_TURNS)
-)
-KEEP_LAST_TURNS: int = int(
-    os.getenv("KEEP_LAST_TURNS", DEFAULT_KEEP_LAST_TURNS)
-)
-
 # --- Prompts LangChain ---
 
-summary_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", SUMMARY_SYSTEM_PROMPT),
-        ("user", SUMMARY_USER_PROMPT),
-    ]
-)
-
 conversation_prompt = ChatPromptTemplate.from_messages(
     [
         ("system", BASE_PERSONALITY_PROMPT),
@@ -77,6 +56,8 @@ conversation_prompt = ChatPromptTemplate.from_messages(
             "Usa el resumen más el historial reciente para responder al usuario "
             "de forma coherente y consistente.",
         ),
+        # Modo single-pass: reglas del normalizador en la propia generación
+        *([("system", GENERATION_STYLE_RULES)] if GENERATION_STYLE_RULES else []),
         ("user", CONVERSATION_USER_TEMPLATE),
     ]
 )
@@ -86,86 +67,10 @@ conversation_prompt = ChatPromptTemplate.from_messages(
 
 def _format_messages_as_text(messages: List[Message]) -> str:
     """
-    Convierte la lista de mensajes en un bloque de texto etiquetado,
-    útil tanto para el resumen como para el contexto del LLM.
-    """
-    lines: List[str] = []
-    for msg in messages:
-        role = msg["role"]
-        label = "Usuario" if role == "user" else "Agente"
-        lines.append(f"{label}: {msg['content']}")
-    return "\n".join(lines).strip() or "(sin mensajes previos relevantes)"
-
-
-def _user_turn_indices(history: List[Message]) -> List[int]:
-    """
-    Devuelve los índices en history donde empieza cada turno de usuario.
-    (Un turno empieza cuando hay un mensaje con role == 'user').
-    """
-    return [i for i, m in enumerate(history) if m["role"] == "user"]
-
-
-def _should_summarize(history: List[Message]) -> bool:
-    """
-    Decide si hay que resumir en función del nº de turnos de usuario.
-    (Ahora mismo no se usa directamente, pero lo dejamos por claridad).
-    """
-    return len(_user_turn_indices(history)) > CONTEXT_LIMIT_TURNS
-
-
-def _summarize_prefix_into_state(
-    state: SessionState,
-    prefix_messages: List[Message],
-) -> None:
-    """
-    Resume el bloque 'prefix_messages' y lo integra en state.summary.
-    Después NO toca state.history: eso se hace fuera (trimming).
-    """
-    if not prefix_messages:
-        return
-
-    existing_summary = state.summary or ""
-    new_block = _format_messages_as_text(prefix_messages)
-
-    messages = summary_prompt.format_messages(
-        existing_summary=existing_summary,
-        new_block=new_block,
-    )
-
-    result = summary_llm.invoke(messages)
-    state.summary = result.content.strip()
-
-
-def _maybe_trim_and_summarize(state: SessionState) -> None:
-    """
-    Implementa la lógica de trimming + summarizing:
-
-    - Si nº de turnos de usuario > CONTEXT_LIMIT_TURNS:
-        - Calcula índices de turnos de usuario.
-        - Determina el límite para conservar los últimos KEEP_LAST_TURNS turnos.
-        - Resume todo lo anterior en state.summary.
-        - Deja en state.history solo los últimos KEEP_LAST_TURNS turnos.
+    Convierte la lista de mensajes en un bloque de texto etiquetado
+    (lo usa el resumidor; el prompt usa render_history, incremental).
     """
-    history = state.history
-    user_indices = _user_turn_indices(history)
-
-    if len(user_indices) <= CONTEXT_LIMIT_TURNS:
-        return  # todavía no hace falta resumir
-
-    # Nos aseguramos de que KEEP_LAST_TURNS sea al menos 1 y no exceda el nº de turnos reales
-    keep_last = max(1, min(KEEP_LAST_TURNS, len(user_indices)))
-
-    # Índice (en history) del PRIMER turno que queremos conservar sin resumir
-    first_kept_user_idx = user_indices[-keep_last]
-
-    prefix = history[:first_kept_user_idx]
-    suffix = history[first_kept_user_idx:]
-
-    # 1) Resumir prefix + integrarlo en summary
-    _summarize_prefix_into_state(state, prefix)
-
-    # 2) Mantener sólo suffix en el historial corto
-    state.history = suffix
+    return format_messages(messages, USER_AGENT_LABELS)
 
 
 def _build_conversation_messages(
@@ -175,11 +80,16 @@ def _build_conversation_messages(
     """
     Construye los mensajes (para LangChain) combinando:
     - summary (memoria larga)
-    - history recortado (short-term window)
+    - history recortado (short-term window, acotado en tokens aunque
+      el resumen de fondo todavía no haya recortado state.history)
     - mensaje actual del usuario
     """
     summary_text = state.summary or "Aún no hay resumen de la conversación."
-    recent_history_text = _format_messages_as_text(state.history)
+    recent_history_text = render_history(
+        state,
+        USER_AGENT_LABELS,
+        start=CONTEXT_WINDOW.visible_start(state.history),
+    )
 
     messages = conversation_prompt.format_messages(
         summary=summary_text,
@@ -191,51 +101,97 @@ def _build_conversation_messages(
 
 # ---- Punto de entrada principal del agente ----
 
-def run_agent(
-    state: SessionState,
-    user_message: str,
-) -> Tuple[str, SessionState]:
+async def _prepare_turn(state: SessionState, user_message: str):
     """
+    Primera mitad de un turno (común a run_agent y stream_agent):
     - Añade el mensaje del usuario a state.history.
-    - Si se supera el límite de turnos, resume + recorta.
-    - Construye el prompt de conversación.
-    - Llama al modelo principal (Daniel).
-    - Añade la respuesta del agente a state.history.
-    - Guarda el estado.
+    - Construye los mensajes para el LLM (el resumen, si toca, va en segundo plano).
     """
 
     # 1) Añadir el mensaje del usuario al historial
     add_message(state, role="user", content=user_message)
 
-    # 2) Trimming + summarizing si toca (según nº de turnos)
-    _maybe_trim_and_summarize(state)
+    # 2) Construir mensajes para el LLM
+    return _build_conversation_messages(state, user_message)
 
-    # 3) Construir mensajes para el LLM
-    messages = _build_conversation_messages(state, user_message)
 
-    # 4) Llamar al modelo principal
-    result = llm.invoke(messages)
-    raw_reply = result.content.strip()
+async def _finish_turn(state: SessionState, raw_reply: str, user_message: str) -> str:
+    """
+    Segunda mitad de un turno: normaliza la salida cruda de Daniel,
+    la añade al historial y guarda el estado.
+    """
 
     # DEBUG: ver qué sale de Daniel antes del normalizador
     print("\n===== RAW_DANIEL_OUTPUT =====")
     print(raw_reply)
     print("===== END_RAW_DANIEL_OUTPUT =====\n", flush=True)
 
-    # 4.1) Normalizar estilo (máx. 1–2 frases, sin meta, etc.) +  Pasamos también el mensaje del usuario al normalizador
-    reply_text = normalize_text(raw_reply, user_message)
+    # Normalizar estilo (máx. 1–2 frases, sin meta, etc.) +  Pasamos también el mensaje del usuario al normalizador
+    reply_text = await normalize_text(raw_reply, user_message)
 
     # DEBUG: ver qué queda después de normalizar
     print("\n===== NORMALIZED_OUTPUT =====")
     print(reply_text)
     print("===== END_NORMALIZED_OUTPUT =====\n", flush=True)
 
-    # 5) Añadir respuesta del agente al historial (solo la versión normalizada)
+    # Añadir respuesta del agente al historial (solo la versión normalizada)
     add_message(state, role="assistant", content=reply_text)
 
-    # 6) Guardar estado
-    save_session_state(state)
+    # Techo duro de tokens del historial (por si el resumen no da abasto)
+    enforce_history_ceiling(state)
+
+    # Guardar estado
+    await asave_session_state(state)
+
+    # Recorte + resumen fuera del camino crítico (si toca)
+    schedule_background_summary(state, _format_messages_as_text)
+
+    return reply_text
 
-    # 7) Devolver al usuario la versión ya normalizada
+
+async def run_agent(
+    state: SessionState,
+    user_message: str,
+) -> Tuple[str, SessionState]:
+    """
+    - Prepara el turno (añade el mensaje al historial + prompt con la
+      ventana reciente y el resumen que haya).
+    - Llama al modelo principal (Daniel).
+    - Normaliza, añade la respuesta al historial y guarda el estado.
+    - El resumen/recorte del historial no ocurre aquí: se programa en
+      segundo plano (schedule_background_summary) al cerrar el turno.
+    """
+    messages = await _prepare_turn(state, user_message)
+
+    # Llamar al modelo principal
+    result = await llm.ainvoke(messages)
+    raw_reply = result.content.strip()
+
+    # Devolver al usuario la versión ya normalizada
+    reply_text = await _finish_turn(state, raw_reply, user_message)
     return reply_text, state
 
+
+async def stream_agent(
+    state: SessionState,
+    user_message: str,
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Igual que run_agent, pero emitiendo la salida del modelo principal
+    según se genera:
+
+    - ("delta", texto_parcial) por cada fragmento crudo del LLM.
+    - ("final", respuesta_normalizada) al terminar el turno.
+    """
+    messages = await _prepare_turn(state, user_message)
+
+    parts: List[str] = []
+    async for chunk in llm.astream(messages):
+        text = chunk.content or ""
+        if not text:
+            continue
+        parts.append(text)
+        yield "delta", text
+
+    raw_reply = "".join(parts).strip()
+    yield "final", await _finish_turn(state, raw_reply, user_message)
@@ -0,0 +1,328 @@
+# backend/alignment_pool.py
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import (
+    BrokenExecutor,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from typing import Dict, List, Tuple
+
+
+# --- Configuración (vía .env) ---
+
+# Nº de procesos de alineado. Cada uno carga su propio aligner de BFA.
+# 0 = sin procesos: se alinea en un único hilo del proceso principal.
+ALIGNER_WORKERS = int(os.getenv("ALIGNER_WORKERS", "2"))
+
+# Peticiones (items, no lotes) que pueden esperar en cola además de las que
+# están en curso, que son hasta ALIGNER_BATCH_MAX por worker.
+ALIGNER_QUEUE_SIZE = int(os.getenv("ALIGNER_QUEUE_SIZE", "8"))
+
+# Tiempo máximo (s) que una petición espera su timeline.
+ALIGNER_TIMEOUT_S = float(os.getenv("ALIGNER_TIMEOUT_S", "15"))
+
+# Micro-batching: juntamos peticiones que llegan casi a la vez en un solo
+# forward de BFA. Se envía el lote al llegar a ALIGNER_BATCH_MAX items o
+# cuando el más antiguo lleva ALIGNER_BATCH_WAIT_MS esperando.
+ALIGNER_BATCH_MAX = int(os.getenv("ALIGNER_BATCH_MAX", "8"))
+ALIGNER_BATCH_WAIT_MS = float(os.getenv("ALIGNER_BATCH_WAIT_MS", "20"))
+
+# Hilos de torch por proceso (con varios workers conviene 1 para no competir)
+ALIGNER_TORCH_THREADS = int(os.getenv("ALIGNER_TORCH_THREADS", "1"))
+
+
+class AlignmentPoolSaturated(RuntimeError):
+    """La cola de alineado está llena: el llamante debe usar su fallback."""
+
+
+# --- Código que corre dentro de cada worker ---
+
+def _init_worker() -> None:
+    """
+    Inicializa el hilo de alineado (workers=0): solo carga BFA.
+    No toca los hilos de torch, que aquí son los de todo el proceso de la API.
+    """
+    from lipsync_bfa import get_aligner
+
+    get_aligner()
+
+
+def _init_process_worker() -> None:
+    """
+    Inicializa un proceso worker: limita hilos de torch (el proceso es solo
+    nuestro) y carga BFA una sola vez.
+    """
+    import torch
+
+    torch.set_num_threads(max(1, ALIGNER_TORCH_THREADS))
+    _init_worker()
+
+
+def _ping() -> bool:
+    return True
+
+
+def _align_batch(items: List[Tuple[str, bytes, str]]) -> List[List[Dict]]:
+    """
+    Alinea un lote en un solo forward. Si el lote falla (p. ej. un audio
+    corrupto), reintenta item a item para no penalizar al resto: los que
+    vuelvan a fallar se quedan con timeline vacío.
+    """
+    from lipsync_bfa import (
+        build_viseme_timeline_from_bfa,
+        build_viseme_timelines_batch,
+        decode_audio_bytes,
+    )
+
+    if len(items) > 1:
+        try:
+            return build_viseme_timelines_batch(items)
+        except Exception as e:
+            print(f"[ALIGN] Error en lote de {len(items)}, reintento uno a uno: {e!r}")
+
+    timelines: List[List[Dict]] = []
+    for text, audio_bytes, audio_format in items:
+        try:
+            if not audio_bytes:
+                timelines.append([])
+                continue
+            waveform, sample_rate = decode_audio_bytes(audio_bytes, audio_format)
+            timelines.append(
+                build_viseme_timeline_from_bfa(
+                    text=text,
+                    waveform=waveform,
+                    sample_rate=sample_rate,
+                )
+            )
+        except Exception as e:
+            if len(items) == 1:
+                raise
+            print(f"[ALIGN] Error alineando {text!r}: {e!r}")
+            timelines.append([])
+    return timelines
+
+
+# --- Pool ---
+
+class AlignmentPool:
+    """
+    Pool de alineado BFA fuera del event loop, con cola acotada:
+
+    - Como mucho `workers` lotes en curso (`batch_max` items cada uno)
+      + `queue_size` items esperando.
+    - Si la cola está llena, `align` lanza AlignmentPoolSaturated al momento
+      (backpressure) en lugar de encolar y acabar en timeout.
+    - Cada petición espera como mucho `timeout_s`.
+    - Las peticiones se agrupan en lotes de hasta `batch_max` items,
+      esperando como mucho `batch_wait_s` a que se llene el lote.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        queue_size: int,
+        timeout_s: float,
+        batch_max: int = 1,
+        batch_wait_s: float = 0.0,
+    ) -> None:
+        self.workers = max(0, workers)
+        self.timeout_s = timeout_s
+        self.batch_max = max(1, batch_max)
+        self.batch_wait_s = max(0.0, batch_wait_s)
+        # Admisión en items, dimensionada en lotes: cada worker puede tener
+        # un lote lleno en curso, y detrás esperan queue_size items más.
+        self.queue_size = max(0, queue_size)
+        self.capacity = max(1, self.workers) * self.batch_max + self.queue_size
+
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        # Lote en construcción: (texto, audio, formato, future del llamante)
+        self._batch: List[Tuple[str, bytes, str, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+        # Métricas
+        self.batches = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            return self._get_executor_locked()
+
+    def _get_executor_locked(self) -> Executor:
+        if self._executor is None:
+            if self.workers == 0:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1,
+                    initializer=_init_worker,
+                )
+            else:
+                # "spawn": no heredamos hilos ni estado de torch del proceso de uvicorn
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_process_worker,
+                )
+        return self._executor
+
+    async def warmup(self) -> None:
+        """
+        Arranca los workers y espera a que carguen BFA,
+        en vez de hacerlo en la primera petición real.
+        """
+        executor = self._get_executor()
+        try:
+            pings = [executor.submit(_ping) for _ in range(max(1, self.workers))]
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in pings))
+        except BrokenExecutor:
+            # Un worker murió al arrancar (p. ej. sin memoria para BFA): se
+            # descarta ya, para que la primera petición real cree uno nuevo
+            self._discard_executor(executor)
+            raise
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _discard_executor(self, executor: Executor) -> None:
+        """
+        Un worker ha muerto (OOM, segfault de torch...): cerramos el pool roto
+        (sin dejar procesos colgados) y el siguiente lote crea uno nuevo.
+        Solo si sigue siendo el actual: varios lotes pueden fallar a la vez.
+        """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _on_batch_done(self, executor: Executor, n_items: int, future) -> None:
+        self._release(n_items)
+        if not future.cancelled() and isinstance(future.exception(), BrokenExecutor):
+            self._discard_executor(executor)
+
+    def _release(self, n_items: int) -> None:
+        # Se llama cuando el trabajo REALMENTE termina (no cuando el llamante
+        # deja de esperar), así la cola nunca supera la capacidad real.
+        with self._lock:
+            self._pending -= n_items
+
+    def _flush(self) -> None:
+        """
+        Envía el lote en construcción a un worker.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        items = [(text, audio, audio_format) for text, audio, audio_format, _ in batch]
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_align_batch, items)
+        except Exception as e:
+            self._release(len(batch))
+            if isinstance(e, BrokenExecutor):
+                self._discard_executor(executor)
+            for *_, waiter in batch:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+
+        self.batches += 1
+        future.add_done_callback(lambda f: self._on_batch_done(executor, len(batch), f))
+        asyncio.wrap_future(future).add_done_callback(
+            lambda f: self._resolve_batch(batch, f)
+        )
+
+    def _resolve_batch(
+        self,
+        batch: List[Tuple[str, bytes, str, asyncio.Future]],
+        future: asyncio.Future,
+    ) -> None:
+        for i, (*_, waiter) in enumerate(batch):
+            if waiter.done():
+                # el llamante ya se cansó de esperar (timeout)
+                continue
+            if future.cancelled():
+                waiter.cancel()
+            elif future.exception() is not None:
+                waiter.set_exception(future.exception())
+            else:
+                waiter.set_result(future.result()[i])
+
+    async def align(self, text: str, audio_bytes: bytes, audio_format: str = "wav") -> List[Dict]:
+        """
+        Timeline de visemas para (texto, audio). El audio puede ir en
+        cualquier formato que sepa decodificar lipsync_bfa (wav, mp3, opus):
+        la decodificación a PCM se hace dentro del worker.
+        """
+        with self._lock:
+            if self._pending >= self.capacity:
+                self.rejected += 1
+                raise AlignmentPoolSaturated(
+                    f"Cola de alineado llena ({self._pending}/{self.capacity})"
+                )
+            self._pending += 1
+
+        loop = asyncio.get_running_loop()
+        waiter: asyncio.Future = loop.create_future()
+        self._batch.append((text, audio_bytes, audio_format, waiter))
+
+        if len(self._batch) >= self.batch_max:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_wait_s, self._flush)
+
+        try:
+            # wait_for cancela `waiter` si se agota el tiempo
+            timeline = await asyncio.wait_for(waiter, timeout=self.timeout_s)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except BrokenExecutor:
+            # El pool roto ya se ha cerrado y descartado (_on_batch_done)
+            self.failures += 1
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+
+        self.completed += 1
+        return timeline
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "pending": self._pending,
+            "batch_max": self.batch_max,
+            "batches": self.batches,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+        }
+
+
+ALIGNMENT_POOL = AlignmentPool(
+    workers=ALIGNER_WORKERS,
+    queue_size=ALIGNER_QUEUE_SIZE,
+    timeout_s=ALIGNER_TIMEOUT_S,
+    batch_max=ALIGNER_BATCH_MAX,
+    batch_wait_s=ALIGNER_BATCH_WAIT_MS / 1000.0,
+)
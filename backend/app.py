@@ -1,8 +1,8 @@
 # backend/app.py
 from __future__ import annotations
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.responses import HTMLResponse, JSONResponse
 from pydantic import BaseModel
 
 import os
@@ -11,19 +11,49 @@ from google.oauth2 import service_account
 
 import io  # arriba del archivo
 from fastapi.responses import StreamingResponse
-from openai import OpenAI
-
-from lipsync_bfa import build_viseme_timeline_from_bfa
+from openai import AsyncOpenAI
+
+from alignment_pool import ALIGNMENT_POOL, AlignmentPoolSaturated
+from tts_pipeline import (
+    VISEME_FRAMES_MEDIA_TYPE,
+    encode_frame_header,
+    split_into_speech_chunks,
+    AUDIO_MIME_TYPES,
+    audio_duration_seconds,
+    negotiate_audio_format,
+)
+from tts_cache import TTS_CACHE, CachedSpeech, make_cache_key
+import asyncio
 import base64
-from typing import List, Dict
+import contextlib
+import json
+from typing import AsyncIterator, Callable, Dict, List, Tuple
 
 import pathlib
 from fastapi.staticfiles import StaticFiles
 
-from state import get_session_state
-from agent import run_agent
-
-from negotiation.negotiation_graph import run_negotiation_agent
+from state import (
+    SESSION_STORE,
+    SessionState,
+    aget_session_state,
+    run_serialized_turn,
+    run_session_sweeper,
+    session_lock,
+    session_lock_stats,
+)
+from agent import run_agent, stream_agent
+from memory import load_tokenizer, summary_stats
+from normalizer import normalizer_stats
+
+from negotiation.fast_planner import fast_path_stats
+from negotiation.rag_cache import rag_cache_stats
+from negotiation.negotiation_graph import (
+    get_negotiation_rag_index,
+    has_phase_docs,
+    run_negotiation_agent,
+    stream_negotiation_agent,
+    speculation_stats,
+)
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -35,7 +65,86 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("tts_visemes")
 
-app = FastAPI(title="Agente Humano - MVP")
+# --- Arranque: nada pesado al importar ---
+#
+# Los singletons caros (cliente de Google STT, cliente de OpenAI, índice RAG,
+# workers de BFA) se crean en su primer uso. Además, al arrancar se
+# "precalientan" en segundo plano los de WARMUP_COMPONENTS, sin bloquear
+# /health. /ready dice cuándo han terminado.
+#
+# Un worker que solo sirva /chat puede usar WARMUP_COMPONENTS=openai,tokenizer y
+# nunca cargará ni el aligner ni el índice.
+WARMUP_COMPONENTS = [
+    c.strip()
+    for c in os.getenv("WARMUP_COMPONENTS", "openai,speech,rag,aligner,tokenizer").split(",")
+    if c.strip()
+]
+
+# componente -> "pending" | "ready" | "failed: ..."
+_READINESS: Dict[str, str] = {}
+
+
+async def _warm_openai() -> None:
+    _get_openai_client()
+
+
+async def _warm_speech() -> None:
+    _get_speech_client()
+
+
+async def _warm_rag() -> None:
+    # Sin docs de fases el fallback es lo esperado; con docs, None es un fallo
+    index = await asyncio.to_thread(get_negotiation_rag_index)
+    if index is None and has_phase_docs():
+        raise RuntimeError("no se pudo cargar el índice RAG (se reintentará en el primer uso)")
+
+
+async def _warm_aligner() -> None:
+    await ALIGNMENT_POOL.warmup()
+
+
+async def _warm_tokenizer() -> None:
+    # Sin tiktoken se cuenta con len/4: el componente sigue listo
+    await load_tokenizer()
+
+
+_WARMUPS = {
+    "openai": _warm_openai,
+    "speech": _warm_speech,
+    "rag": _warm_rag,
+    "aligner": _warm_aligner,
+    "tokenizer": _warm_tokenizer,
+}
+
+
+async def _warm_component(name: str) -> None:
+    _READINESS[name] = "pending"
+    try:
+        await _WARMUPS[name]()
+        _READINESS[name] = "ready"
+    except Exception as e:
+        print(f"[WARMUP] Error cargando {name}: {e!r}")
+        _READINESS[name] = f"failed: {e!r}"
+
+
+async def _warmup() -> None:
+    names = [n for n in WARMUP_COMPONENTS if n in _WARMUPS]
+    for name in names:
+        _READINESS[name] = "pending"
+    await asyncio.gather(*(_warm_component(n) for n in names))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup = asyncio.create_task(_warmup())
+    sweeper = asyncio.create_task(run_session_sweeper())
+    yield
+    warmup.cancel()
+    sweeper.cancel()
+    ALIGNMENT_POOL.shutdown()
+
+
+app = FastAPI(title="Agente Humano - MVP", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -66,11 +175,20 @@ GOOGLE_CREDENTIALS_PATH = os.getenv(
     "/workspaces/agente-humano/backend/keys/google-stt.json",  # fallback seguro
 )
 
-credentials = service_account.Credentials.from_service_account_file(
-    GOOGLE_CREDENTIALS_PATH
-)
+# Cliente asíncrono (gRPC aio): credenciales y cliente se crean dentro
+# del event loop en el primer uso (o en el warmup)
+_speech_client: speech.SpeechAsyncClient | None = None
+
+
+def _get_speech_client() -> speech.SpeechAsyncClient:
+    global _speech_client
+    if _speech_client is None:
+        credentials = service_account.Credentials.from_service_account_file(
+            GOOGLE_CREDENTIALS_PATH
+        )
+        _speech_client = speech.SpeechAsyncClient(credentials=credentials)
+    return _speech_client
 
-speech_client = speech.SpeechClient(credentials=credentials)
 
 # Google STT config desde .env
 GOOGLE_STT_MODEL = os.getenv("GOOGLE_STT_MODEL", "latest_long")
@@ -87,7 +205,14 @@ stt_config = speech.RecognitionConfig(
 
 # --- OpenAI Text-to-Speech (salida de audio) ---
 
-openai_client = OpenAI()  # usa OPENAI_API_KEY del entorno
+_openai_client: AsyncOpenAI | None = None
+
+
+def _get_openai_client() -> AsyncOpenAI:
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI()  # usa OPENAI_API_KEY del entorno
+    return _openai_client
 
 TTS_MODEL = os.getenv("OPENAI_TTS_MODEL", "gpt-4o-mini-tts")
 DEFAULT_VOICE = os.getenv("OPENAI_TTS_VOICE", "alloy")
@@ -111,7 +236,9 @@ class TTSRequest(BaseModel):
 class TTSVisemeRequest(BaseModel):
     text: str
     voice: str | None = None   # igual que TTSRequest
-    format: str | None = None  # lo ignoraremos y forzaremos WAV por dentro
+    # Formatos aceptados por orden de preferencia: "opus,mp3,wav".
+    # Se entrega el primero soportado; BFA alinea sobre su PCM decodificado.
+    format: str | None = None
 
 
 class TTSVisemeResponse(BaseModel):
@@ -122,18 +249,50 @@ class TTSVisemeResponse(BaseModel):
 
 @app.get("/health")
 def health_check():
+    # Liveness: el proceso responde (aunque siga cargando cosas)
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready_check():
+    # Readiness: han terminado de cargar todos los componentes del warmup
+    statuses = _READINESS.values()
+    if all(status == "ready" for status in statuses):
+        status = "ready"
+    elif any(status.startswith("failed") for status in statuses):
+        status = "failed"
+    else:
+        status = "starting"
+    return JSONResponse(
+        status_code=200 if status == "ready" else 503,
+        content={"status": status, "components": _READINESS},
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "tts_cache": TTS_CACHE.stats(),
+        "alignment_pool": ALIGNMENT_POOL.stats(),
+        "sessions": SESSION_STORE.stats(),
+        "session_locks": session_lock_stats(),
+        "summaries": summary_stats(),
+        "negotiation_speculation": speculation_stats(),
+        "negotiation_planner": fast_path_stats(),
+        "negotiation_rag": rag_cache_stats(),
+        "normalizer": normalizer_stats(),
+    }
+
+
 @app.post("/chat", response_model=ChatResponse)
-def chat_endpoint(payload: ChatRequest):
+async def chat_endpoint(payload: ChatRequest):
     try:
-        state = get_session_state(
-            user_id=payload.user_id,
-            session_id=payload.session_id,
+        reply, _ = await run_serialized_turn(
+            payload.user_id,
+            payload.session_id,
+            payload.message,
+            run_agent,
         )
-
-        reply, _ = run_agent(state, payload.message)
         return ChatResponse(reply=reply)
 
     except Exception as e:
@@ -143,7 +302,7 @@ def chat_endpoint(payload: ChatRequest):
         )
 
 @app.post("/negociar", response_model=ChatResponse)
-def negociar_endpoint(payload: ChatRequest):
+async def negociar_endpoint(payload: ChatRequest):
     """
     Endpoint específico para el agente NEGOCIADOR (comprador de coche).
 
@@ -152,12 +311,12 @@ def negociar_endpoint(payload: ChatRequest):
     con planner + executor.
     """
     try:
-        state = get_session_state(
-            user_id=payload.user_id,
-            session_id=payload.session_id,
+        reply, _ = await run_serialized_turn(
+            payload.user_id,
+            payload.session_id,
+            payload.message,
+            run_negotiation_agent,
         )
-
-        reply, _ = run_negotiation_agent(state, payload.message)
         return ChatResponse(reply=reply)
 
     except Exception as e:
@@ -166,6 +325,89 @@ def negociar_endpoint(payload: ChatRequest):
             detail=f"Error interno en el agente de negociación: {e}",
         )
 
+# --- Streaming (SSE) de /chat y /negociar ---
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # que nginx no acumule los eventos
+}
+
+
+def _sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _sse_turn_stream(
+    events: AsyncIterator[Tuple[str, str]],
+    error_prefix: str,
+) -> AsyncIterator[str]:
+    """
+    Traduce los eventos ("delta" | "final", texto) del agente a SSE:
+
+    event: delta  -> {"text": "..."}   (texto parcial, sin normalizar)
+    event: final  -> {"reply": "..."}  (respuesta normalizada)
+    event: error  -> {"detail": "..."}
+    """
+    try:
+        async for kind, text in events:
+            if kind == "delta":
+                yield _sse_event("delta", {"text": text})
+            else:
+                yield _sse_event("final", {"reply": text})
+    except Exception as e:
+        print(f"ERROR en streaming ({error_prefix}):", repr(e))
+        yield _sse_event("error", {"detail": f"{error_prefix}: {e}"})
+
+
+async def _locked_turn_events(
+    payload: ChatRequest,
+    stream_turn: Callable[[SessionState, str], AsyncIterator[Tuple[str, str]]],
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Mantiene el lock de la sesión durante todo el streaming del turno
+    (si el cliente corta la conexión, el generador se cierra y lo suelta).
+    """
+    async with session_lock(payload.user_id, payload.session_id):
+        state = await aget_session_state(
+            user_id=payload.user_id,
+            session_id=payload.session_id,
+        )
+        async for event in stream_turn(state, payload.message):
+            yield event
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(payload: ChatRequest):
+    """
+    Versión streaming de /chat: emite el texto de Daniel según se genera
+    y un evento final con la respuesta normalizada.
+    """
+    return StreamingResponse(
+        _sse_turn_stream(
+            _locked_turn_events(payload, stream_agent),
+            "Error interno en el agente",
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+@app.post("/negociar/stream")
+async def negociar_stream_endpoint(payload: ChatRequest):
+    """
+    Versión streaming de /negociar: emite la respuesta del ejecutor
+    (sin PLAN_STATE) según se genera y un evento final normalizado.
+    """
+    return StreamingResponse(
+        _sse_turn_stream(
+            _locked_turn_events(payload, stream_negotiation_agent),
+            "Error interno en el agente de negociación",
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
 @app.get("/demo", response_class=HTMLResponse)
 def demo_page():
     return """
@@ -353,6 +595,7 @@ def demo_page():
       div.textContent = text;
       messagesEl.appendChild(div);
       messagesEl.scrollTop = messagesEl.scrollHeight;
+      return div;
     }
 
     async function sendMessage() {
@@ -372,8 +615,10 @@ def demo_page():
       sendBtn.disabled = true;
       statusEl.textContent = "Pensando...";
 
+      const replyDiv = appendMessage("", "assistant");
+
       try {
-        const res = await fetch(endpoint, {
+        const res = await fetch(endpoint + "/stream", {
           method: "POST",
           headers: {
             "Content-Type": "application/json"
@@ -387,19 +632,51 @@ def demo_page():
 
         if (!res.ok) {
           const errText = await res.text();
-          appendMessage("Error " + res.status + ": " + errText, "assistant");
+          replyDiv.textContent = "Error " + res.status + ": " + errText;
         } else {
-          const data = await res.json();
-          appendMessage(data.reply, "assistant");
+          await readEventStream(res, (event, data) => {
+            if (event === "delta") {
+              replyDiv.textContent += data.text;
+            } else if (event === "final") {
+              replyDiv.textContent = data.reply;
+            } else if (event === "error") {
+              replyDiv.textContent = "Error: " + data.detail;
+            }
+            messagesEl.scrollTop = messagesEl.scrollHeight;
+          });
         }
       } catch (err) {
-        appendMessage("Error de red: " + err, "assistant");
+        replyDiv.textContent = "Error de red: " + err;
       } finally {
         sendBtn.disabled = false;
         statusEl.textContent = "";
       }
     }
 
+    // Lee una respuesta SSE (text/event-stream) y llama a onEvent(event, data)
+    async function readEventStream(res, onEvent) {
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf("\\n\\n")) !== -1) {
+          const rawEvent = buffer.slice(0, sep);
+          buffer = buffer.slice(sep + 2);
+          let event = "message";
+          let data = "";
+          for (const line of rawEvent.split("\\n")) {
+            if (line.startsWith("event: ")) event = line.slice(7);
+            else if (line.startsWith("data: ")) data += line.slice(6);
+          }
+          if (data) onEvent(event, JSON.parse(data));
+        }
+      }
+    }
+
     sendBtn.addEventListener("click", sendMessage);
     inputEl.addEventListener("keydown", (e) => {
       if (e.key === "Enter" && !e.shiftKey) {
@@ -424,7 +701,7 @@ async def stt_google(file: UploadFile = File(...)):
         audio_bytes = await file.read()
         audio = speech.RecognitionAudio(content=audio_bytes)
 
-        response = speech_client.recognize(
+        response = await _get_speech_client().recognize(
             config=stt_config,
             audio=audio
         )
@@ -450,21 +727,17 @@ async def tts_openai(payload: TTSRequest):
         print(f"[TTS_OPENAI] Texto: {payload.text!r}")
         print(f"[TTS_OPENAI] model={TTS_MODEL}, voice={voice}, response_format={fmt}")
 
-        audio_resp = openai_client.audio.speech.create(
+        audio_resp = await _get_openai_client().audio.speech.create(
             model=TTS_MODEL,
             voice=voice,
             input=payload.text,
             response_format=fmt,
         )
 
-        audio_bytes = audio_resp.read()  # <--- aquí también
+        audio_bytes = audio_resp.content
         print(f"[TTS_OPENAI] audio_bytes len={len(audio_bytes)}")
 
-        media_type = (
-            "audio/mpeg" if fmt == "mp3"
-            else "audio/ogg" if fmt == "opus"
-            else "audio/wav"
-        )
+        media_type = AUDIO_MIME_TYPES.get(fmt, "audio/wav")
 
         return StreamingResponse(
             io.BytesIO(audio_bytes),
@@ -481,39 +754,99 @@ async def tts_openai(payload: TTSRequest):
         )
 
 
-    
+
+async def _synthesize_speech(text: str, voice: str, fmt: str) -> bytes:
+    """
+    TTS de OpenAI en el formato de entrega (wav, mp3, opus).
+    El alineado decodifica ese mismo audio a PCM, así que los visemas
+    corresponden exactamente a lo que oye el cliente.
+    """
+    audio = await _get_openai_client().audio.speech.create(
+        model=TTS_MODEL,
+        voice=voice,
+        input=text,
+        response_format=fmt,
+    )
+    # OpenAI nuevo SDK: el contenido binario está en `audio.content`
+    return audio.content
+
+
+async def _viseme_timeline_or_empty(text: str, audio_bytes: bytes, fmt: str) -> List[Dict]:
+    """
+    Timeline de visemas con BFA (en el pool de alineado); si falla,
+    se agota el tiempo o la cola está llena, timeline vacío
+    (sin visemas, pero el audio se sigue devolviendo).
+    """
+    try:
+        return await ALIGNMENT_POOL.align(text, audio_bytes, fmt)
+    except AlignmentPoolSaturated as e:
+        print("AVISO alineado BFA saturado, devolvemos audio sin visemas:", e)
+        return []
+    except asyncio.TimeoutError:
+        print(f"AVISO alineado BFA > {ALIGNMENT_POOL.timeout_s}s, devolvemos audio sin visemas")
+        return []
+    except Exception as e:
+        print("ERROR construyendo timeline BFA:", repr(e))
+        return []
+
+
+async def _speech_with_visemes(text: str, voice: str, fmt: str) -> Tuple[bytes, List[Dict]]:
+    """
+    Audio (en `fmt`) + timeline de visemas para `text`, pasando por la caché
+    (texto normalizado, voz, modelo TTS, formato).
+    """
+    key = make_cache_key(text, voice, TTS_MODEL, fmt)
+    cached = await TTS_CACHE.get(key)
+    if cached is not None:
+        return cached.audio, cached.timeline
+
+    audio_bytes = await _synthesize_speech(text, voice, fmt)
+    print(f">>> TTS: audio_bytes len={len(audio_bytes)} ({fmt})")
+
+    # --- Timeline de visemas con BFA (con fallback) ---
+    timeline = await _viseme_timeline_or_empty(text, audio_bytes, fmt)
+
+    # Solo cacheamos respuestas completas: si BFA ha fallado o estaba
+    # saturado, la próxima vez merece la pena volver a intentarlo.
+    if timeline:
+        await TTS_CACHE.put(key, CachedSpeech(audio=audio_bytes, timeline=timeline))
+    return audio_bytes, timeline
+
+
+def _wants_viseme_frames(request: Request) -> bool:
+    """
+    El cliente pide el formato binario con `Accept: application/x-viseme-frames`.
+    """
+    return VISEME_FRAMES_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def _single_frame(header: Dict, audio_bytes: bytes) -> AsyncIterator[bytes]:
+    yield encode_frame_header(header, len(audio_bytes))
+    yield audio_bytes
+
+
 @app.post("/tts_with_visemes", response_model=TTSVisemeResponse)
-async def tts_with_visemes(payload: TTSVisemeRequest):
+async def tts_with_visemes(payload: TTSVisemeRequest, request: Request):
     try:
         voice = payload.voice or DEFAULT_VOICE
-        fmt = "wav"
+        fmt = negotiate_audio_format(payload.format)
 
         print(f">>> /tts_with_visemes llamado. Texto: {payload.text!r}")
         print(f">>> model={TTS_MODEL}, voice={voice}, response_format={fmt}")
 
-        audio = openai_client.audio.speech.create(
-            model=TTS_MODEL,
-            voice=voice,
-            input=payload.text,
-            response_format=fmt,
-        )
+        audio_bytes, timeline = await _speech_with_visemes(payload.text, voice, fmt)
 
-        # OpenAI nuevo SDK: el contenido binario está en `audio.content`
-        audio_bytes = audio.content
-        print(f">>> /tts_with_visemes: audio_bytes len={len(audio_bytes)}")
+        media_type = AUDIO_MIME_TYPES[fmt]
 
-        # --- Timeline de visemas con BFA (con fallback) ---
-        try:
-            timeline = build_viseme_timeline_from_bfa(
-                text=payload.text,
-                audio_bytes_wav=audio_bytes,
+        if _wants_viseme_frames(request):
+            return StreamingResponse(
+                _single_frame(
+                    {"audio_mime_type": media_type, "timeline": timeline},
+                    audio_bytes,
+                ),
+                media_type=VISEME_FRAMES_MEDIA_TYPE,
             )
-        except Exception as e:
-            print("ERROR construyendo timeline BFA:", repr(e))
-            # Fallback: sin visemas, pero devolvemos audio.
-            timeline = []
 
-        media_type = "audio/wav"
         audio_b64 = base64.b64encode(audio_bytes).decode("ascii")
 
         return TTSVisemeResponse(
@@ -529,3 +862,109 @@ async def tts_with_visemes(payload: TTSVisemeRequest):
             detail=f"Error en TTS+visemas: {e}",
         )
 
+
+# --- TTS + visemas incremental (por frases) ---
+
+# Cuántos trozos sintetizamos/alineamos a la vez por petición
+TTS_PIPELINE_CONCURRENCY = int(os.getenv("TTS_PIPELINE_CONCURRENCY", "4"))
+
+
+async def _synthesize_chunk(
+    text: str,
+    voice: str,
+    fmt: str,
+    semaphore: asyncio.Semaphore,
+) -> Tuple[bytes, List[Dict]]:
+    async with semaphore:
+        return await _speech_with_visemes(text, voice, fmt)
+
+
+async def _tts_chunks(
+    chunks: List[str],
+    voice: str,
+    fmt: str,
+) -> AsyncIterator[Tuple[Dict, bytes]]:
+    """
+    Lanza TTS + alineado de todos los trozos en paralelo y los devuelve
+    EN ORDEN, como (cabecera, audio), en cuanto cada uno está listo.
+
+    - "timeline" es relativo al inicio del propio trozo.
+    - "offset" es el instante (s) en que empieza el trozo dentro de la respuesta.
+    - Si un trozo falla, se emite una cabecera con "error" y se corta.
+    """
+    semaphore = asyncio.Semaphore(max(1, TTS_PIPELINE_CONCURRENCY))
+    tasks = [
+        asyncio.create_task(_synthesize_chunk(chunk, voice, fmt, semaphore))
+        for chunk in chunks
+    ]
+
+    offset = 0.0
+    try:
+        for index, (chunk, task) in enumerate(zip(chunks, tasks)):
+            try:
+                audio_bytes, timeline = await task
+            except Exception as e:
+                print(f"ERROR en /tts_with_visemes/stream (trozo {index}):", repr(e))
+                yield {"index": index, "error": f"Error en TTS+visemas: {e}"}, b""
+                return
+
+            # De las cabeceras del audio (no del timeline: el silencio final no
+            # tiene visemas y sin alineado no habría timeline)
+            duration = audio_duration_seconds(audio_bytes, fmt)
+            if duration is None:
+                # Audio ilegible: mejor aproximación disponible
+                duration = timeline[-1]["end"] if timeline else 0.0
+            header = {
+                "index": index,
+                "text": chunk,
+                "offset": offset,
+                "duration": duration,
+                "audio_mime_type": AUDIO_MIME_TYPES[fmt],
+                "timeline": timeline,
+            }
+            yield header, audio_bytes
+            offset += duration
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _chunks_as_ndjson(items: AsyncIterator[Tuple[Dict, bytes]]) -> AsyncIterator[str]:
+    async for header, audio_bytes in items:
+        if audio_bytes:
+            header = {**header, "audio_base64": base64.b64encode(audio_bytes).decode("ascii")}
+        yield json.dumps(header, ensure_ascii=False) + "\n"
+
+
+async def _chunks_as_frames(items: AsyncIterator[Tuple[Dict, bytes]]) -> AsyncIterator[bytes]:
+    async for header, audio_bytes in items:
+        yield encode_frame_header(header, len(audio_bytes))
+        if audio_bytes:
+            yield audio_bytes
+
+
+@app.post("/tts_with_visemes/stream")
+async def tts_with_visemes_stream(payload: TTSVisemeRequest, request: Request):
+    """
+    Versión incremental de /tts_with_visemes: divide la respuesta en frases
+    y devuelve cada trozo (audio + visemas) en cuanto está listo, para que
+    el avatar empiece a hablar sin esperar a la respuesta completa.
+
+    Por defecto NDJSON (audio en base64); con
+    `Accept: application/x-viseme-frames`, frames binarios con el audio tal cual.
+    """
+    voice = payload.voice or DEFAULT_VOICE
+    fmt = negotiate_audio_format(payload.format)
+    chunks = split_into_speech_chunks(payload.text)
+    print(f">>> /tts_with_visemes/stream: {len(chunks)} trozos, voice={voice}, format={fmt}")
+
+    items = _tts_chunks(chunks, voice, fmt)
+    if _wants_viseme_frames(request):
+        return StreamingResponse(
+            _chunks_as_frames(items),
+            media_type=VISEME_FRAMES_MEDIA_TYPE,
+        )
+    return StreamingResponse(
+        _chunks_as_ndjson(items),
+        media_type="application/x-ndjson",
+    )
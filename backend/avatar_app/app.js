@@ -530,6 +530,117 @@ function base64ToAudioUrl(b64, mimeType = 'audio/wav') {
 }
 
 const BACKEND_URL = '';
+
+function waitForAudioEnd(el) {
+  return new Promise((resolve) => {
+    if (!el || el.ended) return resolve();
+    el.addEventListener('ended', resolve, { once: true });
+    el.addEventListener('error', resolve, { once: true });
+  });
+}
+
+// Lee una respuesta NDJSON (una línea JSON por objeto) y llama a onItem por cada una
+async function readNdjson(res, onItem) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let nl;
+    while ((nl = buffer.indexOf('\n')) !== -1) {
+      const line = buffer.slice(0, nl).trim();
+      buffer = buffer.slice(nl + 1);
+      if (line) onItem(JSON.parse(line));
+    }
+  }
+  if (buffer.trim()) onItem(JSON.parse(buffer));
+}
+
+// Lee frames binarios "application/x-viseme-frames":
+// [u32 BE longitud cabecera][cabecera JSON][audio_length bytes de audio]
+async function readVisemeFrames(res, onFrame) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = new Uint8Array(0);
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    const merged = new Uint8Array(buffer.length + value.length);
+    merged.set(buffer);
+    merged.set(value, buffer.length);
+    buffer = merged;
+
+    while (buffer.length >= 4) {
+      const headerLen = new DataView(buffer.buffer, buffer.byteOffset, 4).getUint32(0);
+      if (buffer.length < 4 + headerLen) break;
+      const header = JSON.parse(decoder.decode(buffer.subarray(4, 4 + headerLen)));
+      const end = 4 + headerLen + (header.audio_length || 0);
+      if (buffer.length < end) break;
+      onFrame(header, buffer.slice(4 + headerLen, end));
+      buffer = buffer.slice(end);
+    }
+  }
+}
+
+const VISEME_FRAMES_MEDIA_TYPE = 'application/x-viseme-frames';
+
+// Formatos de audio que este navegador reproduce, por orden de preferencia
+// (Opus pesa ~10x menos que WAV; WAV siempre como último recurso).
+function preferredAudioFormats() {
+  const probe = new Audio();
+  const formats = [];
+  if (probe.canPlayType('audio/ogg; codecs="opus"')) formats.push('opus');
+  if (probe.canPlayType('audio/mpeg')) formats.push('mp3');
+  formats.push('wav');
+  return formats.join(',');
+}
+
+// TTS + visemas por frases: empieza a hablar con el primer trozo
+// y encola el resto según van llegando (audio binario, sin base64).
+async function playTtsStream(text, { emotion = 'neutral', speechIntensity = 1.0 } = {}) {
+  const res = await fetch(`${BACKEND_URL}/tts_with_visemes/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: VISEME_FRAMES_MEDIA_TYPE },
+    body: JSON.stringify({ text, format: preferredAudioFormats() }),
+  });
+  if (!res.ok) {
+    console.error('Error TTS+visemas:', await res.text());
+    return;
+  }
+
+  let playing = Promise.resolve();
+  const enqueue = (chunk, audioUrl) => {
+    playing = playing.then(async () => {
+      await playAudioWithVisemes(audioUrl, chunk.timeline || [], { emotion, speechIntensity });
+      await waitForAudioEnd(audioElement);
+      URL.revokeObjectURL(audioUrl);
+    });
+  };
+
+  const contentType = res.headers.get('Content-Type') || '';
+  if (contentType.startsWith(VISEME_FRAMES_MEDIA_TYPE)) {
+    await readVisemeFrames(res, (chunk, audioBytes) => {
+      if (chunk.error) {
+        console.error('Error TTS+visemas:', chunk.error);
+        return;
+      }
+      const blob = new Blob([audioBytes], { type: chunk.audio_mime_type });
+      enqueue(chunk, URL.createObjectURL(blob));
+    });
+  } else {
+    await readNdjson(res, (chunk) => {
+      if (chunk.error) {
+        console.error('Error TTS+visemas:', chunk.error);
+        return;
+      }
+      enqueue(chunk, base64ToAudioUrl(chunk.audio_base64, chunk.audio_mime_type));
+    });
+  }
+  await playing;
+}
+
 async function sendTextToAgent(message, { mode = 'negociar', withAudio = true } = {}) {
   const lastReplyEl = document.getElementById('lastReply');
   lastReplyEl.textContent = '…';
@@ -557,20 +668,7 @@ async function sendTextToAgent(message, { mode = 'negociar', withAudio = true }
       return;
     }
 
-    const ttsRes = await fetch(`${BACKEND_URL}/tts_with_visemes`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ text: replyText }),
-    });
-    if (!ttsRes.ok) {
-      const errText = await ttsRes.text();
-      console.error('Error TTS+visemas:', errText);
-      return;
-    }
-    const ttsData = await ttsRes.json();
-    const audioUrl = base64ToAudioUrl(ttsData.audio_base64, ttsData.audio_mime_type);
-    const timeline = ttsData.timeline || [];
-    await playAudioWithVisemes(audioUrl, timeline, { emotion, speechIntensity: intensity });
+    await playTtsStream(replyText, { emotion, speechIntensity: intensity });
   } catch (err) {
     console.error('Error al hablar con el backend:', err);
     lastReplyEl.textContent = 'Error de red con el backend.';
@@ -2,22 +2,40 @@
 from __future__ import annotations
 
 import json
-import os
-import tempfile
-from typing import List, Dict
+import threading
+from typing import Dict, List, Optional, Tuple
 
-from bournemouth_aligner import PhonemeTimestampAligner
+import numpy as np
+import torch
 
+from tts_pipeline import WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM, parse_wav_header
 
-# --- 1) Inicializar BFA una sola vez (import-time) ---
 
-# Para español usamos el preset "es" (usa espeak-es por debajo)
-# duration_max lo fijamos a 20 s (más que suficiente para tu caso).
-ALIGNER = PhonemeTimestampAligner(
-    preset="es",        # español
-    duration_max=20,
-    device="cpu",       # en VPS sin GPU
-)
+# --- 1) Inicializar BFA una sola vez (en el primer uso, no al importar) ---
+
+_ALIGNER = None
+_ALIGNER_LOCK = threading.Lock()
+
+
+def get_aligner():
+    """
+    Devuelve el PhonemeTimestampAligner del proceso, creándolo la primera vez.
+
+    Para español usamos el preset "es" (usa espeak-es por debajo)
+    duration_max lo fijamos a 20 s (más que suficiente para tu caso).
+    """
+    global _ALIGNER
+    if _ALIGNER is None:
+        with _ALIGNER_LOCK:
+            if _ALIGNER is None:
+                from bournemouth_aligner import PhonemeTimestampAligner
+
+                _ALIGNER = PhonemeTimestampAligner(
+                    preset="es",        # español
+                    duration_max=20,
+                    device="cpu",       # en VPS sin GPU
+                )
+    return _ALIGNER
 
 
 # --- 2) Mapeo fonema IPA -> visema lógico (versión "industrial" para tu rig CC) ---
@@ -157,9 +175,154 @@ def phoneme_to_viseme(phoneme: str) -> str:
 # --- 3) Función central: audio_bytes (WAV) + texto -> timeline de visemas ---
 
 
+_PCM_DTYPES = {8: np.uint8, 16: np.dtype("<i2"), 32: np.dtype("<i4")}
+_FLOAT_DTYPES = {32: np.dtype("<f4"), 64: np.dtype("<f8")}
+
+
+def _pcm24_to_float(data: memoryview) -> np.ndarray:
+    """
+    PCM de 24 bits (3 bytes little-endian con signo) -> float32 en [-1, 1].
+    """
+    raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+    samples = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+    samples = (samples << 8) >> 8  # extensión de signo desde el bit 23
+    return samples.astype(np.float32) / float(2 ** 23)
+
+
+def decode_wav_bytes(audio_bytes_wav: bytes) -> Tuple[torch.Tensor, int]:
+    """
+    Decodifica un WAV en memoria (sin fichero temporal) y devuelve
+    (waveform [1, N] float32 en [-1, 1], sample_rate), igual que
+    torchaudio.load(..., normalize=True) + mezcla a mono.
+
+    Soporta PCM entero de 8/16/24/32 bits y float IEEE de 32/64 bits
+    (también dentro de WAVE_FORMAT_EXTENSIBLE); otros formatos dan ValueError.
+
+    Las muestras se leen directamente del buffer (memoryview + frombuffer);
+    la única copia es la conversión a float.
+    """
+    header = parse_wav_header(audio_bytes_wav)
+    if header is None:
+        raise ValueError("El audio no es un WAV PCM válido")
+
+    channels, sample_rate, bits, data_offset, data_len, format_tag = header
+    if format_tag == WAVE_FORMAT_PCM:
+        if bits != 24 and bits not in _PCM_DTYPES:
+            raise ValueError(f"WAV PCM de {bits} bits no soportado")
+    elif format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if bits not in _FLOAT_DTYPES:
+            raise ValueError(f"WAV float de {bits} bits no soportado")
+    else:
+        raise ValueError(f"Formato WAV {format_tag:#x} no soportado (solo PCM o float IEEE)")
+
+    frame_bytes = channels * (bits // 8)
+    n_frames = data_len // frame_bytes
+    data = memoryview(audio_bytes_wav)[data_offset:data_offset + n_frames * frame_bytes]
+
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        samples = np.frombuffer(data, dtype=_FLOAT_DTYPES[bits]).astype(np.float32)
+    elif bits == 24:
+        samples = _pcm24_to_float(data)
+    else:
+        samples = np.frombuffer(data, dtype=_PCM_DTYPES[bits]).astype(np.float32)
+        if bits == 8:
+            samples -= 128.0
+        samples /= float(2 ** (bits - 1))
+
+    if channels > 1:
+        samples = samples.reshape(n_frames, channels).mean(axis=1)
+
+    return torch.from_numpy(samples).unsqueeze(0), sample_rate
+
+
+def decode_audio_bytes(audio_bytes: bytes, audio_format: str = "wav") -> Tuple[torch.Tensor, int]:
+    """
+    Decodifica audio en memoria a PCM (waveform [1, N] float32, sample_rate).
+
+    - "wav": lectura directa del buffer (decode_wav_bytes).
+    - Comprimidos ("mp3", "opus"...): torchcodec, también desde bytes.
+    """
+    if audio_format == "wav":
+        return decode_wav_bytes(audio_bytes)
+
+    from torchcodec.decoders import AudioDecoder
+
+    samples = AudioDecoder(audio_bytes).get_all_samples()
+    waveform = samples.data
+    if waveform.shape[0] > 1:
+        waveform = waveform.mean(dim=0, keepdim=True)
+    return waveform, samples.sample_rate
+
+
+def _load_audio_bytes(audio_bytes: bytes, audio_format: str = "wav") -> torch.Tensor:
+    """
+    Audio (bytes) -> waveform listo para BFA (mono, 16 kHz), sin tocar disco.
+    """
+    waveform, sample_rate = decode_audio_bytes(audio_bytes, audio_format)
+    return get_aligner().load_audio(waveform, sr=sample_rate)
+
+
+def _timeline_from_bfa_output(ts: Dict) -> List[Dict]:
+    """
+    Traduce el JSON de BFA (segments -> phoneme_ts) a timeline de visemas
+    y fusiona fonemas consecutivos con el mismo visema.
+    """
+    viseme_timeline: List[Dict] = []
+
+    segments = ts.get("segments", [])
+    for seg in segments:
+        for ph in seg.get("phoneme_ts", []):
+            label = ph.get("phoneme_label")
+            start_ms = ph.get("start_ms")
+            end_ms = ph.get("end_ms")
+
+            if label is None or start_ms is None or end_ms is None:
+                continue
+
+            viseme = phoneme_to_viseme(str(label))
+            start_s = float(start_ms) / 1000.0
+            end_s = float(end_ms) / 1000.0
+
+            # DEBUG: ver fonema → visema
+            print(
+                f"[BFA] phoneme={label!r} -> viseme={viseme}, "
+                f"{start_s:.3f}-{end_s:.3f}s"
+            )
+
+            viseme_timeline.append(
+                {
+                    "start": start_s,
+                    "end": end_s,
+                    "viseme": viseme,
+                }
+            )
+
+    # Fusionar fonemas consecutivos con el mismo visema (suaviza timeline)
+    merged: List[Dict] = []
+    for seg in viseme_timeline:
+        if not merged:
+            merged.append(seg)
+            continue
+
+        last = merged[-1]
+        if seg["viseme"] == last["viseme"] and abs(seg["start"] - last["end"]) < 0.02:
+            # pegamos segmentos casi contiguos del mismo visema
+            last["end"] = seg["end"]
+        else:
+            merged.append(seg)
+
+    print(f"[BFA] timeline visemas: {len(merged)} segmentos")
+    for seg in merged:
+        print(f"[BFA] VISEME_SEG: {seg['viseme']} {seg['start']:.3f}-{seg['end']:.3f}s")
+
+    return merged
+
+
 def build_viseme_timeline_from_bfa(
     text: str,
-    audio_bytes_wav: bytes,
+    audio_bytes_wav: Optional[bytes] = None,
+    waveform: Optional[torch.Tensor] = None,
+    sample_rate: Optional[int] = None,
 ) -> List[Dict]:
     """
     Usa BFA para alinear audio + texto y devuelve
@@ -172,86 +335,67 @@ def build_viseme_timeline_from_bfa(
 
     Donde "viseme" es uno de:
     {AA, AE, EE, IH, OH, OO, MBP, FV, TH, L, S, CH, KG, R, SIL}
+
+    El audio puede llegar como WAV en bytes (audio_bytes_wav) o ya
+    decodificado (waveform [1, N] float + sample_rate).
     """
 
-    if not audio_bytes_wav:
+    # 1) Cargar audio
+    if waveform is not None:
+        if sample_rate is None:
+            raise ValueError("sample_rate es obligatorio si se pasa waveform")
+        if waveform.numel() == 0:
+            return []
+        audio_wav = get_aligner().load_audio(waveform, sr=sample_rate)
+    elif audio_bytes_wav:
+        audio_wav = _load_audio_bytes(audio_bytes_wav)
+    else:
         return []
 
-    # BFA espera ruta de archivo, así que usamos un temporal .wav
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        tmp.write(audio_bytes_wav)
-        tmp_path = tmp.name
-
-    try:
-        # 1) Cargar audio
-        audio_wav = ALIGNER.load_audio(tmp_path)
-
-        # 2) Procesar frase completa (BFA espera `text`, no `text_sentence`)
-        ts = ALIGNER.process_sentence(
-            text,              # o text=text
-            audio_wav,         # audio cargado con ALIGNER.load_audio
-            ts_out_path=None,
-            extract_embeddings=False,
-            vspt_path=None,
-            do_groups=True,
-            debug=False,
-        )
-
-        # 3) Traducir JSON de BFA a timeline de visemas
-        viseme_timeline: List[Dict] = []
-
-        segments = ts.get("segments", [])
-        for seg in segments:
-            for ph in seg.get("phoneme_ts", []):
-                label = ph.get("phoneme_label")
-                start_ms = ph.get("start_ms")
-                end_ms = ph.get("end_ms")
-
-                if label is None or start_ms is None or end_ms is None:
-                    continue
-
-                viseme = phoneme_to_viseme(str(label))
-                start_s = float(start_ms) / 1000.0
-                end_s = float(end_ms) / 1000.0
-
-                # DEBUG: ver fonema → visema
-                print(
-                    f"[BFA] phoneme={label!r} -> viseme={viseme}, "
-                    f"{start_s:.3f}-{end_s:.3f}s"
-                )
+    # 2) Procesar frase completa (BFA espera `text`, no `text_sentence`)
+    ts = get_aligner().process_sentence(
+        text,              # o text=text
+        audio_wav,         # audio cargado con get_aligner().load_audio
+        ts_out_path=None,
+        extract_embeddings=False,
+        vspt_path=None,
+        do_groups=True,
+        debug=False,
+    )
 
-                viseme_timeline.append(
-                    {
-                        "start": start_s,
-                        "end": end_s,
-                        "viseme": viseme,
-                    }
-                )
+    # 3) + 4) Traducir a visemas y fusionar
+    return _timeline_from_bfa_output(ts)
 
 
-        # 4) Fusionar fonemas consecutivos con el mismo visema (suaviza timeline)
-        merged: List[Dict] = []
-        for seg in viseme_timeline:
-            if not merged:
-                merged.append(seg)
-                continue
+def build_viseme_timelines_batch(
+    items: List[Tuple[str, bytes, str]],
+) -> List[List[Dict]]:
+    """
+    Versión por lotes de build_viseme_timeline_from_bfa:
+    recibe [(texto, audio_bytes, formato), ...] (formato "wav", "mp3",
+    "opus"...) y devuelve un timeline por item, en el mismo orden.
 
-            last = merged[-1]
-            if seg["viseme"] == last["viseme"] and abs(seg["start"] - last["end"]) < 0.02:
-                # pegamos segmentos casi contiguos del mismo visema
-                last["end"] = seg["end"]
-            else:
-                merged.append(seg)
-
-        print(f"[BFA] timeline visemas: {len(merged)} segmentos")
-        for seg in merged:
-            print(f"[BFA] VISEME_SEG: {seg['viseme']} {seg['start']:.3f}-{seg['end']:.3f}s")
-
-        return merged
-
-    finally:
-        # Limpieza del temporal
-        try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
+    Todas las frases pasan juntas por process_sentences_batch del aligner, que
+    rellena (padding) los audios y los alinea en el mismo forward del modelo.
+    Los items sin audio devuelven [].
+    """
+    timelines: List[List[Dict]] = [[] for _ in items]
+
+    batch_idx = [i for i, (_, audio, _) in enumerate(items) if audio]
+    if not batch_idx:
+        return timelines
+
+    texts = [items[i][0] for i in batch_idx]
+    audio_wavs = [_load_audio_bytes(items[i][1], items[i][2]) for i in batch_idx]
+
+    results = get_aligner().process_sentences_batch(
+        texts,
+        audio_wavs,
+        extract_embeddings=False,
+        do_groups=True,
+        debug=False,
+    )
+
+    for i, ts in zip(batch_idx, results):
+        timelines[i] = _timeline_from_bfa_output(ts)
+    return timelines
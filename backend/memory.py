@@ -0,0 +1,386 @@
+# backend/memory.py
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from langchain_core.prompts import ChatPromptTemplate
+
+from state import (
+    SessionState,
+    Message,
+    RenderedTranscript,
+    afind_session_state,
+    asave_session_state,
+    session_lock,
+    DEFAULT_CONTEXT_TRIGGER_TOKENS,
+    DEFAULT_KEEP_RECENT_TOKENS,
+)
+from prompts import SUMMARY_SYSTEM_PROMPT, SUMMARY_USER_PROMPT
+
+# Cargar variables de entorno (.env)
+load_dotenv()
+
+
+# --- Conteo de tokens ---
+
+# Modelo cuyo tokenizer usamos para contar (el del agente principal)
+TOKENIZER_MODEL = os.getenv("OPENAI_MODEL_NAME", "gpt-4o-mini")
+
+# Tokens extra por mensaje (rol + separadores del formato de chat)
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """
+    Carga el tokenizer de tiktoken una sola vez.
+    Si tiktoken no está instalado, devuelve None (se usa la aproximación).
+
+    La primera carga lee (o descarga) el fichero BPE: es lenta y bloqueante,
+    por eso app.py la hace en el warmup, en un hilo (load_tokenizer).
+    """
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+
+                try:
+                    _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+                except KeyError:
+                    _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                print(f"[MEMORY] tiktoken no disponible, aproximando tokens: {e!r}")
+                _encoding = None
+            _encoding_loaded = True
+    return _encoding
+
+
+async def load_tokenizer() -> bool:
+    """
+    Carga el tokenizer fuera del event loop. True si hay tiktoken,
+    False si se va a usar la aproximación len/4.
+    """
+    return await asyncio.to_thread(_get_encoding) is not None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Nº de tokens de un texto (aprox. len/4 si no hay tiktoken).
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(msg: Message) -> int:
+    """
+    Tokens de un mensaje. Se cuentan una sola vez y se guardan en
+    msg["tokens"] (viaja con la sesión al serializarla).
+    """
+    tokens = msg.get("tokens")
+    if tokens is None:
+        tokens = count_tokens(msg["content"]) + _MESSAGE_OVERHEAD_TOKENS
+        msg["tokens"] = tokens
+    return tokens
+
+
+def history_tokens(messages: List[Message]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+# --- Historial renderizado como texto ---
+
+# (etiqueta de user, etiqueta de assistant)
+LabelScheme = Tuple[str, str]
+
+USER_AGENT_LABELS: LabelScheme = ("Usuario", "Agente")
+SELLER_BUYER_LABELS: LabelScheme = ("Vendedor", "Comprador")
+
+EMPTY_TRANSCRIPT = "(sin mensajes previos relevantes)"
+
+
+def _render_line(msg: Message, labels: LabelScheme) -> str:
+    label = labels[0] if msg["role"] == "user" else labels[1]
+    return f"{label}: {msg['content']}"
+
+
+def format_messages(messages: List[Message], labels: LabelScheme) -> str:
+    """
+    Convierte una lista de mensajes cualquiera en texto etiquetado.
+    """
+    lines = [_render_line(msg, labels) for msg in messages]
+    return "\n".join(lines).strip() or EMPTY_TRANSCRIPT
+
+
+def render_history(state: SessionState, labels: LabelScheme, start: int = 0) -> str:
+    """
+    Igual que format_messages(state.history[start:], labels), pero
+    incremental: cada mensaje se formatea una sola vez (state.transcripts)
+    y solo se une la ventana visible, que además se reutiliza si no ha
+    cambiado. Nunca se recorre ni se copia el historial entero.
+    Solo se rehace todo si history se ha recortado (los recortes siempre
+    asignan una lista nueva a state.history).
+    """
+    history = state.history
+    key = "/".join(labels)
+    cache = state.transcripts.get(key)
+    if cache is None or cache.history is not history or len(cache.lines) > len(history):
+        cache = state.transcripts[key] = RenderedTranscript(history=history)
+
+    for msg in history[len(cache.lines):]:
+        cache.lines.append(_render_line(msg, labels))
+
+    count = len(cache.lines)
+    if start >= count:
+        return EMPTY_TRANSCRIPT
+    if cache.window_start != start or cache.window_count != count:
+        cache.window_text = "\n".join(cache.lines[max(0, start):]).rstrip()
+        cache.window_start = start
+        cache.window_count = count
+    return cache.window_text or EMPTY_TRANSCRIPT
+
+
+# --- Ventana de contexto por presupuesto de tokens ---
+
+class ContextWindow:
+    """
+    Ventana de historial reciente medida en tokens (no en turnos):
+
+    - trigger_tokens: si el historial supera esto, toca resumir. También es
+      el máximo de historial que entra en el prompt mientras el resumen
+      no está listo.
+    - keep_tokens: lo que se conserva "entero" tras resumir.
+    - hard_max_tokens: techo duro del historial guardado en la sesión. Si
+      el resumen de fondo no da abasto (cola llena, errores del LLM), lo
+      que pase de aquí se descarta sin resumir. 0 = 4 x trigger_tokens.
+
+    Los cortes siempre caen al inicio de un turno de usuario, y el último
+    turno de usuario se conserva aunque él solo supere el presupuesto.
+    """
+
+    def __init__(self, trigger_tokens: int, keep_tokens: int, hard_max_tokens: int = 0) -> None:
+        self.trigger_tokens = max(1, trigger_tokens)
+        self.keep_tokens = max(1, min(keep_tokens, self.trigger_tokens))
+        self.hard_max_tokens = max(self.trigger_tokens, hard_max_tokens or 4 * self.trigger_tokens)
+
+    def _tail_start(self, history: List[Message], budget: int) -> int:
+        """
+        Índice donde empieza la cola más larga de history que cabe en
+        `budget` tokens y empieza en un mensaje de usuario.
+        """
+        start = len(history)
+        used = 0
+        for i in range(len(history) - 1, -1, -1):
+            used += message_tokens(history[i])
+            if used > budget:
+                break
+            if history[i]["role"] == "user":
+                start = i
+
+        if start == len(history):
+            # Ni el último turno cabe: lo conservamos igualmente
+            user_indices = [i for i, m in enumerate(history) if m["role"] == "user"]
+            start = user_indices[-1] if user_indices else 0
+        return start
+
+    def needs_summary(self, history: List[Message]) -> bool:
+        return history_tokens(history) > self.trigger_tokens
+
+    def split_for_summary(
+        self,
+        history: List[Message],
+    ) -> Optional[Tuple[List[Message], List[Message]]]:
+        """
+        (prefix, suffix) si hay que resumir: prefix va al resumen,
+        suffix (<= keep_tokens) se queda en el historial. None si no toca.
+        """
+        if not self.needs_summary(history):
+            return None
+        start = self._tail_start(history, self.keep_tokens)
+        if start == 0:
+            return None
+        return history[:start], history[start:]
+
+    def visible_start(self, history: List[Message]) -> int:
+        """
+        Índice desde el que el historial entra en el prompt (<= trigger_tokens).
+        """
+        if not self.needs_summary(history):
+            return 0
+        return self._tail_start(history, self.trigger_tokens)
+
+    def visible_history(self, history: List[Message]) -> List[Message]:
+        return history[self.visible_start(history):]
+
+
+CONTEXT_WINDOW = ContextWindow(
+    trigger_tokens=int(os.getenv("CONTEXT_TRIGGER_TOKENS", DEFAULT_CONTEXT_TRIGGER_TOKENS)),
+    keep_tokens=int(os.getenv("KEEP_RECENT_TOKENS", DEFAULT_KEEP_RECENT_TOKENS)),
+    hard_max_tokens=int(os.getenv("HISTORY_HARD_MAX_TOKENS", "0")),
+)
+
+
+def enforce_history_ceiling(state: SessionState, window: ContextWindow = CONTEXT_WINDOW) -> int:
+    """
+    Aplica el techo duro de tokens a state.history (recorta sin resumir).
+    Devuelve cuántos mensajes se han descartado.
+    """
+    if history_tokens(state.history) <= window.hard_max_tokens:
+        return 0
+    kept = window.visible_history(state.history)
+    dropped = len(state.history) - len(kept)
+    if dropped:
+        print(f"[MEMORY] Techo de tokens superado en {state.session_id}: {dropped} mensajes descartados sin resumir")
+        state.history = kept
+        _SUMMARY_STATS["dropped_messages"] += dropped
+    return dropped
+
+
+# --- Resumen (summarizing) ---
+
+# Modelo de resumen (puede ser más pequeño/barato)
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL_NAME", "gpt-4o-mini")
+SUMMARY_TEMPERATURE = float(os.getenv("SUMMARY_TEMPERATURE", "0.2"))
+
+# Modelo para resumir (memoria comprimida de sesión)
+summary_llm = ChatOpenAI(
+    model=SUMMARY_MODEL,
+    temperature=SUMMARY_TEMPERATURE,
+)
+
+summary_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", SUMMARY_SYSTEM_PROMPT),
+        ("user", SUMMARY_USER_PROMPT),
+    ]
+)
+
+# Cómo se renderiza un bloque de mensajes para el resumidor. Cada agente
+# pasa su propio esquema de etiquetas (Usuario/Agente, Vendedor/Comprador).
+MessageFormatter = Callable[[List[Message]], str]
+
+
+async def summarize_block(
+    existing_summary: str,
+    prefix_messages: List[Message],
+    format_messages: MessageFormatter,
+) -> str:
+    """
+    Resume el bloque 'prefix_messages' integrándolo en el resumen existente
+    (esquema JSON de SUMMARY_USER_PROMPT). No toca ningún estado.
+    """
+    new_block = format_messages(prefix_messages)
+
+    messages = summary_prompt.format_messages(
+        existing_summary=existing_summary,
+        new_block=new_block,
+    )
+
+    result = await summary_llm.ainvoke(messages)
+    return result.content.strip()
+
+
+# ---- Resumen en segundo plano ----
+#
+# El resumen no se hace dentro del turno (sería una llamada extra al LLM
+# en la latencia del usuario). Al terminar un turno se lanza una tarea de
+# fondo; el siguiente turno usa el resumen nuevo si ya está y, si no, el
+# historial visible de la ventana.
+
+# Máximo de resúmenes pendientes a la vez en el proceso
+SUMMARY_MAX_PENDING: int = int(os.getenv("SUMMARY_MAX_PENDING", "16"))
+
+# Una tarea como mucho por sesión
+_PENDING_SUMMARIES: Dict[Tuple[str, str], asyncio.Task] = {}
+_SUMMARY_STATS = {
+    "completed": 0,
+    "discarded": 0,
+    "skipped": 0,
+    "failed": 0,
+    "dropped_messages": 0,
+}
+
+
+async def _background_summarize(
+    user_id: str,
+    session_id: str,
+    format_messages: MessageFormatter,
+    window: ContextWindow,
+) -> None:
+    # 1) Foto del prefijo a resumir (con el lock, sin llamar al LLM)
+    async with session_lock(user_id, session_id):
+        state = await afind_session_state(user_id, session_id)
+        split = window.split_for_summary(state.history) if state else None
+        if split is None:
+            return
+        prefix = list(split[0])
+        existing_summary = state.summary or ""
+
+    # 2) Llamada al LLM fuera del lock: los turnos siguen mientras tanto
+    new_summary = await summarize_block(existing_summary, prefix, format_messages)
+
+    # 3) Aplicar solo si nadie ha tocado resumen ni prefijo entretanto
+    async with session_lock(user_id, session_id):
+        state = await afind_session_state(user_id, session_id)
+        if (
+            state is None
+            or (state.summary or "") != existing_summary
+            or state.history[:len(prefix)] != prefix
+        ):
+            _SUMMARY_STATS["discarded"] += 1
+            return
+
+        state.summary = new_summary
+        state.history = state.history[len(prefix):]
+        await asave_session_state(state)
+        _SUMMARY_STATS["completed"] += 1
+
+
+def _on_summary_done(key: Tuple[str, str], task: asyncio.Task) -> None:
+    _PENDING_SUMMARIES.pop(key, None)
+    if not task.cancelled() and task.exception() is not None:
+        _SUMMARY_STATS["failed"] += 1
+        print(f"[SUMMARY] Error resumiendo sesión {key}: {task.exception()!r}")
+
+
+def schedule_background_summary(
+    state: SessionState,
+    format_messages: MessageFormatter,
+    window: ContextWindow = CONTEXT_WINDOW,
+) -> None:
+    """
+    Lanza el resumen de la sesión en segundo plano si hace falta,
+    no hay ya uno en curso para ella y no se supera SUMMARY_MAX_PENDING.
+    """
+    if window.split_for_summary(state.history) is None:
+        return
+
+    key = (state.user_id, state.session_id)
+    if key in _PENDING_SUMMARIES:
+        return
+    if len(_PENDING_SUMMARIES) >= SUMMARY_MAX_PENDING:
+        # Se reintentará al final del próximo turno
+        _SUMMARY_STATS["skipped"] += 1
+        return
+
+    task = asyncio.create_task(_background_summarize(*key, format_messages, window))
+    _PENDING_SUMMARIES[key] = task
+    task.add_done_callback(lambda t: _on_summary_done(key, t))
+
+
+def summary_stats() -> Dict[str, int]:
+    return {"pending": len(_PENDING_SUMMARIES), **_SUMMARY_STATS}
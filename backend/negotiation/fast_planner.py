@@ -0,0 +1,184 @@
+# backend/negotiation/fast_planner.py
+from __future__ import annotations
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+# ---- Planner rápido basado en reglas ----
+#
+# Delante del planner LLM: si la fase es evidente (el vendedor pone precio,
+# se está cerrando el trato, la fase actual acaba de empezar...) devolvemos
+# la decisión sin llamar al modelo.
+#
+# Modos (PLANNER_FAST_PATH):
+# - "off":    solo el planner LLM.
+# - "shadow": siempre el LLM, pero se calcula la regla y se mide el acuerdo.
+# - "on":     si la regla supera el umbral de confianza, se salta el LLM.
+
+PLANNER_FAST_PATH = os.getenv("PLANNER_FAST_PATH", "shadow").lower()
+
+# Confianza mínima para saltarse el LLM en modo "on"
+PLANNER_FAST_PATH_THRESHOLD = float(os.getenv("PLANNER_FAST_PATH_THRESHOLD", "0.8"))
+
+# Turnos mínimos en una fase antes de plantearse cambiarla
+PLANNER_MIN_TURNS_PER_PHASE = int(os.getenv("PLANNER_MIN_TURNS_PER_PHASE", "2"))
+
+# Índices de las fases del plan base (ver BASE_NEGOTIATION_PLAN)
+CONCESSIONS_PHASE = 3
+RECAP_PHASE = 4
+
+# Cantidad de dinero ("8.500 €", "9 mil", "300 euros"), salvo que sea otra
+# cosa: "120 mil kilómetros", "2.000 euros de extras"...
+_AMOUNT_RE = re.compile(
+    r"(?:\b\d{1,3}(?:[.\s]?\d{3})*(?:,\d+)?\s*(?:€|euros?\b|eur\b|pavos\b|k\b|mil\b)"
+    r"|€\s*\d)"
+    r"(?!\s*(?:km\b|kms\b|kil[oó]metros\b|(?:de |en )?extras\b))",
+    re.IGNORECASE,
+)
+
+# Formas de poner precio u oferta encima de la mesa
+_OFFER_RE = re.compile(
+    r"\b(?:precio|oferta|ofrezco|ofreces|contraoferta|rebaja|rebajar|rebajo|descuento"
+    r"|negociable|te lo dejo|lo dejo en|te lo vendo|lo vendo por|pido|pedir|me das"
+    r"|último precio|cuánto (?:me )?ofreces|cuánto das|cuánto pagarías|por menos de)\b",
+    re.IGNORECASE,
+)
+
+_CLOSING_RE = re.compile(
+    r"\b(?:trato hecho|cerramos|cerrar el trato|acepto|aceptado|firmamos"
+    r"|nos lo quedamos|te lo quedas|es tuyo|hay trato)\b",
+    re.IGNORECASE,
+)
+
+# Negación en las palabras justo antes de la fórmula de cierre, dentro de
+# la misma frase: "no acepto", "no hay trato", "ni de broma firmamos"...
+_NEGATION_RE = re.compile(r"\b(?:no|ni|nunca|jam[aá]s|tampoco)\b", re.IGNORECASE)
+_NEGATION_WINDOW_WORDS = 3
+_CLAUSE_BREAK_RE = re.compile(r"[,;:.!?¡¿\n]")
+# Fin de frase (el punto de miles de "9.500" no cuenta)
+_SENTENCE_END_RE = re.compile(r"[!?\n]|\.(?!\d)")
+
+
+def _is_closing(message: str) -> bool:
+    """
+    True si alguna fórmula de cierre es afirmativa: ni negada
+    ("no hay trato") ni dentro de una pregunta ("¿cerramos en 9.500?").
+    """
+    for match in _CLOSING_RE.finditer(message):
+        before, after = message[:match.start()], message[match.end():]
+
+        # Pregunta: "¿" abierto antes, o la frase termina en "?"
+        if before.rfind("¿") > before.rfind("?"):
+            continue
+        sentence_end = _SENTENCE_END_RE.search(after)
+        if sentence_end and sentence_end.group() == "?":
+            continue
+
+        clause = _CLAUSE_BREAK_RE.split(before)[-1]
+        if _NEGATION_RE.search(" ".join(clause.split()[-_NEGATION_WINDOW_WORDS:])):
+            continue
+        return True
+    return False
+
+
+# (nuevo índice, confianza 0-1, motivo)
+FastPlan = Tuple[int, float, str]
+
+
+def _turns_in_current_phase(step_results: List[Tuple[str, str]], phase_name: str) -> int:
+    turns = 0
+    for name, _ in reversed(step_results):
+        if name != phase_name:
+            break
+        turns += 1
+    return turns
+
+
+def fast_plan(
+    plan: List[str],
+    current_idx: int,
+    user_message: str,
+    step_results: List[Tuple[str, str]],
+    phase_done: bool,
+) -> Optional[FastPlan]:
+    """
+    Decide la fase con reglas baratas. None si no hay plan.
+    """
+    if not plan:
+        return None
+
+    last = len(plan) - 1
+    current_idx = max(0, min(current_idx, last))
+    message = user_message or ""
+    # Solo cuenta como oferta si hay forma de oferta, no una cifra suelta
+    talks_price = bool(_OFFER_RE.search(message))
+    has_amount = bool(_AMOUNT_RE.search(message))
+
+    # 1) Primer turno: siempre se empieza creando clima
+    if not step_results and current_idx == 0 and not talks_price:
+        return 0, 0.95, "inicio de la negociación"
+
+    # 2) Cierre explícito cuando ya se está negociando precio
+    if current_idx >= CONCESSIONS_PHASE and _is_closing(message):
+        return min(RECAP_PHASE, last), 0.85, "el vendedor acepta o cierra el trato"
+
+    # 3) Precios / ofertas sobre la mesa
+    if current_idx >= CONCESSIONS_PHASE and (talks_price or has_amount):
+        return current_idx, 0.9, "se sigue negociando precio"
+    if talks_price:
+        # Saltar de fase con reglas es arriesgado: confianza por debajo del
+        # umbral por defecto, que decida el LLM
+        confidence = 0.75 if has_amount else 0.65
+        return min(CONCESSIONS_PHASE, last), confidence, "el vendedor pone precio u oferta"
+
+    turns = _turns_in_current_phase(step_results, plan[current_idx])
+
+    # 4) Fase recién empezada y no cumplida: se mantiene
+    if not phase_done and turns < PLANNER_MIN_TURNS_PER_PHASE:
+        return current_idx, 0.9, f"fase recién empezada ({turns} turnos)"
+
+    # 5) Fase no cumplida: probablemente se mantiene
+    if not phase_done:
+        return current_idx, 0.75, "el ejecutor aún no da la fase por cumplida"
+
+    # 6) Fase cumplida: probablemente se avanza (el LLM decide mejor)
+    return min(current_idx + 1, last), 0.6, "el ejecutor dio la fase por cumplida"
+
+
+# ---- Métricas ----
+
+_FAST_PATH_STATS = {
+    "decisions": 0,
+    "llm_skipped": 0,
+    "shadow_compared": 0,
+    "shadow_agreed": 0,
+}
+
+
+def record_fast_path(skipped_llm: bool) -> None:
+    _FAST_PATH_STATS["decisions"] += 1
+    if skipped_llm:
+        _FAST_PATH_STATS["llm_skipped"] += 1
+
+
+def record_agreement(fast_idx: int, llm_idx: int) -> None:
+    """
+    Compara una decisión de reglas confiada con la del LLM.
+    """
+    _FAST_PATH_STATS["shadow_compared"] += 1
+    if fast_idx == llm_idx:
+        _FAST_PATH_STATS["shadow_agreed"] += 1
+
+
+def fast_path_stats() -> Dict[str, float]:
+    compared = _FAST_PATH_STATS["shadow_compared"]
+    decisions = _FAST_PATH_STATS["decisions"]
+    return {
+        "mode": PLANNER_FAST_PATH,
+        "threshold": PLANNER_FAST_PATH_THRESHOLD,
+        **_FAST_PATH_STATS,
+        "agreement_rate": _FAST_PATH_STATS["shadow_agreed"] / compared if compared else 0.0,
+        "skip_rate": _FAST_PATH_STATS["llm_skipped"] / decisions if decisions else 0.0,
+    }
@@ -0,0 +1,101 @@
+# backend/negotiation/local_embeddings.py
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import re
+import unicodedata
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+
+# ---- Embeddings locales (CPU, sin red) para el RAG de técnicas ----
+#
+# Vectorizador TF con "hashing trick": cada palabra (y cada par de palabras
+# seguidas) va a una de `dim` posiciones según su hash blake2b, con signo
+# también sacado del hash para que las colisiones se compensen. Peso
+# sublineal (1 + log tf) y normalización L2, así FAISS (L2) ordena igual
+# que por coseno.
+#
+# Sin IDF a propósito: el vector de un documento no depende del resto del
+# corpus, así el índice incremental (solo se re-embeben los docs cambiados)
+# sigue siendo coherente. Las palabras vacías se descartan en su lugar.
+
+LOCAL_EMBEDDINGS_DIM = int(os.getenv("LOCAL_EMBEDDINGS_DIM", "2048"))
+
+_WORD_RE = re.compile(r"\w+")
+
+# Palabras vacías en español (más las de la plantilla de la query del RAG)
+_STOPWORDS = frozenset(
+    """
+    a al algo ante antes aqui asi aun bien cada como con contra cual cuando de
+    del desde donde durante e el ella ellas ello ellos en entre era es esa ese
+    eso esta estaba estan estar este esto estos fue ha hay la las le les lo los
+    mas me mi mis mucho muy nada ni no nos o os otra otro para pero poco por
+    porque que quien se sea segun ser si sin sobre solo son su sus tambien te
+    tiene tu tus un una uno unos y ya yo
+    fase contexto reciente objetivo resumen historial actual vendedor comprador
+    """.split()
+)
+
+
+def _normalize_word(word: str) -> str:
+    # Sin tildes: "señales" y "senales", "aún" y "aun" cuentan igual
+    decomposed = unicodedata.normalize("NFKD", word.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _terms(text: str) -> List[str]:
+    words = [
+        w
+        for w in (_normalize_word(w) for w in _WORD_RE.findall(text or ""))
+        if len(w) > 1 and w not in _STOPWORDS and not w.isdigit()
+    ]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class HashedTfEmbeddings(Embeddings):
+    """
+    Embeddings locales deterministas (mismo texto = mismo vector,
+    en cualquier proceso y arranque).
+    """
+
+    def __init__(self, dim: int = LOCAL_EMBEDDINGS_DIM) -> None:
+        self.dim = max(16, dim)
+
+    @property
+    def model_id(self) -> str:
+        # Va al manifest del índice: cambiar dim obliga a reconstruirlo
+        return f"local-hashed-tf-{self.dim}"
+
+    def _embed(self, text: str) -> List[float]:
+        counts: Dict[int, float] = {}
+        for term in _terms(text):
+            digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            slot = value % self.dim
+            sign = 1.0 if value >> 63 else -1.0
+            counts[slot] = counts.get(slot, 0.0) + sign
+
+        vector = [0.0] * self.dim
+        for slot, tf in counts.items():
+            if tf:
+                vector[slot] = math.copysign(1.0 + math.log(abs(tf)), tf)
+
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Es CPU puro y muy rápido: sin saltar a un hilo
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self._embed(text)
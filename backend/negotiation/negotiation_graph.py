@@ -3,23 +3,62 @@ from __future__ import annotations
 
 import json
 import os
-from typing import List, Tuple
+import re
+import asyncio
+import contextlib
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl  # lock entre procesos del índice (solo POSIX)
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
 
 from dotenv import load_dotenv
 from typing_extensions import TypedDict
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import SystemMessage, HumanMessage
 
 from prompts import BASE_PERSONALITY_PROMPT
-from state import SessionState, Message, add_message, save_session_state
+from state import SessionState, Message, TechniqueMemo, add_message, asave_session_state
+from memory import (
+    CONTEXT_WINDOW,
+    SELLER_BUYER_LABELS,
+    count_tokens,
+    enforce_history_ceiling,
+    format_messages,
+    render_history,
+    schedule_background_summary,
+)
 
-from normalizer import normalize_text
+from normalizer import GENERATION_STYLE_RULES, normalize_text
+from negotiation.fast_planner import (
+    PLANNER_FAST_PATH,
+    PLANNER_FAST_PATH_THRESHOLD,
+    fast_plan,
+    record_agreement,
+    record_fast_path,
+)
+from negotiation.rag_cache import (
+    aembed_query_cached,
+    context_vector,
+    lookup_technique_memo,
+    store_technique_memo,
+)
 
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from negotiation.local_embeddings import HashedTfEmbeddings
 
 
 load_dotenv()
@@ -28,6 +67,12 @@ load_dotenv()
 
 EMBEDDINGS_MODEL = os.getenv("EMBEDDINGS_MODEL_NAME", "text-embedding-3-small")
 
+# Proveedor de embeddings del RAG:
+# - "openai": EMBEDDINGS_MODEL vía API (por defecto).
+# - "local":  vectorizador TF con hashing en CPU (local_embeddings.py), sin red.
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "openai").lower()
+EMBEDDINGS_BACKENDS = ("openai", "local")
+
 # Directorio por defecto donde estarán los .md/.txt de técnicas
 DEFAULT_RAG_DIR = os.path.join(
     os.path.dirname(__file__),
@@ -36,19 +81,102 @@ DEFAULT_RAG_DIR = os.path.join(
 
 RAG_DIR = os.getenv("NEGOTIATION_RAG_DIR", DEFAULT_RAG_DIR)
 
+# Índice FAISS persistido (save_local/load_local) + manifest con el hash de cada doc
+DEFAULT_RAG_INDEX_DIR = os.path.join(
+    os.path.dirname(__file__),
+    "rag_index",
+)
 
-def _load_negotiation_rag_index():
+RAG_INDEX_ROOT = os.getenv("NEGOTIATION_RAG_INDEX_DIR", DEFAULT_RAG_INDEX_DIR)
+
+# Un índice por proveedor: cambiar de uno a otro no obliga a re-embeber
+RAG_INDEX_DIR = os.path.join(RAG_INDEX_ROOT, EMBEDDINGS_BACKEND)
+RAG_MANIFEST_NAME = "manifest.json"
+
+# Tag con el que marcamos la llamada principal del ejecutor, para poder
+# distinguir sus tokens (streaming) de los del planner o el normalizador.
+EXECUTOR_STREAM_TAG = "negotiation_executor_reply"
+
+# Tag del ejecutor especulativo: sus tokens solo se muestran si el planner
+# confirma la fase (si no, se descartan).
+EXECUTOR_SPECULATIVE_TAG = "negotiation_executor_speculative"
+
+# Modo especulativo (opt-in): el ejecutor arranca para la fase actual a la
+# vez que el planner. Si el planner mantiene la fase, ahorramos una llamada
+# entera al LLM en la latencia del turno; si la cambia, se cancela y se
+# relanza con la fase nueva.
+SPECULATIVE_EXECUTOR = os.getenv("NEGOTIATION_SPECULATIVE_EXECUTOR", "0") == "1"
+
+# Marcador de la línea interna que el ejecutor añade al final de su mensaje.
+PLAN_STATE_MARKER = "PLAN_STATE:"
+
+# Nº máximo de entradas de progreso (step_results) que guardamos en la sesión
+MAX_STEP_RESULTS = int(os.getenv("NEGOTIATION_MAX_STEP_RESULTS", "20"))
+
+# Recuperación especulativa: mientras el planner decide, el RAG busca técnicas
+# para la fase actual y para las N fases a cada lado.
+RAG_SPECULATIVE_RADIUS = int(os.getenv("RAG_SPECULATIVE_RADIUS", "1"))
+
+# Troceado por secciones "## ..." de los .md. Si cambia la forma de trocear,
+# se sube la versión y el índice guardado se reconstruye entero.
+RAG_CHUNKING_VERSION = "sections-v1"
+
+# Secciones candidatas por búsqueda (ya filtradas a la fase) y presupuesto
+# de tokens del bloque de técnicas que se mete en el prompt del ejecutor.
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_FETCH_K = int(os.getenv("RAG_FETCH_K", "40"))
+RAG_MAX_TOKENS = int(os.getenv("RAG_MAX_TOKENS", "450"))
+
+_PHASE_FILE_RE = re.compile(r"fase_(\d+)", re.IGNORECASE)
+_SECTION_RE = re.compile(r"^##\s+(.+?)\s*$", re.MULTILINE)
+
+
+def _phase_index_from_filename(filename: str) -> Optional[int]:
     """
-    Carga todos los .md/.txt de RAG_DIR en un vector store FAISS.
-    Cada documento es un Document(page_content=texto, metadata={"filename": ...}).
-    Si no hay carpeta o no hay docs, devuelve None.
+    "fase_2_descubrir.md" -> 1 (índice en BASE_NEGOTIATION_PLAN). None si no aplica.
     """
-    if not os.path.isdir(RAG_DIR):
-        print(f"[RAG] Directorio no encontrado: {RAG_DIR}. Usaré fallback simple.")
-        return None
+    match = _PHASE_FILE_RE.search(filename)
+    return int(match.group(1)) - 1 if match else None
 
-    docs: List[Document] = []
-    for filename in os.listdir(RAG_DIR):
+
+def _split_sections(text: str) -> List[Tuple[str, str]]:
+    """
+    Trocea un .md por sus cabeceras "## ". Devuelve [(sección, texto)],
+    donde cada texto lleva delante el título del documento ("# ...") para
+    que el fragmento se entienda solo. Sin cabeceras, un único trozo.
+    """
+    lines = text.splitlines()
+    title = lines[0].lstrip("# ").strip() if lines and lines[0].startswith("# ") else ""
+    matches = list(_SECTION_RE.finditer(text))
+    if not matches:
+        return [(title, text)]
+
+    sections: List[Tuple[str, str]] = []
+    # Texto entre el título y la primera sección (si lo hay)
+    intro = text[:matches[0].start()].strip()
+    if intro and intro.lstrip("# ").strip() != title:
+        sections.append((title, intro))
+
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        body = text[match.start():end].strip()
+        if not body[match.end() - match.start():].strip():
+            continue  # cabecera sin contenido
+        header = f"# {title}\n" if title else ""
+        sections.append((match.group(1), header + body))
+    return sections
+
+
+def _read_phase_docs() -> Dict[str, Tuple[str, List[Document]]]:
+    """
+    Lee los .md/.txt de RAG_DIR. Devuelve {filename: (hash, [Document])},
+    con el hash sha256 del contenido para saber qué ha cambiado.
+
+    Cada archivo se trocea por secciones; cada Document lleva en metadata
+    la fase (phase_hint / phase_index) y el nombre de la sección.
+    """
+    docs_by_file: Dict[str, Tuple[str, List[Document]]] = {}
+    for filename in sorted(os.listdir(RAG_DIR)):
         if not filename.lower().endswith((".md", ".txt")):
             continue
         path = os.path.join(RAG_DIR, filename)
@@ -60,33 +188,324 @@ def _load_negotiation_rag_index():
 
             # Inferimos la fase a partir del nombre de archivo (opcional)
             phase_hint = filename.replace(".md", "").replace(".txt", "")
-            docs.append(
-                Document(
-                    page_content=text,
-                    metadata={
-                        "filename": filename,
-                        "phase_hint": phase_hint,
-                    },
-                )
+            phase_index = _phase_index_from_filename(filename)
+            content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            docs_by_file[filename] = (
+                content_hash,
+                [
+                    Document(
+                        page_content=chunk,
+                        metadata={
+                            "filename": filename,
+                            "phase_hint": phase_hint,
+                            "phase_index": phase_index,
+                            "section": section,
+                        },
+                    )
+                    for section, chunk in _split_sections(text)
+                ],
             )
         except Exception as e:
             print(f"[RAG] Error leyendo {path}: {e}")
+    return docs_by_file
+
+
+def _doc_ids(filename: str, content_hash: str, docs: List[Document]) -> List[str]:
+    return [f"{filename}#{content_hash[:16]}#{i}" for i in range(len(docs))]
+
+
+def get_embeddings(backend: str = EMBEDDINGS_BACKEND) -> Embeddings:
+    """
+    Proveedor de embeddings según EMBEDDINGS_BACKEND (openai si no se reconoce).
+    """
+    if backend == "local":
+        return HashedTfEmbeddings()
+    if backend != "openai":
+        print(f"[RAG] EMBEDDINGS_BACKEND desconocido ({backend!r}), uso openai.")
+    return OpenAIEmbeddings(model=EMBEDDINGS_MODEL)
+
+
+def embeddings_model_id(embeddings: Embeddings) -> str:
+    """
+    Identificador del modelo de embeddings (manifest del índice y caché de queries).
+    """
+    return getattr(embeddings, "model_id", None) or getattr(embeddings, "model", EMBEDDINGS_MODEL)
+
+
+def _load_manifest() -> Dict:
+    try:
+        with open(os.path.join(RAG_INDEX_DIR, RAG_MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+RAG_INDEX_FILES = ("index.faiss", "index.pkl")
+
+
+def _save_index(vs: FAISS, manifest: Dict) -> None:
+    """
+    Guarda índice + manifest. Se escribe todo en una carpeta temporal y
+    luego se mueve con os.replace: primero se retira el manifest, después
+    los ficheros del índice y el manifest nuevo el último. Si algo falla a
+    medias, no queda un manifest que case con ficheros a medio escribir y
+    el siguiente arranque re-embebe.
+
+    Se llama con _index_dir_lock() cogido (varios workers).
+    """
+    try:
+        os.makedirs(RAG_INDEX_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=RAG_INDEX_DIR)
+        try:
+            vs.save_local(tmp_dir)
+            with open(os.path.join(tmp_dir, RAG_MANIFEST_NAME), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+            path = os.path.join(RAG_INDEX_DIR, RAG_MANIFEST_NAME)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            for name in RAG_INDEX_FILES:
+                os.replace(os.path.join(tmp_dir, name), os.path.join(RAG_INDEX_DIR, name))
+            os.replace(os.path.join(tmp_dir, RAG_MANIFEST_NAME), path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception as e:
+        print(f"[RAG] No se pudo guardar el índice en {RAG_INDEX_DIR}: {e}")
+
+
+@contextlib.contextmanager
+def _index_dir_lock() -> Iterator[None]:
+    """
+    Lock de fichero (flock) sobre RAG_INDEX_DIR: con varios workers de
+    uvicorn solo uno carga/actualiza/guarda el índice a la vez; el resto
+    espera y luego lo carga de disco ya al día, sin re-embeber.
+    Sin fcntl (Windows) o sin permisos en la carpeta, no bloquea.
+    """
+    try:
+        os.makedirs(RAG_INDEX_DIR, exist_ok=True)
+        lock_file = open(os.path.join(RAG_INDEX_DIR, ".lock"), "a")
+    except OSError as e:
+        print(f"[RAG] Sin lock del índice en {RAG_INDEX_DIR}: {e}")
+        lock_file = None
+
+    if lock_file is None or fcntl is None:
+        yield
+        return
+
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _build_full_index(docs_by_file: Dict[str, Tuple[str, List[Document]]], embeddings: Embeddings) -> FAISS:
+    docs: List[Document] = []
+    ids: List[str] = []
+    for filename, (content_hash, file_docs) in docs_by_file.items():
+        docs.extend(file_docs)
+        ids.extend(_doc_ids(filename, content_hash, file_docs))
+    return FAISS.from_documents(docs, embeddings, ids=ids)
+
+
+def _reload_saved_index(embeddings: Embeddings) -> Optional[FAISS]:
+    """
+    Vuelve a cargar de disco el índice guardado (el que casa con el manifest).
+    """
+    try:
+        return FAISS.load_local(
+            RAG_INDEX_DIR,
+            embeddings,
+            allow_dangerous_deserialization=True,  # ficheros generados por nosotros
+        )
+    except Exception as e:
+        print(f"[RAG] No se pudo recargar el índice guardado: {e!r}")
+        return None
+
+
+def _load_negotiation_rag_index():
+    """
+    Carga el vector store FAISS de técnicas de negociación.
+
+    - Embeddings del proveedor EMBEDDINGS_BACKEND ("openai" o "local").
+    - Si hay un índice guardado en RAG_INDEX_DIR (uno por proveedor) con el
+      mismo modelo de embeddings y el mismo troceado, se carga de disco
+      (sin llamadas de red).
+    - Solo se (re)embeben los documentos nuevos o cuyo contenido ha cambiado
+      (hash sha256 en el manifest); los borrados se quitan del índice.
+    - Si no hay carpeta o no hay docs, devuelve None.
+    - Entre procesos, la carga/actualización va bajo _index_dir_lock().
+    """
+    if not os.path.isdir(RAG_DIR):
+        print(f"[RAG] Directorio no encontrado: {RAG_DIR}. Usaré fallback simple.")
+        return None
 
-    if not docs:
+    docs_by_file = _read_phase_docs()
+    if not docs_by_file:
         print(f"[RAG] No se encontraron documentos de técnicas en {RAG_DIR}.")
         return None
 
-    try:
-        embeddings = OpenAIEmbeddings(model=EMBEDDINGS_MODEL)
-        vs = FAISS.from_documents(docs, embeddings)
-        print(f"[RAG] Index de negociación cargado con {len(docs)} documentos.")
+    with _index_dir_lock():
+        return _sync_saved_index(docs_by_file)
+
+
+def _sync_saved_index(docs_by_file: Dict[str, Tuple[str, List[Document]]]) -> Optional[FAISS]:
+    """
+    Carga el índice guardado y lo pone al día con docs_by_file.
+    Se llama con _index_dir_lock() cogido.
+    """
+    embeddings = get_embeddings()
+    model_id = embeddings_model_id(embeddings)
+
+    # 1) Índice guardado (si es del mismo modelo de embeddings y troceado)
+    vs = None
+    manifest = _load_manifest()
+    indexed: Dict[str, Dict] = {}
+    if (
+        manifest.get("embeddings_model") == model_id
+        and manifest.get("chunking") == RAG_CHUNKING_VERSION
+    ):
+        vs = _reload_saved_index(embeddings)
+        if vs is not None:
+            indexed = manifest.get("docs", {})
+
+    # 2) Diferencias con los docs actuales
+    stale_ids: List[str] = []
+    for filename, entry in indexed.items():
+        if docs_by_file.get(filename, (None,))[0] != entry.get("hash"):
+            stale_ids.extend(entry.get("ids", []))
+
+    changed = {
+        filename: (content_hash, docs)
+        for filename, (content_hash, docs) in docs_by_file.items()
+        if indexed.get(filename, {}).get("hash") != content_hash
+    }
+
+    if vs is not None and not stale_ids and not changed:
+        print(
+            f"[RAG] Índice de negociación cargado de disco ({len(indexed)} documentos, "
+            f"{len(vs.index_to_docstore_id)} secciones)."
+        )
         return vs
+
+    # 3) Re-embeber solo lo nuevo/cambiado. Primero se embebe (lo que puede
+    #    fallar: red, cuota...) sin tocar el índice cargado: si falla, sigue
+    #    igual que el de disco y su manifest.
+    new_docs: List[Document] = []
+    new_ids: List[str] = []
+    for filename, (content_hash, docs) in changed.items():
+        new_docs.extend(docs)
+        new_ids.extend(_doc_ids(filename, content_hash, docs))
+
+    texts = [d.page_content for d in new_docs]
+    try:
+        vectors = embeddings.embed_documents(texts) if texts else []
     except Exception as e:
+        if vs is not None and indexed:
+            print(f"[RAG] Error embebiendo docs nuevos ({e}); uso el índice guardado tal cual.")
+            return vs
         print(f"[RAG] Error creando el índice FAISS: {e}")
         return None
 
+    # 4) Aplicar los cambios. Si algo falla a medias, el índice en memoria ya
+    #    no es fiable: reconstrucción completa (o, si tampoco se puede, el
+    #    índice de disco recargado limpio).
+    try:
+        text_embeddings = list(zip(texts, vectors))
+        metadatas = [d.metadata for d in new_docs]
+        if vs is None or len(stale_ids) == len(vs.index_to_docstore_id):
+            vs = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=new_ids)
+        else:
+            if stale_ids:
+                vs.delete(stale_ids)
+            if new_docs:
+                vs.add_embeddings(text_embeddings, metadatas=metadatas, ids=new_ids)
+    except Exception as e:
+        print(f"[RAG] Error actualizando el índice ({e!r}), se reconstruye entero.")
+        try:
+            vs = _build_full_index(docs_by_file, embeddings)
+            changed, stale_ids = docs_by_file, []
+        except Exception as e:
+            print(f"[RAG] Error reconstruyendo el índice FAISS: {e}")
+            return _reload_saved_index(embeddings) if indexed else None
+
+    # 5) Solo con todo bien se guardan índice + manifest
+    manifest = {
+        "embeddings_model": model_id,
+        "chunking": RAG_CHUNKING_VERSION,
+        "docs": {
+            filename: {
+                "hash": content_hash,
+                "ids": _doc_ids(filename, content_hash, docs),
+            }
+            for filename, (content_hash, docs) in docs_by_file.items()
+        },
+    }
+    _save_index(vs, manifest)
+
+    print(
+        f"[RAG] Index de negociación ({model_id}) listo con {len(docs_by_file)} documentos "
+        f"({len(vs.index_to_docstore_id)} secciones; {len(changed)} docs embebidos, "
+        f"{len(stale_ids)} fragmentos retirados)."
+    )
+    return vs
+
+
+def has_phase_docs() -> bool:
+    """
+    True si RAG_DIR tiene documentos de fases (es decir, si un índice
+    None es un fallo y no la falta de documentos).
+    """
+    try:
+        return any(
+            name.lower().endswith((".md", ".txt")) for name in os.listdir(RAG_DIR)
+        )
+    except OSError:
+        return False
+
+
+# El índice se carga en el primer uso (o en el warmup de la app),
+# nunca al importar este módulo.
+_RAG_INDEX = None
+_RAG_INDEX_LOADED = False
+_RAG_INDEX_LOCK = threading.Lock()
 
-NEGOTIATION_RAG_INDEX = _load_negotiation_rag_index()
+# Si la carga falla habiendo docs (red, cuota...), no se da por cargado:
+# se reintenta, como mucho cada RAG_INDEX_RETRY_S segundos.
+RAG_INDEX_RETRY_S = float(os.getenv("RAG_INDEX_RETRY_S", "30"))
+_RAG_INDEX_FAILED_AT: Optional[float] = None
+
+
+def get_negotiation_rag_index():
+    """
+    Índice FAISS de técnicas (None si no hay docs o falló la carga).
+    Bloqueante: desde el event loop usar aget_negotiation_rag_index.
+    """
+    global _RAG_INDEX, _RAG_INDEX_LOADED, _RAG_INDEX_FAILED_AT
+    if not _RAG_INDEX_LOADED:
+        with _RAG_INDEX_LOCK:
+            if _RAG_INDEX_LOADED:
+                return _RAG_INDEX
+            if (
+                _RAG_INDEX_FAILED_AT is not None
+                and time.monotonic() - _RAG_INDEX_FAILED_AT < RAG_INDEX_RETRY_S
+            ):
+                return None
+
+            _RAG_INDEX = _load_negotiation_rag_index()
+            if _RAG_INDEX is None and has_phase_docs():
+                _RAG_INDEX_FAILED_AT = time.monotonic()
+            else:
+                _RAG_INDEX_LOADED = True
+                _RAG_INDEX_FAILED_AT = None
+    return _RAG_INDEX
+
+
+async def aget_negotiation_rag_index():
+    if _RAG_INDEX_LOADED:
+        return _RAG_INDEX
+    return await asyncio.to_thread(get_negotiation_rag_index)
 
 
 # ---- Modelos para planner y ejecutor ----
@@ -149,26 +568,39 @@ class PlanExecute(TypedDict):
     current_step_index: int
     step_results: List[Tuple[str, str]]
 
+    # phase_done del PLAN_STATE del último turno del ejecutor
+    phase_done: bool
+
+    # Técnicas RAG ya recuperadas por índice de fase (nodo retriever)
+    phase_techniques: Dict[int, str]
+
+    # Memo de técnicas de la sesión (SessionState.technique_memo, mismo dict)
+    technique_memo: Dict[int, TechniqueMemo]
+
     response: str
 
 
 # ---- Utilidades internas ----
 
-def _ensure_plan_initialized(state: PlanExecute) -> None:
+def _plan_initialization(state: PlanExecute) -> PlanExecute:
     """
-    Si aún no hay objetivo/plan, los inicializa.
+    Si aún no hay objetivo/plan, devuelve la actualización que los inicializa.
     """
+    update: PlanExecute = {}
+
     if not state.get("objective"):
-        state["objective"] = (
+        update["objective"] = (
             "Conseguir comprar este coche de segunda mano por un coste total "
             "inferior a 10.000€ (precio + posibles gastos), manteniendo una "
             "relación cordial con el vendedor."
         )
 
     if not state.get("plan"):
-        state["plan"] = BASE_NEGOTIATION_PLAN.copy()
-        state["current_step_index"] = 0
-        state["step_results"] = []
+        update["plan"] = BASE_NEGOTIATION_PLAN.copy()
+        update["current_step_index"] = 0
+        update["step_results"] = []
+
+    return update
 
 
 def _get_current_phase(state: PlanExecute) -> str:
@@ -189,26 +621,34 @@ def _format_messages_as_text(messages: List[Message]) -> str:
     Convierte la lista de mensajes en texto etiquetado,
     vista desde fuera: user = Vendedor, assistant = Comprador.
     """
-    lines: List[str] = []
-    for msg in messages:
-        role = msg["role"]
-        label = "Vendedor" if role == "user" else "Comprador"
-        lines.append(f"{label}: {msg['content']}")
-    return "\n".join(lines).strip() or "(sin mensajes previos relevantes)"
+    return format_messages(messages, SELLER_BUYER_LABELS)
 
 
 # ---- Hook para RAG de técnicas (stub, lo conectarás tú) ----
 
-def get_phase_techniques(phase_name: str, context: str) -> str:
+async def get_phase_techniques(
+    phase_name: str,
+    context: str,
+    phase_index: Optional[int] = None,
+    embedding: Optional[List[float]] = None,
+) -> str:
     """
     Recupera técnicas específicas de negociación para la fase actual
     usando un vector store (RAG) sobre documentos locales.
 
     - phase_name: nombre de la fase actual (ej. "Fase 2 – Preguntar y descubrir...")
     - context: resumen + historial reciente (por si queremos usarlo en la query)
+    - phase_index: índice de la fase en el plan; si se da, se buscan primero
+      solo secciones de esa fase (si no hay ninguna, se busca en todas).
+    - embedding: vector de la query ya calculado (el del contexto del turno,
+      compartido entre fases); si no se da, se embebe fase + contexto.
+
+    Devuelve las secciones más relevantes que quepan en RAG_MAX_TOKENS.
     """
+    rag_index = await aget_negotiation_rag_index()
+
     # Si el índice no está disponible, usamos el fallback simple
-    if NEGOTIATION_RAG_INDEX is None:
+    if rag_index is None:
         return (
             f"[RAG FALLBACK] Técnicas recomendadas para {phase_name}:\n"
             "- Haz preguntas abiertas y escucha con atención.\n"
@@ -228,27 +668,53 @@ Objetivo: recuperar técnicas concretas para actuar en esta fase.
 """
 
     try:
-        # Buscamos los documentos más relevantes
-        docs = NEGOTIATION_RAG_INDEX.similarity_search(query, k=3)
+        # Un solo embedding de la query (con LRU) para las dos búsquedas
+        if embedding is None:
+            embedding = await aembed_query_cached(
+                rag_index.embedding_function,
+                embeddings_model_id(rag_index.embedding_function),
+                query,
+            )
+
+        # Buscamos las secciones más relevantes, primero dentro de la fase
+        docs: List[Document] = []
+        if phase_index is not None:
+            docs = await rag_index.asimilarity_search_by_vector(
+                embedding,
+                k=RAG_TOP_K,
+                filter={"phase_index": phase_index},
+                fetch_k=RAG_FETCH_K,
+            )
+        if not docs:
+            docs = await rag_index.asimilarity_search_by_vector(embedding, k=RAG_TOP_K)
 
         if not docs:
             return (
                 f"[RAG VACÍO] No se encontraron técnicas específicas para {phase_name}. "
                 "Usa tu criterio general de negociación."
             )
-        
-        # DEBUG: ver qué docs se han usado
-        print("\n[RAG] Fase:", phase_name)
-        for d in docs:
-            print("  - Doc:", d.metadata.get("filename"), "| phase_hint:", d.metadata.get("phase_hint"))
-        print("----------\n", flush=True)
-        
-        # Concatenamos fragmentos relevantes
+
+        # Secciones por orden de relevancia mientras quepan en el presupuesto
+        # (la primera entra siempre, aunque sea larga).
         snippets: List[str] = []
+        used_tokens = 0
         for d in docs:
-            # Podemos incluir filename como referencia interna (no se mostrará al usuario directamente)
             snippet = d.page_content.strip()
+            tokens = count_tokens(snippet)
+            if snippets and used_tokens + tokens > RAG_MAX_TOKENS:
+                continue
             snippets.append(snippet)
+            used_tokens += tokens
+
+        # DEBUG: ver qué secciones se han usado
+        print("\n[RAG] Fase:", phase_name, f"({len(snippets)}/{len(docs)} secciones, ~{used_tokens} tokens)")
+        for d in docs:
+            print(
+                "  - Doc:", d.metadata.get("filename"),
+                "| phase_hint:", d.metadata.get("phase_hint"),
+                "| sección:", d.metadata.get("section"),
+            )
+        print("----------\n", flush=True)
 
         joined = "\n\n---\n\n".join(snippets)
         header = f"Técnicas de apoyo para {phase_name} (RAG):\n"
@@ -262,17 +728,142 @@ Objetivo: recuperar técnicas concretas para actuar en esta fase.
         )
 
 
+def _rag_context(state: PlanExecute) -> str:
+    """
+    Contexto simplificado para la query del RAG. No lleva el nombre de la
+    fase: el mismo embedding sirve para buscar en todas (filtrando por
+    phase_index).
+    """
+    summary_text = state.get("summary") or "Aún no hay resumen de la conversación."
+    history_text = state.get("history_text") or "(sin historial reciente)"
+    objective = state.get("objective") or ""
+    return f"""
+Resumen: {summary_text}
+Historial reciente:
+{history_text}
+
+Objetivo de la negociación: {objective}
+"""
+
+
+async def _embed_rag_context(context: str) -> Optional[List[float]]:
+    """
+    Embedding (con LRU) del contexto del turno. None si no hay índice o
+    falla: get_phase_techniques ya devuelve su fallback/error.
+    """
+    rag_index = await aget_negotiation_rag_index()
+    if rag_index is None:
+        return None
+    try:
+        return await aembed_query_cached(
+            rag_index.embedding_function,
+            embeddings_model_id(rag_index.embedding_function),
+            context,
+        )
+    except Exception as e:
+        print(f"[RAG] Error embebiendo el contexto: {e}")
+        return None
+
+
+async def _techniques_for_phases(state: PlanExecute, indices: List[int]) -> Dict[int, str]:
+    """
+    get_phase_techniques para varias fases con el memo de la sesión: si ya
+    se buscó una fase y la conversación (resumen + historial) no ha
+    derivado, se reutiliza el resultado. Para las que faltan, el contexto
+    se embebe una sola vez y se lanza una búsqueda filtrada por fase.
+    """
+    plan = state["plan"]
+    memo = state.get("technique_memo")
+    # La deriva se mide solo sobre lo que cambia entre turnos (no la plantilla)
+    vector = context_vector(f"{state.get('summary') or ''}\n{state.get('history_text') or ''}")
+
+    results: Dict[int, str] = {}
+    if memo is not None:
+        for i in indices:
+            cached = lookup_technique_memo(memo, i, vector)
+            if cached is not None:
+                print("[RAG] Técnicas memorizadas para:", plan[i])
+                results[i] = cached
+
+    missing = [i for i in indices if i not in results]
+    if missing:
+        context = _rag_context(state)
+        embedding = await _embed_rag_context(context)
+        fetched = await asyncio.gather(
+            *(get_phase_techniques(plan[i], context, i, embedding=embedding) for i in missing)
+        )
+        for i, techniques in zip(missing, fetched):
+            # Los textos de fallback/error no se memorizan: se reintenta el próximo turno
+            if memo is not None and not techniques.startswith("[RAG "):
+                store_technique_memo(memo, i, vector, techniques)
+            results[i] = techniques
+
+    return {i: results[i] for i in indices}
+
+
+# ---- Nodo PREPARE (inicializa objetivo/plan) ----
+
+def prepare_node(state: PlanExecute) -> PlanExecute:
+    """
+    Inicializa objetivo y plan si hace falta, antes de que planner y
+    retriever arranquen en paralelo (ambos necesitan el plan).
+    """
+    return _plan_initialization(state)
+
+
+# ---- Nodo RETRIEVER (RAG especulativo, en paralelo con el planner) ----
+
+async def retriever_node(state: PlanExecute) -> PlanExecute:
+    """
+    Recupera técnicas para la fase actual y las adyacentes mientras el
+    planner decide, así la latencia del RAG queda escondida tras la
+    llamada al planner. El executor usa la de la fase elegida.
+    """
+    plan = state.get("plan") or []
+    if not plan:
+        return {"phase_techniques": {}}
+
+    current_idx = max(0, min(state.get("current_step_index", 0), len(plan) - 1))
+    indices = [
+        i
+        for i in range(current_idx - RAG_SPECULATIVE_RADIUS, current_idx + RAG_SPECULATIVE_RADIUS + 1)
+        if 0 <= i < len(plan)
+    ]
+
+    return {"phase_techniques": await _techniques_for_phases(state, indices)}
+
 
 # ---- Nodo PLANNER (decide fase) ----
 
-def planner_node(state: PlanExecute) -> PlanExecute:
+async def planner_node(state: PlanExecute) -> PlanExecute:
     """
     Decide en qué fase del plan debemos estar ahora.
-    """
+    Devuelve solo el nuevo current_step_index (corre en paralelo con el retriever).
 
-    _ensure_plan_initialized(state)
+    Primero prueba el planner de reglas (fast_planner); en modo "on" y con
+    confianza suficiente, no se llama al LLM.
+    """
 
     plan = state["plan"]
+
+    fast = None
+    if PLANNER_FAST_PATH in ("shadow", "on"):
+        fast = fast_plan(
+            plan,
+            state.get("current_step_index", 0),
+            state.get("user_message") or "",
+            state.get("step_results") or [],
+            bool(state.get("phase_done")),
+        )
+
+    fast_confident = fast is not None and fast[1] >= PLANNER_FAST_PATH_THRESHOLD
+    if PLANNER_FAST_PATH == "on" and fast_confident:
+        record_fast_path(skipped_llm=True)
+        new_idx, confidence, reason = fast
+        print("\n[PLANNER] Fase elegida (reglas):", new_idx, "-", plan[new_idx])
+        print(f"[PLANNER] Reason: {reason} (confianza {confidence:.2f})")
+        print("----------\n", flush=True)
+        return {"current_step_index": new_idx}
     plan_text = _format_plan(plan)
     current_phase = _get_current_phase(state)
 
@@ -379,7 +970,7 @@ Responde SOLO con un JSON del tipo:
         plan_text=plan_text,
     )
 
-    result = planner_llm.invoke(messages)
+    result = await planner_llm.ainvoke(messages)
     raw = (result.content or "").strip()
 
     reason = "(sin reason parseable)"
@@ -395,25 +986,33 @@ Responde SOLO con un JSON del tipo:
     else:
         new_idx = 0
 
-    state["current_step_index"] = new_idx
+    if fast is not None:
+        record_fast_path(skipped_llm=False)
+        if fast_confident:
+            record_agreement(fast[0], new_idx)
 
     # DEBUG: ver fase elegida y motivo
-    phase_name = _get_current_phase(state)
+    phase_name = plan[new_idx] if plan else "Fase desconocida"
     print("\n[PLANNER] Fase elegida:", new_idx, "-", phase_name)
     print("[PLANNER] Reason:", reason)
     print("----------\n", flush=True)
 
-    return state
-    
+    return {"current_step_index": new_idx}
+
 
 # ---- Nodo EXECUTOR (responde como Daniel-comprador) ----
 
-def executor_node(state: PlanExecute) -> PlanExecute:
+async def executor_node(state: PlanExecute) -> PlanExecute:
+    return await _run_executor(state, EXECUTOR_STREAM_TAG)
+
+
+async def _run_executor(state: PlanExecute, stream_tag: str) -> PlanExecute:
     """
     Genera la respuesta del comprador al vendedor para la fase actual.
 
     - Usa el resumen estratégico + historial reciente + mensaje actual.
-    - Consulta el RAG (manual interno) para la fase actual.
+    - Usa las técnicas RAG ya recuperadas para la fase actual (o las busca
+      si el planner ha saltado fuera de las especuladas).
     - Devuelve la respuesta de Daniel-comprador.
     - Extrae de PLAN_STATE:
         - step_summary: qué se ha avanzado en esta fase en este turno.
@@ -421,8 +1020,6 @@ def executor_node(state: PlanExecute) -> PlanExecute:
     - NO cambia el índice de fase aquí; el planner decide la fase en el siguiente turno.
     """
 
-    _ensure_plan_initialized(state)
-
     summary_text = state.get("summary") or "Aún no hay resumen de la conversación."
     history_text = state.get("history_text") or "(sin historial reciente)"
     user_message = state.get("user_message") or ""
@@ -432,20 +1029,16 @@ def executor_node(state: PlanExecute) -> PlanExecute:
     plan_text = _format_plan(plan)
     current_phase = _get_current_phase(state)
 
-    # Contexto simplificado para el RAG
-    rag_context = f"""
-Resumen: {summary_text}
-Historial reciente:
-{history_text}
-
-Fase actual: {current_phase}
-Objetivo de la negociación: {objective}
-"""
-
-    techniques_text = get_phase_techniques(current_phase, rag_context)
+    # Técnicas RAG: normalmente ya las trae el retriever
+    techniques_text = (state.get("phase_techniques") or {}).get(state["current_step_index"])
+    if techniques_text is None:
+        print("[RAG] Fase fuera de la recuperación especulativa, buscando ahora:", current_phase)
+        idx = state["current_step_index"]
+        techniques_text = (await _techniques_for_phases(state, [idx]))[idx]
 
     executor_system = f"""
 {BASE_PERSONALITY_PROMPT}
+{GENERATION_STYLE_RULES}
 
 <scene_context>
 Escenario de la negociación:
@@ -552,7 +1145,7 @@ Tarea:
         HumanMessage(content=executor_user),
     ]
 
-    result = executor_llm.invoke(messages)
+    result = await executor_llm.ainvoke(messages, config={"tags": [stream_tag]})
     full_text = (result.content or "").strip()
 
     # DEBUG: ver qué genera el ejecutor ANTES de separar PLAN_STATE
@@ -564,11 +1157,12 @@ Tarea:
     visible_text = full_text
     step_summary = ""
     phase_done = False
+    step_results = list(state.get("step_results") or [])
 
     try:
-        if "PLAN_STATE:" in full_text:
+        if PLAN_STATE_MARKER in full_text:
             # Usamos la ÚLTIMA aparición por si el modelo lo repite
-            before, after = full_text.rsplit("PLAN_STATE:", 1)
+            before, after = full_text.rsplit(PLAN_STATE_MARKER, 1)
             visible_text = before.strip()
             state_part = after.strip()
 
@@ -582,10 +1176,8 @@ Tarea:
                 phase_done = bool(data.get("phase_done", False))
 
         # Actualizar progreso de fase (solo notas internas)
-        current_phase_name = _get_current_phase(state)
         if step_summary:
-            state.setdefault("step_results", [])
-            state["step_results"].append((current_phase_name, step_summary))
+            step_results = step_results + [(current_phase, step_summary)]
 
         # IMPORTANTÍSIMO:
         # Aquí NO cambiamos current_step_index.
@@ -597,46 +1189,121 @@ Tarea:
 
     # ➊ Normalizamos SOLO la parte visible al vendedor,
     #    sin el bloque PLAN_STATE y sin tocar step_summary/phase_done.
-    normalized_response = normalize_text(visible_text or full_text, user_message)
+    normalized_response = await normalize_text(visible_text or full_text, user_message)
 
     print("\n===== NORMALIZED_EXECUTOR_OUTPUT =====")
     print(normalized_response)
     print("===== END_NORMALIZED_EXECUTOR_OUTPUT =====\n", flush=True)
 
-    state["response"] = normalized_response
-    return state
+    return {
+        "response": normalized_response,
+        "step_results": step_results,
+        "phase_done": phase_done,
+    }
+
+
 
 
 
+# ---- Nodo SPECULATIVE (planner || ejecutor especulativo) ----
+
+_SPECULATION_STATS = {"hits": 0, "misses": 0}
+
+
+def speculation_stats() -> Dict[str, float]:
+    total = _SPECULATION_STATS["hits"] + _SPECULATION_STATS["misses"]
+    return {
+        "enabled": SPECULATIVE_EXECUTOR,
+        **_SPECULATION_STATS,
+        "hit_rate": _SPECULATION_STATS["hits"] / total if total else 0.0,
+    }
+
+
+async def speculative_node(state: PlanExecute) -> PlanExecute:
+    """
+    Planner, retriever y un ejecutor especulativo (fase actual) a la vez.
+
+    - Si el planner mantiene la fase: se usa la respuesta especulativa.
+    - Si la cambia: se cancela y se ejecuta de nuevo con la fase elegida.
+
+    El streaming se entera del veredicto por el canal "custom"
+    ({"speculation": "hit" | "miss"}) para soltar o tirar lo acumulado.
+    """
+    write = get_stream_writer()
+    current_idx = state["current_step_index"]
+
+    planner_task = asyncio.create_task(planner_node(state))
+    retriever_task = asyncio.create_task(retriever_node(state))
+
+    async def speculate() -> PlanExecute:
+        # shield: si la especulación se cancela (fallo), el retriever sigue
+        # vivo, que lo necesita el ejecutor relanzado
+        retrieved = await asyncio.shield(retriever_task)
+        return await _run_executor(
+            {**state, **retrieved},
+            EXECUTOR_SPECULATIVE_TAG,
+        )
+
+    speculative_task = asyncio.create_task(speculate())
+    tasks = (planner_task, retriever_task, speculative_task)
+
+    try:
+        planned = await planner_task
+        new_idx = planned["current_step_index"]
+
+        if new_idx == current_idx:
+            _SPECULATION_STATS["hits"] += 1
+            write({"speculation": "hit"})
+            executed = await speculative_task
+        else:
+            _SPECULATION_STATS["misses"] += 1
+            print(f"[SPECULATION] Fallo: fase {current_idx} -> {new_idx}, relanzando ejecutor")
+            speculative_task.cancel()
+            write({"speculation": "miss"})
+            retrieved = await retriever_task
+            executed = await _run_executor(
+                {**state, **planned, **retrieved},
+                EXECUTOR_STREAM_TAG,
+            )
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    return {**planned, **retriever_task.result(), **executed}
 
 
 # ---- Construcción del grafo LangGraph ----
 
 workflow = StateGraph(PlanExecute)
 
-workflow.add_node("planner", planner_node)
-workflow.add_node("executor", executor_node)
-
-workflow.add_edge(START, "planner")
-workflow.add_edge("planner", "executor")
-workflow.add_edge("executor", END)
+workflow.add_node("prepare", prepare_node)
+workflow.add_edge(START, "prepare")
+
+if SPECULATIVE_EXECUTOR:
+    # prepare -> (planner || retriever || ejecutor especulativo)
+    workflow.add_node("speculative", speculative_node)
+    workflow.add_edge("prepare", "speculative")
+    workflow.add_edge("speculative", END)
+else:
+    # prepare -> (planner || retriever) -> executor
+    workflow.add_node("planner", planner_node)
+    workflow.add_node("retriever", retriever_node)
+    workflow.add_node("executor", executor_node)
+    workflow.add_edge("prepare", "planner")
+    workflow.add_edge("prepare", "retriever")
+    workflow.add_edge(["planner", "retriever"], "executor")
+    workflow.add_edge("executor", END)
 
 negotiation_app = workflow.compile()
 
 
 # ---- Función de alto nivel: usar el grafo con SessionState ----
 
-def run_negotiation_agent(
-    state: SessionState,
-    user_message: str,
-) -> Tuple[str, SessionState]:
+def _build_graph_state(state: SessionState, user_message: str) -> PlanExecute:
     """
-    Ejecuta un turno de negociación:
-    - Añade el mensaje del vendedor al historial.
-    - Construye el estado para LangGraph.
-    - Pasa por planner + executor.
-    - Guarda objetivo/plan/fase/progreso en SessionState.
-    - Añade la respuesta del comprador al historial.
+    Añade el mensaje del vendedor al historial y construye
+    el estado inicial del grafo a partir del SessionState.
     """
 
     # 1) Añadir mensaje del vendedor al historial
@@ -644,10 +1311,14 @@ def run_negotiation_agent(
 
     # 2) Construir textos de contexto
     summary_text = state.summary or "Aún no hay resumen de la conversación."
-    history_text = _format_messages_as_text(state.history)
+    history_text = render_history(
+        state,
+        SELLER_BUYER_LABELS,
+        start=CONTEXT_WINDOW.visible_start(state.history),
+    )
 
     # 3) Estado inicial para el grafo
-    graph_state: PlanExecute = {
+    return {
         "summary": summary_text,
         "history_text": history_text,
         "user_message": user_message,
@@ -655,24 +1326,161 @@ def run_negotiation_agent(
         "plan": state.negotiation_plan,
         "current_step_index": state.current_step_index,
         "step_results": state.step_results,
+        "phase_done": state.phase_done,
+        "phase_techniques": {},
+        "technique_memo": state.technique_memo,
         "response": "",
     }
 
-    # 4) Ejecutar grafo (planner + executor)
-    new_graph_state = negotiation_app.invoke(graph_state)
 
-    # 5) Volcar cambios de vuelta al SessionState
+async def _apply_graph_result(state: SessionState, new_graph_state: PlanExecute) -> str:
+    """
+    Vuelca el resultado del grafo en el SessionState, añade la respuesta
+    del comprador al historial y guarda el estado.
+    """
     state.negotiation_objective = new_graph_state["objective"]
     state.negotiation_plan = new_graph_state["plan"]
+    if new_graph_state["current_step_index"] != state.current_step_index:
+        # Cambio de fase: las técnicas memorizadas se vuelven a buscar
+        state.technique_memo.clear()
     state.current_step_index = new_graph_state["current_step_index"]
-    state.step_results = new_graph_state["step_results"]
+    # El progreso por fase también se acota (uno por turno crecería sin fin)
+    state.step_results = new_graph_state["step_results"][-MAX_STEP_RESULTS:]
+    state.phase_done = new_graph_state.get("phase_done", False)
 
     reply_text = new_graph_state["response"].strip()
 
-    # 6) Añadir respuesta del comprador al historial
+    # Añadir respuesta del comprador al historial
     add_message(state, role="assistant", content=reply_text)
 
-    # 7) Guardar estado
-    save_session_state(state)
+    # Techo duro de tokens del historial (por si el resumen no da abasto)
+    enforce_history_ceiling(state)
+
+    # Guardar estado
+    await asave_session_state(state)
+
+    # Resumen incremental en segundo plano (mismo esquema JSON que /chat)
+    schedule_background_summary(state, _format_messages_as_text)
+
+    return reply_text
+
+
+class _VisibleTextStream:
+    """
+    Filtra el streaming del ejecutor para no mostrar nunca la línea
+    PLAN_STATE. Retiene los últimos caracteres por si el marcador
+    llega partido entre dos fragmentos.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._emitted = 0
+        self._done = False
+
+    def feed(self, text: str) -> str:
+        if self._done:
+            return ""
+        self._buffer += text
+
+        marker_idx = self._buffer.find(PLAN_STATE_MARKER)
+        if marker_idx != -1:
+            self._done = True
+            out = self._buffer[self._emitted:marker_idx].rstrip()
+            self._emitted = marker_idx
+            return out
+
+        safe_end = len(self._buffer) - (len(PLAN_STATE_MARKER) - 1)
+        if safe_end <= self._emitted:
+            return ""
+        out = self._buffer[self._emitted:safe_end]
+        self._emitted = safe_end
+        return out
+
+    def flush(self) -> str:
+        if self._done:
+            return ""
+        self._done = True
+        return self._buffer[self._emitted:]
+
+
+async def run_negotiation_agent(
+    state: SessionState,
+    user_message: str,
+) -> Tuple[str, SessionState]:
+    """
+    Ejecuta un turno de negociación:
+    - Añade el mensaje del vendedor al historial.
+    - Construye el estado para LangGraph.
+    - Pasa por prepare -> (planner || retriever) -> executor.
+    - Guarda objetivo/plan/fase/progreso en SessionState.
+    - Añade la respuesta del comprador al historial.
+    """
+    graph_state = _build_graph_state(state, user_message)
+
+    # Ejecutar grafo
+    new_graph_state = await negotiation_app.ainvoke(graph_state)
+
+    reply_text = await _apply_graph_result(state, new_graph_state)
+    return reply_text, state
+
+
+async def stream_negotiation_agent(
+    state: SessionState,
+    user_message: str,
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Igual que run_negotiation_agent, pero emitiendo el texto del ejecutor
+    según se genera (sin la línea PLAN_STATE):
+
+    - ("delta", texto_parcial) por cada fragmento visible del ejecutor.
+    - ("final", respuesta_normalizada) al terminar el turno.
+    """
+    graph_state = _build_graph_state(state, user_message)
+
+    visible = _VisibleTextStream()
+    new_graph_state: PlanExecute = graph_state
+
+    # Tokens del ejecutor especulativo: se retienen hasta saber si el
+    # planner confirma la fase (None = veredicto pendiente).
+    speculative_buffer: List[str] = []
+    speculation: Optional[str] = None
+
+    async for mode, payload in negotiation_app.astream(
+        graph_state,
+        stream_mode=["messages", "values", "custom"],
+    ):
+        if mode == "values":
+            new_graph_state = payload
+            continue
+
+        if mode == "custom":
+            speculation = payload.get("speculation", speculation)
+            if speculation == "hit":
+                text = visible.feed("".join(speculative_buffer))
+                if text:
+                    yield "delta", text
+            speculative_buffer = []
+            continue
+
+        chunk, metadata = payload
+        tags = metadata.get("tags") or []
+        content = chunk.content or ""
+
+        if EXECUTOR_SPECULATIVE_TAG in tags:
+            if speculation is None:
+                speculative_buffer.append(content)
+                continue
+            if speculation != "hit":
+                continue
+        elif EXECUTOR_STREAM_TAG not in tags:
+            continue
+
+        text = visible.feed(content)
+        if text:
+            yield "delta", text
+
+    tail = visible.flush()
+    if tail:
+        yield "delta", tail
 
-    return reply_text, state
\ No newline at end of file
+    yield "final", await _apply_graph_result(state, new_graph_state)
@@ -0,0 +1,150 @@
+# backend/negotiation/rag_benchmark.py
+"""
+Benchmark de los proveedores de embeddings del RAG de técnicas.
+
+Desde backend/:
+
+    python -m negotiation.rag_benchmark                 # local + openai
+    python -m negotiation.rag_benchmark --backends local -k 3
+
+Para cada proveedor indexa las secciones de phase_docs (sin tocar el índice
+guardado) y lanza consultas etiquetadas con la fase a la que pertenecen.
+Las consultas van SIN nombre de fase y sin filtro, para medir solo lo que
+aporta el embedding:
+
+- recall@1 / recall@k: la fase correcta aparece en la 1ª / primeras k secciones.
+- mrr: rango recíproco medio de la primera sección de la fase correcta.
+- overlap@k vs openai: fracción de las k secciones de openai que también
+  devuelve el proveedor (si se han podido lanzar los dos).
+- build_s / query_ms: tiempo de indexado y latencia media (embedding + búsqueda).
+
+Si openai no responde (sin red o sin clave válida) se omite con un aviso.
+Ojo: importar el grafo ya exige OPENAI_API_KEY definida; para medir solo
+"local" sin red vale cualquier valor.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Dict, List, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+
+from negotiation.negotiation_graph import (
+    EMBEDDINGS_BACKENDS,
+    _doc_ids,
+    _read_phase_docs,
+    embeddings_model_id,
+    get_embeddings,
+)
+
+
+# (contexto de la conversación, índice de fase esperado)
+BENCHMARK_QUERIES: List[Tuple[str, int]] = [
+    ("Vendedor: Hola, buenas tardes. Pues este es el coche, échale un vistazo con calma.", 0),
+    ("Vendedor: Encantado. Lo tengo aparcado aquí desde esta mañana, ¿has venido de lejos?", 0),
+    ("Vendedor: Sí, sí, lo he cuidado mucho, es casi como de la familia.", 0),
+    ("Vendedor: Lo usaba sobre todo para ir a trabajar por autovía, unos 20.000 km al año.", 1),
+    ("Vendedor: Las revisiones las hacía siempre en el mismo taller, tengo todas las facturas.", 1),
+    ("Vendedor: Lo vendo porque me han trasladado y allí no necesito coche.", 1),
+    ("Vendedor: Necesito venderlo antes de fin de mes, pero tampoco quiero regalarlo.", 2),
+    ("Vendedor: Si te viene mejor, podría dejarte pasar por mi mecánico antes de cerrar nada.", 2),
+    ("Vendedor: Podría incluir las ruedas de invierno si eso te ayuda a decidirte.", 2),
+    ("Vendedor: Te lo dejo en 11.500, de ahí no puedo bajar mucho más.", 3),
+    ("Vendedor: Si me pagas en efectivo podría rebajarte unos 300 euros.", 3),
+    ("Vendedor: Tu oferta me parece muy baja, ¿cuánto podrías subir?", 3),
+    ("Vendedor: Vale, trato hecho, nos vemos el lunes en la gestoría para el cambio de nombre.", 4),
+    ("Vendedor: Perfecto entonces, 9.800 con la revisión hecha y las ruedas incluidas.", 4),
+    ("Vendedor: Pues ya está, quedamos así. Te mando los papeles por la mañana.", 4),
+]
+
+
+def _build_index(backend: str, docs_by_file) -> Tuple[FAISS, float]:
+    docs = [d for _, file_docs in docs_by_file.values() for d in file_docs]
+    ids = [
+        doc_id
+        for filename, (content_hash, file_docs) in docs_by_file.items()
+        for doc_id in _doc_ids(filename, content_hash, file_docs)
+    ]
+    start = time.perf_counter()
+    vs = FAISS.from_documents(docs, get_embeddings(backend), ids=ids)
+    return vs, time.perf_counter() - start
+
+
+def _run_backend(backend: str, docs_by_file, k: int) -> Optional[Dict]:
+    try:
+        vs, build_s = _build_index(backend, docs_by_file)
+    except Exception as e:
+        print(f"[BENCH] {backend}: no se pudo indexar ({e!r}), se omite.")
+        return None
+
+    embeddings = vs.embedding_function
+    fetch = max(k, len(vs.index_to_docstore_id))
+    hits_at_1 = hits_at_k = 0
+    reciprocal_ranks = 0.0
+    latencies: List[float] = []
+    top_ids: List[List[str]] = []
+
+    for query, expected in BENCHMARK_QUERIES:
+        start = time.perf_counter()
+        vector = embeddings.embed_query(query)
+        ranked = vs.similarity_search_by_vector(vector, k=fetch)
+        latencies.append(time.perf_counter() - start)
+
+        phases = [d.metadata.get("phase_index") for d in ranked]
+        hits_at_1 += phases[:1] == [expected]
+        hits_at_k += expected in phases[:k]
+        if expected in phases:
+            reciprocal_ranks += 1.0 / (phases.index(expected) + 1)
+        top_ids.append([d.id for d in ranked[:k]])
+
+    n = len(BENCHMARK_QUERIES)
+    return {
+        "backend": backend,
+        "model": embeddings_model_id(embeddings),
+        "sections": len(vs.index_to_docstore_id),
+        "build_s": build_s,
+        "query_ms": 1000 * sum(latencies) / n,
+        "recall@1": hits_at_1 / n,
+        f"recall@{k}": hits_at_k / n,
+        "mrr": reciprocal_ranks / n,
+        "_top_ids": top_ids,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backends", default=",".join(EMBEDDINGS_BACKENDS))
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    docs_by_file = _read_phase_docs()
+    if not docs_by_file:
+        print("[BENCH] No hay documentos de fases.")
+        return
+
+    results: Dict[str, Dict] = {}
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        result = _run_backend(backend, docs_by_file, args.k)
+        if result is not None:
+            results[backend] = result
+
+    reference = results.get("openai")
+    for result in results.values():
+        if reference is not None and result is not reference:
+            overlaps = [
+                len(set(ours) & set(theirs)) / len(theirs)
+                for ours, theirs in zip(result["_top_ids"], reference["_top_ids"])
+                if theirs
+            ]
+            result[f"overlap@{args.k}_vs_openai"] = sum(overlaps) / len(overlaps)
+
+        print(f"\n[BENCH] {result['backend']} ({result['model']})")
+        for key, value in result.items():
+            if key.startswith("_") or key in ("backend", "model"):
+                continue
+            print(f"  {key:>22}: {value:.4f}" if isinstance(value, float) else f"  {key:>22}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# backend/negotiation/rag_cache.py
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+from state import TechniqueMemo
+
+
+# ---- Cachés del RAG de técnicas ----
+#
+# Dos niveles para no embeber la query en cada turno:
+#
+# 1) Memo por sesión y fase (SessionState.technique_memo): si el contexto
+#    apenas ha cambiado desde la última búsqueda de esa fase (similitud léxica
+#    por encima del umbral), se reutilizan las técnicas sin llamar a la red.
+#    Viaja con la sesión (también en SQLite/Redis) y se vacía al cambiar de
+#    fase. Es el que ahorra embeddings de un turno a otro.
+# 2) LRU de embeddings de query por hash del contenido (sin espacios de
+#    más), compartida entre sesiones. El contexto no lleva la fase, así que
+#    dentro de un turno todas las fases (y la búsqueda tardía del ejecutor)
+#    comparten vector; entre turnos solo acierta con contextos idénticos
+#    (p. ej. el arranque de sesiones distintas), porque cada mensaje nuevo
+#    cambia el texto.
+
+# Nº máximo de embeddings de query en la LRU (0 = sin caché)
+RAG_QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "256"))
+
+# Similitud (coseno sobre frecuencias de palabras) mínima entre el contexto
+# actual y el de la última búsqueda para reutilizar las técnicas memorizadas.
+# 1.0 = solo con contexto idéntico; 0 = nunca se refresca.
+RAG_MEMO_MIN_SIMILARITY = float(os.getenv("RAG_MEMO_MIN_SIMILARITY", "0.8"))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+# ---- Deriva del contexto ----
+
+def context_vector(text: str) -> Dict[str, int]:
+    """
+    Bolsa de palabras (minúsculas) del contexto. Barata y sin red.
+    """
+    return dict(Counter(_WORD_RE.findall((text or "").lower())))
+
+
+def context_similarity(a: Dict[str, int], b: Dict[str, int]) -> float:
+    """
+    Coseno entre dos bolsas de palabras (0.0 si alguna está vacía).
+    """
+    if not a or not b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(count * b.get(word, 0) for word, count in a.items())
+    norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norm if norm else 0.0
+
+
+_MEMO_STATS = {
+    "hits": 0,
+    "misses": 0,
+    "drift_refreshes": 0,
+}
+
+
+def lookup_technique_memo(
+    memo: Dict[int, TechniqueMemo],
+    phase_index: int,
+    vector: Dict[str, int],
+) -> Optional[str]:
+    """
+    Técnicas memorizadas para la fase si el contexto no ha derivado
+    por debajo de RAG_MEMO_MIN_SIMILARITY. None = hay que buscar.
+    """
+    entry = memo.get(phase_index)
+    if entry is None:
+        _MEMO_STATS["misses"] += 1
+        return None
+    if context_similarity(entry.context_vector, vector) < RAG_MEMO_MIN_SIMILARITY:
+        _MEMO_STATS["drift_refreshes"] += 1
+        return None
+    _MEMO_STATS["hits"] += 1
+    return entry.text
+
+
+def store_technique_memo(
+    memo: Dict[int, TechniqueMemo],
+    phase_index: int,
+    vector: Dict[str, int],
+    text: str,
+) -> None:
+    memo[phase_index] = TechniqueMemo(text=text, context_vector=vector)
+
+
+# ---- LRU de embeddings de query ----
+
+class QueryEmbeddingCache:
+    """
+    LRU {sha256(modelo + query): vector}. Thread-safe (el índice también se
+    usa desde hilos vía to_thread).
+    """
+
+    def __init__(self, max_items: int) -> None:
+        self.max_items = max(0, max_items)
+        self._items: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, query: str) -> str:
+        # Los espacios/saltos de línea de la plantilla no cambian el vector
+        normalized = " ".join(query.split())
+        return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._items.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: str, vector: List[float]) -> None:
+        if self.max_items == 0:
+            return
+        with self._lock:
+            self._items[key] = vector
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_items": self.max_items,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+QUERY_EMBEDDING_CACHE = QueryEmbeddingCache(RAG_QUERY_CACHE_SIZE)
+
+
+async def aembed_query_cached(embeddings, model: str, query: str) -> List[float]:
+    """
+    embeddings.aembed_query pasando por la LRU.
+    """
+    key = QueryEmbeddingCache.key(model, query)
+    vector = QUERY_EMBEDDING_CACHE.get(key)
+    if vector is None:
+        vector = await embeddings.aembed_query(query)
+        QUERY_EMBEDDING_CACHE.put(key, vector)
+    return vector
+
+
+def rag_cache_stats() -> Dict[str, object]:
+    lookups = sum(_MEMO_STATS.values())
+    return {
+        "query_embeddings": QUERY_EMBEDDING_CACHE.stats(),
+        "technique_memo": {
+            "min_similarity": RAG_MEMO_MIN_SIMILARITY,
+            **_MEMO_STATS,
+            "hit_rate": _MEMO_STATS["hits"] / lookups if lookups else 0.0,
+        },
+    }
@@ -2,6 +2,8 @@
 from __future__ import annotations
 
 import os
+import re
+from typing import Dict, List
 
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
@@ -17,6 +19,14 @@ NORMALIZER_MODEL = os.getenv(
 
 NORMALIZER_TEMPERATURE = float(os.getenv("NORMALIZER_TEMPERATURE", "0.0"))
 
+# Modo de normalización:
+# - "llm":         siempre segunda llamada al normalizador (comportamiento original).
+# - "single_pass": el modelo principal ya genera con las reglas de estilo;
+#                  aquí solo se limpia en local y el LLM normalizador
+#                  entra solo si se detecta alguna infracción.
+NORMALIZER_MODE = os.getenv("NORMALIZER_MODE", "llm").lower()
+SINGLE_PASS = NORMALIZER_MODE == "single_pass"
+
 normalizer_llm = ChatOpenAI(
     model=NORMALIZER_MODEL,
     temperature=NORMALIZER_TEMPERATURE,
@@ -109,22 +119,163 @@ normalizer_prompt = ChatPromptTemplate.from_messages(
 
 
 
-def normalize_text(raw_reply: str, last_user_message: str | None = None) -> str:
+# ---- Modo single-pass: reglas en la generación + comprobación local ----
+
+# Reglas del normalizador resumidas para el prompt del modelo principal,
+# así la respuesta sale ya normalizada en la primera pasada.
+SINGLE_PASS_STYLE_RULES = """
+<single_pass_output>
+Tu respuesta se envía tal cual, sin revisión posterior. Antes de escribirla:
+- Máximo 2 frases; si cabe en muy pocas palabras, mejor.
+- Como mucho UNA pregunta, y siempre al final.
+- No empieces con validaciones ("vale", "ok", "claro", "entiendo", "perfecto", "tiene sentido"...).
+- Nada de relleno ni comentarios interpretativos ("eso suena bien", "me hago una idea"...).
+- No reformules lo que acaba de decir el usuario.
+- Si te preguntan algo concreto, respóndelo antes de preguntar tú.
+</single_pass_output>
+"""
+
+# Texto extra para el prompt de generación (vacío en modo "llm")
+GENERATION_STYLE_RULES = SINGLE_PASS_STYLE_RULES if SINGLE_PASS else ""
+
+_VALIDATION_WORDS = (
+    r"vale|ok|okay|claro|entiendo|perfecto|genial|estupendo|de acuerdo"
+    r"|tiene sentido|me alegra(?: saberlo| oírlo)?|bien|ya veo"
+)
+
+# Validaciones encadenadas al principio: "Vale, perfecto. ..."
+# (exigimos puntuación detrás para no tocar "Claro que sí" o "Bien hecho")
+_LEADING_VALIDATION_RE = re.compile(
+    rf"^(?:[¡!]?\s*(?:{_VALIDATION_WORDS})\s*[,.!:;…]+\s+)+",
+    re.IGNORECASE,
+)
+
+# Frases de relleno que el normalizador borraría
+_FILLER_RE = re.compile(
+    r"\b(?:me hago una idea|eso suena bien|suena bien|eso (?:ya )?da tranquilidad"
+    r"|eso suele venirle bien|tiene sentido|me alegra (?:saberlo|oírlo))\b",
+    re.IGNORECASE,
+)
+
+# Cosas que nunca deberían llegar al usuario
+_META_RE = re.compile(
+    r"PLAN_STATE|\bcomo (?:IA|inteligencia artificial|modelo de lenguaje|asistente)\b",
+    re.IGNORECASE,
+)
+
+# Fin de frase: puntuación que NO está entre dos dígitos ("8.500", "2.5" no cortan)
+_SENTENCE_END_RE = re.compile(r"(?<!\d)[.!?…]+|[.!?…]+(?!\d)")
+_DIGIT_RE = re.compile(r"\d")
+
+_NORMALIZER_STATS = {"local_only": 0, "llm_fallback": 0}
+_VIOLATION_COUNTS: Dict[str, int] = {}
+
+
+def _split_sentences(text: str) -> List[str]:
+    sentences: List[str] = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def local_normalize(text: str) -> str:
+    """
+    Post-procesado barato sin LLM:
+    - quita validaciones al principio ("Vale, claro. ...").
+    - quita frases de puro relleno que no son preguntas (nunca las que
+      llevan cifras: precios, kilómetros...).
+    """
+    text = " ".join((text or "").split())
+
+    stripped = _LEADING_VALIDATION_RE.sub("", text)
+    if stripped:
+        text = stripped[0].upper() + stripped[1:]
+
+    sentences = _split_sentences(text)
+    kept = [
+        s
+        for s in sentences
+        if "?" in s or _DIGIT_RE.search(s) or not _FILLER_RE.search(s)
+    ]
+    if kept and len(kept) < len(sentences):
+        text = " ".join(kept)
+    return text
+
+
+def find_style_violations(text: str) -> List[str]:
+    """
+    Reglas de estilo que se pueden comprobar en local. Lista vacía = OK.
+    """
+    violations: List[str] = []
+    if not text:
+        return ["empty"]
+
+    if len(_split_sentences(text)) > 2:
+        violations.append("too_many_sentences")
+    questions = text.count("?")
+    if questions > 1:
+        violations.append("multiple_questions")
+    if questions and text.rstrip(" \"'”»)").rfind("?") != len(text.rstrip(" \"'”»)")) - 1:
+        violations.append("question_not_last")
+    if _LEADING_VALIDATION_RE.match(text + " "):
+        violations.append("leading_validation")
+    if _FILLER_RE.search(text):
+        violations.append("filler")
+    if _META_RE.search(text):
+        violations.append("meta")
+    return violations
+
+
+def normalizer_stats() -> Dict[str, object]:
+    return {
+        "mode": NORMALIZER_MODE,
+        **_NORMALIZER_STATS,
+        "violations": dict(_VIOLATION_COUNTS),
+    }
+
+
+async def normalize_text(raw_reply: str, last_user_message: str | None = None) -> str:
     """
     Normaliza una respuesta del modelo principal:
     - reescribe estilo
     - mantiene significado
     - devuelve máx. 1–2 frases
+
+    En modo single_pass solo llama al LLM si la limpieza local no basta.
     """
     raw_reply = (raw_reply or "").strip()
     if not raw_reply:
         return ""
 
+    if SINGLE_PASS:
+        cleaned = local_normalize(raw_reply)
+        violations = find_style_violations(cleaned)
+        if not violations:
+            _NORMALIZER_STATS["local_only"] += 1
+            return cleaned
+
+        _NORMALIZER_STATS["llm_fallback"] += 1
+        for v in violations:
+            _VIOLATION_COUNTS[v] = _VIOLATION_COUNTS.get(v, 0) + 1
+        print(f"[NORMALIZER] Infracciones {violations}, paso por el LLM normalizador")
+        raw_reply = cleaned
+
+    return await _llm_normalize(raw_reply, last_user_message)
+
+
+async def _llm_normalize(raw_reply: str, last_user_message: str | None) -> str:
     last_user_message = (last_user_message or "").strip()
 
     messages = normalizer_prompt.format_messages(
         user_message=last_user_message,
         assistant_reply=raw_reply,
     )
-    result = normalizer_llm.invoke(messages)
+    result = await normalizer_llm.ainvoke(messages)
     return (result.content or "").strip()
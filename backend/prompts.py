@@ -187,7 +187,7 @@ Tarea:
 Usando la información anterior, genera un NUEVO estado interno en formato JSON.
 Debes devolver EXCLUSIVAMENTE un objeto JSON con esta estructura:
 
-{
+{{
   "personal_details": "",
   "emotional_state": "",
   "open_topics": "",
@@ -196,7 +196,7 @@ Debes devolver EXCLUSIVAMENTE un objeto JSON con esta estructura:
   "long_term_objectives": "",
   "plans_and_strategies": "",
   "negotiation_state": ""
-}
+}}
 
 Reglas:
 - Integra el contenido previo (existing_summary) con el nuevo bloque (new_block).
@@ -1,9 +1,32 @@
 # backend/state.py
 from __future__ import annotations
 
-from dataclasses import dataclass, field
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, fields
 from datetime import datetime, timezone
-from typing import Dict, List, Literal, Tuple, TypedDict
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    NotRequired,
+    Optional,
+    Tuple,
+    TypedDict,
+    TypeVar,
+)
 
 
 # ---- Tipos básicos ----
@@ -14,11 +37,38 @@ Role = Literal["user", "assistant"]
 class Message(TypedDict):
     role: Role
     content: str
+    # Nº de tokens de content, cacheado la primera vez que se cuenta (memory.py)
+    tokens: NotRequired[int]
 
 
 SessionKey = Tuple[str, str]
 
 
+@dataclass
+class RenderedTranscript:
+    """
+    Historial ya formateado ("Etiqueta: texto") para un esquema de
+    etiquetas: una línea por mensaje, solo se formatean las nuevas.
+    Además se guarda la última ventana unida (window_*), que se reutiliza
+    tal cual mientras no lleguen mensajes ni se mueva su inicio.
+    """
+    history: List["Message"]
+    lines: List[str] = field(default_factory=list)
+    window_start: int = -1
+    window_count: int = -1
+    window_text: str = ""
+
+
+@dataclass
+class TechniqueMemo:
+    """
+    Últimas técnicas RAG recuperadas para una fase, junto con el vector
+    léxico del contexto con el que se buscaron (para medir la deriva).
+    """
+    text: str
+    context_vector: Dict[str, int]
+
+
 @dataclass
 class SessionState:
     user_id: str
@@ -43,6 +93,9 @@ class SessionState:
     # Progreso por fase: lista de (nombre_fase, resumen_progreso)
     step_results: List[Tuple[str, str]] = field(default_factory=list)
 
+    # Si el ejecutor dio la fase actual por cumplida en el último turno
+    phase_done: bool = False
+
     # Datos internos del comprador (escenario coche)
     sister_option_price: float = 8000.0      # coche hermana
     sister_option_repairs: float = 2000.0    # reparaciones esperadas
@@ -54,38 +107,430 @@ class SessionState:
         default_factory=lambda: datetime.now(timezone.utc)
     )
 
+    # Caché en RAM del historial renderizado por esquema de etiquetas
+    # (memory.render_history). No se serializa: se reconstruye al vuelo.
+    transcripts: Dict[str, RenderedTranscript] = field(
+        default_factory=dict,
+        repr=False,
+        compare=False,
+        metadata={"transient": True},
+    )
+
+    # Memo de técnicas RAG por índice de fase (negotiation/rag_cache.py).
+    # Se serializa con la sesión: con SQLite/Redis cada turno lee una copia
+    # nueva del estado y, si no viajara, nunca habría aciertos.
+    technique_memo: Dict[int, TechniqueMemo] = field(
+        default_factory=dict,
+        repr=False,
+        compare=False,
+    )
 
-# Almacén global en RAM (MVP, sin DB)
-SESSIONS: Dict[SessionKey, SessionState] = {}
 
-# Si algún día quieres leer estos valores desde env, puedes moverlos a agent.py.
+# Si algún día quieres leer estos valores desde env, puedes moverlos a memory.py.
 # Aquí solo documentamos que son "parámetros de diseño".
-DEFAULT_CONTEXT_LIMIT_TURNS: int = 12        # a partir de cuántos turnos totales empezamos a resumir
-DEFAULT_KEEP_LAST_TURNS: int = 4            # cuántos turnos recientes guardamos "enteros"
+DEFAULT_CONTEXT_TRIGGER_TOKENS: int = 3000   # a partir de cuántos tokens de historial empezamos a resumir
+DEFAULT_KEEP_RECENT_TOKENS: int = 1000       # cuántos tokens recientes guardamos "enteros"
 
 
 def _make_key(user_id: str, session_id: str) -> SessionKey:
     return (user_id, session_id)
 
 
+# ---- Serialización compacta de SessionState ----
+
+def serialize_session(state: SessionState) -> bytes:
+    """
+    SessionState -> bytes (JSON compacto + zlib).
+    step_results va como lista de pares, last_updated como timestamp y
+    technique_memo como {"fase": {"text", "context_vector"}}.
+    """
+    data: Dict[str, Any] = {
+        f.name: getattr(state, f.name)
+        for f in fields(SessionState)
+        if not f.metadata.get("transient")
+    }
+    data["last_updated"] = state.last_updated.timestamp()
+    data["technique_memo"] = {
+        str(phase): {"text": memo.text, "context_vector": memo.context_vector}
+        for phase, memo in state.technique_memo.items()
+    }
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(raw.encode("utf-8"))
+
+
+def deserialize_session(blob: bytes) -> SessionState:
+    """
+    Inversa de serialize_session. Ignora campos desconocidos
+    (p. ej. datos guardados por una versión más nueva).
+    """
+    data = json.loads(zlib.decompress(blob).decode("utf-8"))
+    data["step_results"] = [tuple(item) for item in data.get("step_results", [])]
+    data["last_updated"] = datetime.fromtimestamp(data["last_updated"], tz=timezone.utc)
+    data["technique_memo"] = {
+        int(phase): TechniqueMemo(**memo)
+        for phase, memo in data.get("technique_memo", {}).items()
+    }
+
+    known = {f.name for f in fields(SessionState) if not f.metadata.get("transient")}
+    return SessionState(**{k: v for k, v in data.items() if k in known})
+
+
+# ---- Almacenes de sesiones ----
+
+class SessionStore(ABC):
+    """
+    Interfaz de almacén de sesiones.
+
+    get() de un backend persistente devuelve una copia: los cambios
+    solo se ven en otros workers después de put() (save_session_state).
+
+    blocking = True si get/put/delete hacen E/S (disco, red): desde el
+    event loop se llaman en un hilo (aget_session_state & co.).
+    """
+
+    blocking: bool = True
+
+    @abstractmethod
+    def get(self, key: SessionKey) -> Optional[SessionState]:
+        ...
+
+    @abstractmethod
+    def put(self, state: SessionState) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, key: SessionKey) -> None:
+        ...
+
+    def sweep(self) -> int:
+        """
+        Elimina sesiones caducadas; devuelve cuántas. Por defecto no hace
+        nada (p. ej. Redis ya caduca solo con su TTL).
+        """
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self).__name__}
+
+
+def estimate_session_bytes(state: SessionState) -> int:
+    """
+    Estimación barata de la memoria que ocupa una sesión en RAM:
+    overhead fijo + longitud de los textos que acumula.
+    """
+    size = 2048 + len(state.summary) + len(state.negotiation_objective)
+    size += sum(len(m["content"]) + 200 for m in state.history)
+    size += sum(len(step) + 120 for step in state.negotiation_plan)
+    size += sum(len(name) + len(result) + 150 for name, result in state.step_results)
+    size += sum(
+        len(t.window_text) + sum(len(line) + 50 for line in t.lines)
+        for t in state.transcripts.values()
+    )
+    size += sum(
+        len(m.text) + 60 * len(m.context_vector) for m in state.technique_memo.values()
+    )
+    return size
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Diccionario en RAM del proceso, con límites para no crecer sin fin:
+
+    - idle_ttl_s: sesiones sin actividad (last_updated) durante más tiempo caducan.
+    - max_sessions / max_bytes: al superarlos se expulsan las menos usadas (LRU).
+
+    Un límite <= 0 significa "sin límite".
+    """
+
+    # Solo RAM: llamarlo en un hilo costaría más que la propia operación
+    blocking = False
+
+    def __init__(
+        self,
+        idle_ttl_s: float = 0,
+        max_sessions: int = 0,
+        max_bytes: int = 0,
+    ) -> None:
+        self.idle_ttl_s = idle_ttl_s
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+
+        # Orden = LRU (la más antigua primero)
+        self.sessions: "OrderedDict[SessionKey, SessionState]" = OrderedDict()
+        self._sizes: Dict[SessionKey, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.evicted_idle = 0
+        self.evicted_budget = 0
+
+    def _is_expired(self, state: SessionState, now: float) -> bool:
+        return self.idle_ttl_s > 0 and now - state.last_updated.timestamp() > self.idle_ttl_s
+
+    def _remove(self, key: SessionKey) -> None:
+        self.sessions.pop(key, None)
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def get(self, key: SessionKey) -> Optional[SessionState]:
+        with self._lock:
+            state = self.sessions.get(key)
+            if state is None:
+                return None
+            if self._is_expired(state, time.time()):
+                self._remove(key)
+                self.evicted_idle += 1
+                return None
+            self.sessions.move_to_end(key)
+            return state
+
+    def put(self, state: SessionState) -> None:
+        key = _make_key(state.user_id, state.session_id)
+        size = estimate_session_bytes(state)
+        with self._lock:
+            self._bytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+            self.sessions[key] = state
+            self.sessions.move_to_end(key)
+
+            # Expulsar LRU mientras nos pasemos del presupuesto
+            # (nunca la sesión que se acaba de guardar)
+            while len(self.sessions) > 1 and (
+                (self.max_sessions > 0 and len(self.sessions) > self.max_sessions)
+                or (self.max_bytes > 0 and self._bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self.sessions))
+                self._remove(oldest)
+                self.evicted_budget += 1
+
+    def delete(self, key: SessionKey) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def sweep(self) -> int:
+        if self.idle_ttl_s <= 0:
+            return 0
+        now = time.time()
+        with self._lock:
+            expired = [k for k, st in self.sessions.items() if self._is_expired(st, now)]
+            for key in expired:
+                self._remove(key)
+            self.evicted_idle += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self).__name__,
+            "sessions": len(self.sessions),
+            "estimated_bytes": self._bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "evicted_idle": self.evicted_idle,
+            "evicted_budget": self.evicted_budget,
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sesiones en un fichero SQLite (compartible entre workers de la misma máquina).
+
+    idle_ttl_s > 0: sweep() borra las sesiones cuyo last_updated es más
+    antiguo (igual que el TTL por inactividad de InMemorySessionStore).
+    """
+
+    def __init__(self, path: str, idle_ttl_s: float = 0) -> None:
+        self.idle_ttl_s = idle_ttl_s
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id TEXT NOT NULL,"
+            " session_id TEXT NOT NULL,"
+            " data BLOB NOT NULL,"
+            " last_updated REAL NOT NULL,"
+            " PRIMARY KEY (user_id, session_id))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_last_updated ON sessions (last_updated)"
+        )
+
+    def get(self, key: SessionKey) -> Optional[SessionState]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE user_id = ? AND session_id = ?",
+                key,
+            ).fetchone()
+        return deserialize_session(row[0]) if row else None
+
+    def put(self, state: SessionState) -> None:
+        blob = serialize_session(state)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (user_id, session_id, data, last_updated)"
+                " VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (user_id, session_id)"
+                " DO UPDATE SET data = excluded.data, last_updated = excluded.last_updated",
+                (state.user_id, state.session_id, blob, state.last_updated.timestamp()),
+            )
+
+    def delete(self, key: SessionKey) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM sessions WHERE user_id = ? AND session_id = ?",
+                key,
+            )
+
+    def sweep(self) -> int:
+        if self.idle_ttl_s <= 0:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM sessions WHERE last_updated < ?",
+                (time.time() - self.idle_ttl_s,),
+            )
+        return cursor.rowcount
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sesiones en Redis (o cualquier servidor compatible con el protocolo).
+
+    `client` solo necesita get/set/delete al estilo redis-py, así que sirve
+    un redis.Redis real o un sustituto local (p. ej. fakeredis) en pruebas.
+    """
+
+    def __init__(self, client: Any, prefix: str = "session:", ttl_s: Optional[int] = None) -> None:
+        self.client = client
+        self.prefix = prefix
+        self.ttl_s = ttl_s
+
+    def _redis_key(self, key: SessionKey) -> str:
+        # JSON para que ni user_id ni session_id puedan colisionar con el separador
+        return self.prefix + json.dumps(list(key), ensure_ascii=False, separators=(",", ":"))
+
+    def get(self, key: SessionKey) -> Optional[SessionState]:
+        blob = self.client.get(self._redis_key(key))
+        return deserialize_session(blob) if blob else None
+
+    def put(self, state: SessionState) -> None:
+        self.client.set(
+            self._redis_key(_make_key(state.user_id, state.session_id)),
+            serialize_session(state),
+            ex=self.ttl_s,
+        )
+
+    def delete(self, key: SessionKey) -> None:
+        self.client.delete(self._redis_key(key))
+
+
+def _create_session_store() -> SessionStore:
+    """
+    Elige backend con SESSION_STORE = memory (defecto) | sqlite | redis.
+    """
+    backend = os.getenv("SESSION_STORE", "memory").lower()
+
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            os.getenv("SESSION_SQLITE_PATH", "sessions.sqlite3"),
+            idle_ttl_s=float(os.getenv("SESSION_IDLE_TTL_S", str(2 * 3600))),
+        )
+
+    if backend == "redis":
+        import redis  # dependencia opcional, solo si se usa este backend
+
+        ttl = os.getenv("SESSION_REDIS_TTL_S")
+        return RedisSessionStore(
+            redis.Redis.from_url(os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")),
+            prefix=os.getenv("SESSION_REDIS_PREFIX", "session:"),
+            ttl_s=int(ttl) if ttl else None,
+        )
+
+    return InMemorySessionStore(
+        idle_ttl_s=float(os.getenv("SESSION_IDLE_TTL_S", str(2 * 3600))),
+        max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+        max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024))),
+    )
+
+
+# Almacén global de sesiones del proceso
+SESSION_STORE: SessionStore = _create_session_store()
+
+# Cada cuánto (s) pasa el barrendero de sesiones caducadas
+SESSION_SWEEP_INTERVAL_S = float(os.getenv("SESSION_SWEEP_INTERVAL_S", "60"))
+
+
+async def run_session_sweeper(interval_s: float = SESSION_SWEEP_INTERVAL_S) -> None:
+    """
+    Tarea de fondo: elimina periódicamente las sesiones caducadas.
+    Pensada para lanzarse con asyncio.create_task en el arranque de la app.
+    """
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            removed = await _run_store(SESSION_STORE.sweep)
+            if removed:
+                print(f"[SESSIONS] {removed} sesiones caducadas eliminadas")
+        except Exception as e:
+            print(f"[SESSIONS] Error barriendo sesiones: {e!r}")
+
+
 def get_session_state(user_id: str, session_id: str) -> SessionState:
     """
     Recupera el estado de sesión para (user_id, session_id).
     Si no existe, lo crea.
     """
     key = _make_key(user_id, session_id)
-    if key not in SESSIONS:
-        SESSIONS[key] = SessionState(user_id=user_id, session_id=session_id)
-    return SESSIONS[key]
+    state = SESSION_STORE.get(key)
+    if state is None:
+        state = SessionState(user_id=user_id, session_id=session_id)
+        SESSION_STORE.put(state)
+    return state
+
+
+def find_session_state(user_id: str, session_id: str) -> Optional[SessionState]:
+    """
+    Como get_session_state, pero sin crear la sesión si no existe.
+    """
+    return SESSION_STORE.get(_make_key(user_id, session_id))
 
 
 def save_session_state(state: SessionState) -> None:
     """
-    Guarda/actualiza el estado en el diccionario global.
+    Guarda/actualiza el estado en el almacén de sesiones.
     """
-    key = _make_key(state.user_id, state.session_id)
     state.last_updated = datetime.now(timezone.utc)
-    SESSIONS[key] = state
+    SESSION_STORE.put(state)
+
+
+# ---- Versiones async (para el event loop) ----
+
+T = TypeVar("T")
+
+async def _run_store(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Llama a una operación del almacén sin bloquear el event loop
+    si el backend hace E/S (SQLite, Redis).
+    """
+    if SESSION_STORE.blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+async def aget_session_state(user_id: str, session_id: str) -> SessionState:
+    return await _run_store(get_session_state, user_id, session_id)
+
+
+async def afind_session_state(user_id: str, session_id: str) -> Optional[SessionState]:
+    return await _run_store(find_session_state, user_id, session_id)
+
+
+async def asave_session_state(state: SessionState) -> None:
+    await _run_store(save_session_state, state)
+
+
+async def areset_session_state(user_id: str, session_id: str) -> None:
+    await _run_store(reset_session_state, user_id, session_id)
 
 
 def add_message(state: SessionState, role: Role, content: str) -> None:
@@ -103,5 +548,145 @@ def reset_session_state(user_id: str, session_id: str) -> None:
     """
     Elimina (reset) el estado de una sesión.
     """
-    key = _make_key(user_id, session_id)
-    SESSIONS.pop(key, None)
+    SESSION_STORE.delete(_make_key(user_id, session_id))
+
+
+# ---- Concurrencia por sesión ----
+#
+# Dos peticiones simultáneas a la misma (user_id, session_id) no deben
+# intercalar sus turnos: cada sesión tiene su propio asyncio.Lock y el
+# turno entero (leer estado -> LLM -> guardar) se ejecuta dentro de él.
+# Sesiones distintas no comparten nada y siguen en paralelo.
+#
+# Ojo: el lock vive en el event loop del proceso. Con varios workers de
+# uvicorn y un almacén compartido (SQLite/Redis) hay que enrutar cada
+# sesión siempre al mismo worker (sticky sessions).
+
+# Ventana (ms) para agrupar una ráfaga de mensajes de la misma sesión en
+# un solo turno. 0 = desactivado (cada mensaje es su propio turno).
+SESSION_COALESCE_MS = float(os.getenv("SESSION_COALESCE_MS", "0"))
+
+
+class _SessionSlot:
+    __slots__ = ("lock", "users", "pending")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        # Peticiones que usan/esperan este slot (para limpiarlo al llegar a 0)
+        self.users = 0
+        # Mensajes esperando turno: (texto, future con el resultado)
+        self.pending: List[Tuple[str, asyncio.Future]] = []
+
+
+_SESSION_SLOTS: Dict[SessionKey, _SessionSlot] = {}
+_COALESCED_MESSAGES = 0
+
+
+@asynccontextmanager
+async def _session_slot(key: SessionKey) -> AsyncIterator[_SessionSlot]:
+    slot = _SESSION_SLOTS.get(key)
+    if slot is None:
+        slot = _SESSION_SLOTS[key] = _SessionSlot()
+    slot.users += 1
+    try:
+        yield slot
+    finally:
+        slot.users -= 1
+        if slot.users == 0:
+            _SESSION_SLOTS.pop(key, None)
+
+
+@asynccontextmanager
+async def session_lock(user_id: str, session_id: str) -> AsyncIterator[None]:
+    """
+    Exclusión mutua por sesión. Uso:
+
+        async with session_lock(user_id, session_id):
+            state = await aget_session_state(user_id, session_id)
+            ...
+    """
+    async with _session_slot(_make_key(user_id, session_id)) as slot:
+        async with slot.lock:
+            yield
+
+
+async def run_serialized_turn(
+    user_id: str,
+    session_id: str,
+    message: str,
+    turn: Callable[[SessionState, str], Awaitable[T]],
+    coalesce_ms: float = SESSION_COALESCE_MS,
+) -> T:
+    """
+    Ejecuta `turn(state, mensaje)` con el lock de la sesión cogido.
+    El estado se lee DENTRO del lock, así cada turno ve lo que guardó el anterior.
+
+    Con coalesce_ms > 0, los mensajes que llegan mientras la sesión está
+    ocupada (o durante la ventana) se juntan en un solo turno, separados
+    por saltos de línea; todas esas peticiones reciben el mismo resultado.
+    La petición que coge el lock ejecuta el turno por todas. Si turn()
+    lanza una excepción, la reciben todas; si cancelan a esa petición, los
+    mensajes de las demás vuelven a la cola y el siguiente en coger el lock
+    los ejecuta en un turno nuevo.
+    """
+    global _COALESCED_MESSAGES
+
+    if coalesce_ms <= 0:
+        async with session_lock(user_id, session_id):
+            state = await aget_session_state(user_id, session_id)
+            return await turn(state, message)
+
+    async with _session_slot(_make_key(user_id, session_id)) as slot:
+        waiter: asyncio.Future = asyncio.get_running_loop().create_future()
+        entry = (message, waiter)
+        slot.pending.append(entry)
+        try:
+            async with slot.lock:
+                if waiter.done():
+                    # Otro turno ya incluyó nuestro mensaje
+                    return waiter.result()
+
+                # Damos margen a que llegue el resto de la ráfaga
+                await asyncio.sleep(coalesce_ms / 1000.0)
+                batch, slot.pending = slot.pending, []
+                merged = "\n".join(text for text, _ in batch)
+
+                try:
+                    state = await aget_session_state(user_id, session_id)
+                    result = await turn(state, merged)
+                except Exception as e:
+                    for _, other in batch:
+                        if other is not waiter and not other.done():
+                            other.set_exception(e)
+                    raise
+                except BaseException:
+                    # Cancelado (o cierre del proceso): el fallo es nuestro,
+                    # no del turno. Devolvemos los demás mensajes a la cola
+                    # (delante de los recién llegados) para el siguiente.
+                    slot.pending[:0] = [
+                        item for item in batch
+                        if item is not entry and not item[1].done()
+                    ]
+                    raise
+
+                _COALESCED_MESSAGES += len(batch) - 1
+
+                for _, other in batch:
+                    if other is not waiter and not other.done():
+                        other.set_result(result)
+                return result
+        finally:
+            # Si nos cancelan antes de que nadie coja el mensaje, lo retiramos
+            if entry in slot.pending:
+                slot.pending.remove(entry)
+            # Y si ya iba en el lote de otro, que no se reencole por nosotros
+            if not waiter.done():
+                waiter.cancel()
+
+
+def session_lock_stats() -> Dict[str, int]:
+    return {
+        "active_sessions": len(_SESSION_SLOTS),
+        "waiting_requests": sum(max(0, slot.users - 1) for slot in _SESSION_SLOTS.values()),
+        "coalesced_messages": _COALESCED_MESSAGES,
+    }
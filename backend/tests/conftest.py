@@ -0,0 +1,10 @@
+# backend/tests/conftest.py
+import os
+import sys
+
+# Los módulos del backend se importan "planos" (como los arranca uvicorn)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Los clientes de OpenAI se crean al importar: basta con una clave cualquiera
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("NEGOTIATION_RAG_DIR", "/nonexistent")
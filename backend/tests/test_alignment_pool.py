@@ -0,0 +1,97 @@
+# backend/tests/test_alignment_pool.py
+import asyncio
+from concurrent.futures import BrokenExecutor, Executor, Future
+
+import pytest
+
+import alignment_pool
+from alignment_pool import AlignmentPool
+
+
+class _BrokenExecutor(Executor):
+    def __init__(self):
+        self.shutdown_calls = []
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_exception(BrokenExecutor("worker muerto"))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shutdown_calls.append((wait, cancel_futures))
+
+
+def test_thread_mode_does_not_touch_torch_threads():
+    pool = AlignmentPool(workers=0, queue_size=1, timeout_s=1)
+    executor = pool._get_executor()
+    try:
+        assert executor._initializer is alignment_pool._init_worker
+    finally:
+        pool.shutdown()
+
+
+def test_broken_executor_is_shut_down_before_recreating():
+    pool = AlignmentPool(workers=2, queue_size=2, timeout_s=1)
+    broken = _BrokenExecutor()
+    pool._executor = broken
+
+    async def main():
+        with pytest.raises(BrokenExecutor):
+            await pool.align("hola", b"audio")
+
+    asyncio.run(main())
+
+    assert broken.shutdown_calls == [(False, True)]
+    assert pool._executor is None
+    assert pool.failures == 1
+    assert pool._pending == 0
+
+
+class _StuckExecutor(Executor):
+    """Acepta lotes pero no los termina nunca (workers ocupados)."""
+
+    def __init__(self):
+        self.batches = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.batches.append(args[0])
+        return Future()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        pass
+
+
+def test_capacity_is_sized_in_batches():
+    pool = AlignmentPool(workers=2, queue_size=8, timeout_s=1, batch_max=8)
+    assert pool.capacity == 2 * 8 + 8
+
+    stuck = _StuckExecutor()
+    pool._executor = stuck
+
+    async def main():
+        waiters = [
+            asyncio.create_task(pool.align(f"frase {i}", b"audio"))
+            for i in range(pool.capacity)
+        ]
+        await asyncio.sleep(0)
+        with pytest.raises(alignment_pool.AlignmentPoolSaturated):
+            await pool.align("una más", b"audio")
+        for task in waiters:
+            task.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    asyncio.run(main())
+    # Se llenan lotes completos, no un item por worker
+    assert [len(batch) for batch in stuck.batches[:3]] == [8, 8, 8]
+
+
+def test_failed_warmup_discards_broken_executor():
+    pool = AlignmentPool(workers=2, queue_size=2, timeout_s=1)
+    broken = _BrokenExecutor()
+    pool._executor = broken
+
+    with pytest.raises(BrokenExecutor):
+        asyncio.run(pool.warmup())
+
+    assert broken.shutdown_calls == [(False, True)]
+    assert pool._executor is None
@@ -0,0 +1,86 @@
+# backend/tests/test_fast_planner.py
+import pytest
+
+from negotiation.fast_planner import (
+    CONCESSIONS_PHASE,
+    PLANNER_FAST_PATH_THRESHOLD,
+    RECAP_PHASE,
+    fast_plan,
+)
+
+PLAN = [f"Fase {i + 1}" for i in range(5)]
+DISCOVERY = 1
+IN_DISCOVERY = [("Fase 2", "algo")]
+
+
+def _plan(message, current_idx=DISCOVERY, step_results=IN_DISCOVERY, phase_done=False):
+    return fast_plan(PLAN, current_idx, message, step_results, phase_done)
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "Tiene 120 mil kilómetros, pero bien cuidados.",
+        "Le metí 2.000 euros de extras el año pasado.",
+        "Hace 15.000 km al año más o menos.",
+        "La revisión me costó 300 euros.",
+    ],
+)
+def test_amounts_without_offer_do_not_jump_to_concessions(message):
+    idx, _, _ = _plan(message)
+    assert idx == DISCOVERY
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "Te lo dejo en 11.500 €.",
+        "Pido 9 mil, es negociable.",
+        "¿Cuánto me ofreces?",
+    ],
+)
+def test_offers_suggest_concessions_below_threshold(message):
+    idx, confidence, _ = _plan(message)
+    assert idx == CONCESSIONS_PHASE
+    assert confidence < PLANNER_FAST_PATH_THRESHOLD
+
+
+def test_amounts_keep_concessions_phase():
+    steps = [("Fase 4", "contraoferta")]
+    idx, confidence, _ = _plan("Vale, 9.500 €.", CONCESSIONS_PHASE, steps)
+    assert idx == CONCESSIONS_PHASE
+    assert confidence >= PLANNER_FAST_PATH_THRESHOLD
+
+
+IN_CONCESSIONS = [("Fase 4", "contraoferta")]
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "Vale, trato hecho.",
+        "Acepto, nos vemos el lunes.",
+        "Hay trato. Trato hecho, ¿no?",
+        "No sé, bueno, venga: firmamos.",
+    ],
+)
+def test_explicit_closing_moves_to_recap(message):
+    idx, confidence, _ = _plan(message, CONCESSIONS_PHASE, IN_CONCESSIONS)
+    assert idx == RECAP_PHASE
+    assert confidence >= PLANNER_FAST_PATH_THRESHOLD
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "No acepto esa oferta",
+        "No hay trato por ese precio",
+        "Si no bajas, no firmamos",
+        "¿Cerramos en 9.500?",
+        "Cerramos en 9.500?",
+        "Eso nunca lo acepto.",
+    ],
+)
+def test_negated_or_questioned_closing_is_not_a_close(message):
+    idx, confidence, _ = _plan(message, CONCESSIONS_PHASE, IN_CONCESSIONS)
+    assert idx != RECAP_PHASE or confidence < PLANNER_FAST_PATH_THRESHOLD
@@ -0,0 +1,70 @@
+# backend/tests/test_memory.py
+import asyncio
+import threading
+
+import pytest
+
+import memory
+from memory import SELLER_BUYER_LABELS, format_messages, render_history
+from state import SessionState, add_message
+
+
+def _session(n):
+    st = SessionState(user_id="u", session_id="s")
+    for i in range(n):
+        add_message(st, "user" if i % 2 == 0 else "assistant", f"mensaje {i}")
+    return st
+
+
+def test_render_history_matches_format_messages():
+    st = _session(6)
+    for start in range(8):
+        expected = format_messages(st.history[start:], SELLER_BUYER_LABELS)
+        assert render_history(st, SELLER_BUYER_LABELS, start=start) == expected
+
+
+def test_render_history_only_formats_new_messages():
+    st = _session(4)
+    first = render_history(st, SELLER_BUYER_LABELS, start=2)
+    # Sin cambios: se devuelve la ventana ya unida
+    assert render_history(st, SELLER_BUYER_LABELS, start=2) is first
+
+    cache = st.transcripts["/".join(SELLER_BUYER_LABELS)]
+    old_lines = list(cache.lines)
+    add_message(st, "user", "nuevo")
+    text = render_history(st, SELLER_BUYER_LABELS, start=2)
+
+    assert cache.lines[:4] == old_lines and len(cache.lines) == 5
+    assert text == format_messages(st.history[2:], SELLER_BUYER_LABELS)
+
+
+def test_render_history_rebuilds_after_trim():
+    st = _session(6)
+    render_history(st, SELLER_BUYER_LABELS)
+    st.history = st.history[4:]
+    assert render_history(st, SELLER_BUYER_LABELS) == format_messages(st.history, SELLER_BUYER_LABELS)
+
+
+def test_tokenizer_loads_off_the_event_loop(monkeypatch):
+    threads = []
+    monkeypatch.setattr(memory, "_encoding_loaded", False)
+    monkeypatch.setattr(memory, "_encoding", None)
+    monkeypatch.setattr(memory, "TOKENIZER_MODEL", "modelo-falso")
+
+    tiktoken = pytest.importorskip("tiktoken")
+
+    def fake_encoding_for_model(model):
+        threads.append(threading.get_ident())
+        raise RuntimeError("sin red")
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", fake_encoding_for_model)
+
+    async def main():
+        return await memory.load_tokenizer(), threading.get_ident()
+
+    has_tiktoken, loop_thread = asyncio.run(main())
+
+    assert threads and loop_thread not in threads
+    assert has_tiktoken is False                  # se cae a la aproximación
+    assert memory.count_tokens("abcdefgh") == 3   # len/4 + 1, sin recargar
+    assert len(threads) == 1
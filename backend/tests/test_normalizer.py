@@ -0,0 +1,36 @@
+# backend/tests/test_normalizer.py
+import pytest
+
+from normalizer import _split_sentences, find_style_violations, local_normalize
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Mi tope son 9.500€. ¿Te encaja?", ["Mi tope son 9.500€.", "¿Te encaja?"]),
+        ("Te lo dejo en 8.500. ¿Hay trato?", ["Te lo dejo en 8.500.", "¿Hay trato?"]),
+        ("Gasta 5.5 litros a los 100", ["Gasta 5.5 litros a los 100"]),
+        ("Vale. ¿Y los neumáticos?", ["Vale.", "¿Y los neumáticos?"]),
+    ],
+)
+def test_split_sentences_keeps_numbers_whole(text, expected):
+    assert _split_sentences(text) == expected
+
+
+def test_local_normalize_never_drops_prices():
+    text = "Te puedo ofrecer 8.500 euros, eso suena bien para los dos."
+    assert local_normalize(text) == text
+
+
+def test_local_normalize_drops_plain_filler():
+    text = "Me hago una idea. ¿Cuántos kilómetros tiene?"
+    assert local_normalize(text) == "¿Cuántos kilómetros tiene?"
+
+
+def test_price_with_question_is_not_too_many_sentences():
+    assert "too_many_sentences" not in find_style_violations("Mi tope son 9.500€. ¿Te encaja?")
+
+
+def test_three_sentences_with_prices_are_flagged():
+    text = "Vi otro por 9.000 €. Este tiene 120.000 km. ¿Lo dejarías en 8.800?"
+    assert "too_many_sentences" in find_style_violations(text)
@@ -0,0 +1,220 @@
+# backend/tests/test_rag_index.py
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from negotiation import negotiation_graph as ng
+
+
+class _Embeddings(DeterministicFakeEmbedding):
+    fail: bool = False
+
+    def embed_documents(self, texts):
+        if self.fail:
+            raise ConnectionError("sin red")
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def rag(monkeypatch, tmp_path):
+    docs_dir, index_dir = tmp_path / "docs", tmp_path / "index"
+    docs_dir.mkdir()
+    for i in range(3):
+        (docs_dir / f"fase_{i + 1}.md").write_text(f"# Fase {i + 1}\n## Señales\ntexto {i}\n")
+    embeddings = _Embeddings(size=8)
+    monkeypatch.setattr(ng, "RAG_DIR", str(docs_dir))
+    monkeypatch.setattr(ng, "RAG_INDEX_DIR", str(index_dir))
+    monkeypatch.setattr(ng, "get_embeddings", lambda: embeddings)
+    return docs_dir, index_dir, embeddings
+
+
+def _manifest_ids(index_dir):
+    with open(os.path.join(index_dir, ng.RAG_MANIFEST_NAME), encoding="utf-8") as f:
+        docs = json.load(f)["docs"]
+    return sorted(i for entry in docs.values() for i in entry["ids"])
+
+
+def test_failed_embedding_keeps_index_equal_to_disk(rag):
+    docs_dir, index_dir, embeddings = rag
+    ng._load_negotiation_rag_index()
+    saved_ids = _manifest_ids(index_dir)
+
+    (docs_dir / "fase_2.md").write_text("# Fase 2\n## Señales\ncambiado\n")
+    embeddings.fail = True
+    vs = ng._load_negotiation_rag_index()
+
+    assert sorted(vs.index_to_docstore_id.values()) == saved_ids
+    assert _manifest_ids(index_dir) == saved_ids
+
+
+def test_failed_update_falls_back_to_full_rebuild(rag):
+    docs_dir, index_dir, _ = rag
+    ng._load_negotiation_rag_index()
+
+    # Manifest que no casa con el índice: el delete incremental falla
+    path = os.path.join(index_dir, ng.RAG_MANIFEST_NAME)
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["docs"]["fase_1.md"]["ids"] = ["no-existe"]
+    manifest["docs"]["fase_1.md"]["hash"] = "viejo"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    vs = ng._load_negotiation_rag_index()
+
+    assert sorted(vs.index_to_docstore_id.values()) == _manifest_ids(index_dir)
+    assert len(vs.index_to_docstore_id) == 3
+
+
+def test_save_is_staged_and_failed_save_keeps_previous_index(rag, monkeypatch):
+    docs_dir, index_dir, _ = rag
+    vs = ng._load_negotiation_rag_index()
+    saved_ids = _manifest_ids(index_dir)
+    assert not [n for n in os.listdir(index_dir) if n.startswith(".tmp-")]
+
+    def broken_save(folder_path):
+        open(os.path.join(folder_path, "index.faiss"), "w").write("a medias")
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(vs, "save_local", broken_save, raising=False)
+    ng._save_index(vs, {"docs": {}})
+
+    assert _manifest_ids(index_dir) == saved_ids
+    assert sorted(ng._reload_saved_index(ng.get_embeddings()).index_to_docstore_id.values()) == saved_ids
+    assert not [n for n in os.listdir(index_dir) if n.startswith(".tmp-")]
+
+
+def test_index_dir_lock_excludes_other_holders(rag):
+    pytest.importorskip("fcntl")
+    order = []
+    holding = threading.Event()
+
+    def other_worker():
+        holding.wait()
+        with ng._index_dir_lock():
+            order.append("otro")
+
+    thread = threading.Thread(target=other_worker)
+    thread.start()
+    with ng._index_dir_lock():
+        holding.set()
+        time.sleep(0.2)
+        order.append("primero")
+    thread.join(timeout=5)
+
+    assert order == ["primero", "otro"]
+
+
+@pytest.fixture
+def fresh_index_state(monkeypatch):
+    monkeypatch.setattr(ng, "_RAG_INDEX", None)
+    monkeypatch.setattr(ng, "_RAG_INDEX_LOADED", False)
+    monkeypatch.setattr(ng, "_RAG_INDEX_FAILED_AT", None)
+
+
+def test_failed_index_load_is_retried(rag, fresh_index_state, monkeypatch):
+    _, _, embeddings = rag
+    embeddings.fail = True
+    assert ng.get_negotiation_rag_index() is None
+    assert ng._RAG_INDEX_LOADED is False
+
+    # Dentro de la ventana de reintento no se vuelve a intentar
+    embeddings.fail = False
+    assert ng.get_negotiation_rag_index() is None
+
+    monkeypatch.setattr(ng, "RAG_INDEX_RETRY_S", 0)
+    assert ng.get_negotiation_rag_index() is not None
+    assert ng._RAG_INDEX_LOADED is True
+
+
+def test_missing_docs_latch_the_fallback(rag, fresh_index_state, monkeypatch):
+    monkeypatch.setattr(ng, "RAG_DIR", "/nonexistent")
+    assert ng.has_phase_docs() is False
+    assert ng.get_negotiation_rag_index() is None
+    assert ng._RAG_INDEX_LOADED is True
+
+
+class _FakeIndex:
+    """
+    Lo justo de FAISS para el retriever: cuenta embeddings y búsquedas.
+    """
+
+    model_id = "fake-8"
+
+    def __init__(self):
+        self.embedding_function = self
+        self.queries = []
+        self.searches = []
+
+    async def aembed_query(self, text):
+        self.queries.append(text)
+        return [0.0] * 8
+
+    async def asimilarity_search_by_vector(self, embedding, k, filter=None, fetch_k=None):
+        self.searches.append((tuple(embedding), filter))
+        phase = filter["phase_index"] if filter else -1
+        return [ng.Document(page_content=f"técnica {phase}", metadata={"phase_index": phase})]
+
+
+def test_retriever_embeds_the_context_once(monkeypatch):
+    from negotiation import rag_cache
+
+    index = _FakeIndex()
+
+    async def fake_index():
+        return index
+
+    monkeypatch.setattr(ng, "aget_negotiation_rag_index", fake_index)
+    monkeypatch.setattr(rag_cache, "QUERY_EMBEDDING_CACHE", rag_cache.QueryEmbeddingCache(16))
+    state = {
+        "plan": ["Fase 1", "Fase 2", "Fase 3"],
+        "current_step_index": 1,
+        "summary": "resumen",
+        "history_text": "Vendedor: hola",
+        "technique_memo": {},
+    }
+
+    result = asyncio.run(ng.retriever_node(state))["phase_techniques"]
+
+    assert len(index.queries) == 1
+    assert [f["phase_index"] for _, f in index.searches] == [0, 1, 2]
+    assert len({vector for vector, _ in index.searches}) == 1
+    assert all(f"técnica {i}" in result[i] for i in range(3))
+
+
+def test_technique_memo_hits_across_turns_with_a_persistent_store(monkeypatch, tmp_path):
+    from negotiation import rag_cache
+    from state import SQLiteSessionStore, SessionState
+
+    index = _FakeIndex()
+
+    async def fake_index():
+        return index
+
+    monkeypatch.setattr(ng, "aget_negotiation_rag_index", fake_index)
+    monkeypatch.setattr(rag_cache, "QUERY_EMBEDDING_CACHE", rag_cache.QueryEmbeddingCache(16))
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    store.put(SessionState(user_id="u", session_id="s", negotiation_plan=["Fase 1", "Fase 2"]))
+    history = "Vendedor: el coche tiene revisiones al día y ruedas nuevas de este año"
+
+    for turn in range(3):
+        session = store.get(("u", "s"))        # copia nueva en cada turno
+        history += f"\nComprador: vale {turn}"
+        state = {
+            "plan": session.negotiation_plan,
+            "current_step_index": 0,
+            "summary": "resumen",
+            "history_text": history,
+            "technique_memo": session.technique_memo,
+        }
+        result = asyncio.run(ng.retriever_node(state))["phase_techniques"]
+        assert "técnica 0" in result[0]
+        store.put(session)
+
+    assert len(index.queries) == 1
+    assert sorted(store.get(("u", "s")).technique_memo) == [0, 1]
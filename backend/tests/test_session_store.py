@@ -0,0 +1,274 @@
+# backend/tests/test_session_store.py
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import state
+from state import (
+    InMemorySessionStore,
+    RedisSessionStore,
+    SessionState,
+    SQLiteSessionStore,
+    TechniqueMemo,
+    deserialize_session,
+    serialize_session,
+)
+
+
+class _FakeRedis:
+    """
+    Lo mínimo de redis-py que usa RedisSessionStore.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.ttls[key] = ex
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class _RecordingStore(SQLiteSessionStore):
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.get_ident())
+        return super().get(key)
+
+    def put(self, st):
+        self.threads.append(threading.get_ident())
+        super().put(st)
+
+
+def test_blocking_store_runs_off_the_event_loop(monkeypatch, tmp_path):
+    store = _RecordingStore(str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(state, "SESSION_STORE", store)
+
+    async def turn(st, message):
+        st.summary = message
+        await state.asave_session_state(st)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(state.run_serialized_turn("u", "s", "hola", turn, coalesce_ms=0))
+
+    assert store.threads and loop_thread not in store.threads
+    assert store.get(("u", "s")).summary == "hola"
+
+
+def test_memory_store_stays_on_the_event_loop(monkeypatch):
+    monkeypatch.setattr(state, "SESSION_STORE", InMemorySessionStore())
+
+    async def main():
+        st = await state.aget_session_state("u", "s")
+        return st, state.find_session_state("u", "s")
+
+    created, found = asyncio.run(main())
+    assert created is found
+
+
+def _full_state(user_id="u", session_id="s"):
+    st = SessionState(user_id=user_id, session_id=session_id)
+    st.summary = "Resumen con tildes: ¿cuánto?"
+    st.history = [{"role": "user", "content": "hola", "tokens": 1}]
+    st.negotiation_plan = ["Fase 1", "Fase 2"]
+    st.current_step_index = 1
+    st.step_results = [("Fase 1", "hecho")]
+    st.turn_count = 3
+    st.last_updated = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    return st
+
+
+def test_serialize_round_trip_skips_transient_fields():
+    st = _full_state()
+    st.technique_memo[1] = TechniqueMemo(text="t", context_vector={"a": 1})
+    st.transcripts["x/y"] = state.RenderedTranscript(history=st.history, lines=["x: hola"])
+
+    restored = deserialize_session(serialize_session(st))
+
+    assert restored == st
+    assert restored.step_results == [("Fase 1", "hecho")]
+    assert restored.last_updated == st.last_updated
+    assert restored.technique_memo == {1: TechniqueMemo(text="t", context_vector={"a": 1})}
+    assert restored.transcripts == {}
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemorySessionStore()
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    return RedisSessionStore(_FakeRedis())
+
+
+def test_store_contract(store):
+    assert store.get(("u", "s")) is None
+
+    store.put(_full_state())
+    store.put(_full_state(session_id="otra"))
+    assert store.get(("u", "s")) == _full_state()
+
+    updated = _full_state()
+    updated.summary = "nuevo"
+    store.put(updated)
+    assert store.get(("u", "s")).summary == "nuevo"
+
+    store.delete(("u", "s"))
+    store.delete(("u", "no-existe"))
+    assert store.get(("u", "s")) is None
+    assert store.get(("u", "otra")) is not None
+    assert store.stats()["backend"] == type(store).__name__
+
+
+def test_redis_store_passes_ttl():
+    client = _FakeRedis()
+    RedisSessionStore(client, prefix="p:", ttl_s=60).put(_full_state())
+    assert list(client.ttls.items()) == [('p:["u","s"]', 60)]
+
+
+def test_sqlite_sweep_removes_idle_sessions(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), idle_ttl_s=60)
+    stale = _full_state(session_id="vieja")
+    stale.last_updated = datetime.now(timezone.utc) - timedelta(seconds=120)
+    fresh = _full_state(session_id="nueva")
+    fresh.last_updated = datetime.now(timezone.utc)
+    store.put(stale)
+    store.put(fresh)
+
+    assert store.sweep() == 1
+    assert store.get(("u", "vieja")) is None
+    assert store.get(("u", "nueva")) is not None
+    assert SQLiteSessionStore(str(tmp_path / "other.db")).sweep() == 0
+
+
+def _sized_state(session_id, chars=0, age_s=0.0):
+    st = SessionState(user_id="u", session_id=session_id)
+    st.summary = "x" * chars
+    st.last_updated = datetime.now(timezone.utc) - timedelta(seconds=age_s)
+    return st
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = InMemorySessionStore(max_sessions=2)
+    store.put(_sized_state("a"))
+    store.put(_sized_state("b"))
+    store.get(("u", "a"))            # "b" pasa a ser la menos usada
+    store.put(_sized_state("c"))
+
+    assert set(store.sessions) == {("u", "a"), ("u", "c")}
+    assert store.stats()["evicted_budget"] == 1
+
+
+def test_memory_store_byte_budget_keeps_the_newest_session():
+    base = state.estimate_session_bytes(_sized_state("a"))
+    store = InMemorySessionStore(max_bytes=2 * base + 500)
+    store.put(_sized_state("a"))
+    store.put(_sized_state("b"))
+    store.put(_sized_state("grande", chars=10 * base))
+
+    # Aunque sola ya supera el presupuesto, la recién guardada no se expulsa
+    assert list(store.sessions) == [("u", "grande")]
+    assert store.stats()["evicted_budget"] == 2
+
+
+def test_memory_store_expires_idle_sessions():
+    store = InMemorySessionStore(idle_ttl_s=60)
+    store.put(_sized_state("vieja", age_s=120))
+    store.put(_sized_state("otra-vieja", age_s=120))
+    store.put(_sized_state("nueva"))
+
+    assert store.get(("u", "vieja")) is None     # caduca al leerla
+    assert store.sweep() == 1                    # y el barrendero la otra
+    assert list(store.sessions) == [("u", "nueva")]
+    assert store.stats()["evicted_idle"] == 2
+
+
+def test_memory_store_byte_accounting():
+    store = InMemorySessionStore()
+    small, big = _sized_state("a", chars=10), _sized_state("b", chars=1000)
+    store.put(small)
+    store.put(big)
+    assert store.stats()["estimated_bytes"] == (
+        state.estimate_session_bytes(small) + state.estimate_session_bytes(big)
+    )
+
+    small.summary = "y" * 500                    # re-guardar solo suma la diferencia
+    store.put(small)
+    assert store.stats()["estimated_bytes"] == (
+        state.estimate_session_bytes(small) + state.estimate_session_bytes(big)
+    )
+
+    store.delete(("u", "b"))
+    store.delete(("u", "a"))
+    assert store.stats()["estimated_bytes"] == 0
+
+
+def _coalesced_burst(monkeypatch, turn):
+    # Lanza "a", "b" y "c" a la vez: "a" coge el lock y los agrupa a los tres
+    monkeypatch.setattr(state, "SESSION_STORE", InMemorySessionStore())
+
+    async def main():
+        tasks = []
+        for text in ("a", "b", "c"):
+            tasks.append(asyncio.create_task(
+                state.run_serialized_turn("u", "s", text, turn, coalesce_ms=20)
+            ))
+            await asyncio.sleep(0)
+        return tasks
+
+    return main
+
+
+def test_cancelled_owner_requeues_coalesced_messages(monkeypatch):
+    calls = []
+    owner_in_turn = None
+
+    async def turn(st, merged):
+        calls.append(merged)
+        if len(calls) == 1:
+            owner_in_turn.set()
+            await asyncio.Event().wait()      # turno colgado hasta que lo cancelen
+        return merged
+
+    start = _coalesced_burst(monkeypatch, turn)
+
+    async def main():
+        nonlocal owner_in_turn
+        owner_in_turn = asyncio.Event()
+        owner, *others = await start()
+        await owner_in_turn.wait()
+        owner.cancel()
+        results = await asyncio.gather(owner, *others, return_exceptions=True)
+        return results, state.session_lock_stats()
+
+    (owner_result, b, c), stats = asyncio.run(main())
+
+    assert calls == ["a\nb\nc", "b\nc"]
+    assert isinstance(owner_result, asyncio.CancelledError)
+    assert b == c == "b\nc"
+    assert stats["active_sessions"] == 0
+
+
+def test_turn_error_reaches_every_coalesced_request(monkeypatch):
+    async def turn(st, merged):
+        raise RuntimeError(merged)
+
+    start = _coalesced_burst(monkeypatch, turn)
+
+    async def main():
+        return await asyncio.gather(*(await start()), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(r) for r in results] == [RuntimeError] * 3
+    assert all(str(r) == "a\nb\nc" for r in results)
@@ -0,0 +1,63 @@
+# backend/tests/test_speculative.py
+import asyncio
+
+from negotiation import negotiation_graph as ng
+
+
+def _state(current_idx=1):
+    return {
+        "summary": "",
+        "history_text": "",
+        "user_message": "te lo dejo en 9.000",
+        "objective": "comprar",
+        "plan": ng.BASE_NEGOTIATION_PLAN.copy(),
+        "current_step_index": current_idx,
+        "step_results": [],
+        "phase_done": False,
+        "phase_techniques": {},
+        "response": "",
+    }
+
+
+def _patch(monkeypatch, new_idx, events, executed):
+    async def planner(state):
+        return {"current_step_index": new_idx}
+
+    async def retriever(state):
+        # Más lento que el planner: el ejecutor especulativo está esperándolo
+        # cuando llega el veredicto
+        await asyncio.sleep(0.05)
+        return {"phase_techniques": {i: f"técnicas {i}" for i in range(5)}}
+
+    async def run_executor(state, stream_tag):
+        executed.append((state["current_step_index"], stream_tag))
+        return {"response": f"respuesta {stream_tag}", "step_results": [], "phase_done": False}
+
+    monkeypatch.setattr(ng, "planner_node", planner)
+    monkeypatch.setattr(ng, "retriever_node", retriever)
+    monkeypatch.setattr(ng, "_run_executor", run_executor)
+    monkeypatch.setattr(ng, "get_stream_writer", lambda: events.append)
+
+
+def test_speculative_hit_uses_speculative_reply(monkeypatch):
+    events, executed = [], []
+    _patch(monkeypatch, 1, events, executed)
+
+    result = asyncio.run(ng.speculative_node(_state(1)))
+
+    assert events == [{"speculation": "hit"}]
+    assert executed == [(1, ng.EXECUTOR_SPECULATIVE_TAG)]
+    assert result["response"] == f"respuesta {ng.EXECUTOR_SPECULATIVE_TAG}"
+
+
+def test_speculative_miss_does_not_cancel_shared_retriever(monkeypatch):
+    events, executed = [], []
+    _patch(monkeypatch, 3, events, executed)
+
+    result = asyncio.run(ng.speculative_node(_state(1)))
+
+    assert events == [{"speculation": "miss"}]
+    assert executed == [(3, ng.EXECUTOR_STREAM_TAG)]
+    assert result["current_step_index"] == 3
+    assert result["phase_techniques"][3] == "técnicas 3"
+    assert result["response"] == f"respuesta {ng.EXECUTOR_STREAM_TAG}"
@@ -0,0 +1,86 @@
+# backend/tests/test_tts_pipeline.py
+import struct
+
+import pytest
+
+from tts_pipeline import audio_duration_seconds, parse_wav_header
+
+
+def _wav_bytes(data, sample_rate=24000, bits=16, format_tag=1, channels=1, extensible=False):
+    block_align = channels * bits // 8
+    fmt = (
+        (0xFFFE if extensible else format_tag).to_bytes(2, "little")
+        + channels.to_bytes(2, "little")
+        + sample_rate.to_bytes(4, "little")
+        + (sample_rate * block_align).to_bytes(4, "little")
+        + block_align.to_bytes(2, "little")
+        + bits.to_bytes(2, "little")
+    )
+    if extensible:
+        # cbSize, validBits, channelMask y GUID del subformato
+        fmt += (22).to_bytes(2, "little") + bits.to_bytes(2, "little") + b"\0" * 4
+        fmt += format_tag.to_bytes(2, "little") + b"\0" * 14
+    body = b"WAVE" + b"fmt " + len(fmt).to_bytes(4, "little") + fmt
+    body += b"data" + len(data).to_bytes(4, "little") + data
+    return b"RIFF" + len(body).to_bytes(4, "little") + body
+
+
+def _wav(seconds, sample_rate=24000):
+    return _wav_bytes(b"\0" * (int(seconds * sample_rate) * 2), sample_rate)
+
+
+def _mp3_frames(n_frames, xing=False):
+    # MPEG-1 capa III, 128 kbps, 44.1 kHz, sin padding: 417 bytes por frame
+    header = b"\xff\xfb\x90\x00"
+    frame = header + b"\0" * 413
+    frames = frame * n_frames
+    if xing:
+        frames = header + b"\0" * 32 + b"Info" + b"\0" * 377 + frames
+    return b"ID3\x03\x00\x00\x00\x00\x00\x0a" + b"\0" * 10 + frames
+
+
+def test_wav_duration_includes_trailing_silence():
+    assert audio_duration_seconds(_wav(1.5), "wav") == pytest.approx(1.5)
+
+
+def test_mp3_duration_from_frame_headers():
+    expected = 100 * 1152 / 44100
+    assert audio_duration_seconds(_mp3_frames(100), "mp3") == pytest.approx(expected)
+    assert audio_duration_seconds(_mp3_frames(100, xing=True), "mp3") == pytest.approx(expected)
+
+
+def test_unreadable_mp3_has_no_duration():
+    assert audio_duration_seconds(b"not an mp3", "mp3") is None
+
+
+def test_wav_header_reports_format_tag():
+    assert parse_wav_header(_wav(0.1))[5] == 1
+    assert parse_wav_header(_wav_bytes(b"\0" * 8, bits=32, format_tag=3))[5] == 3
+    extensible = _wav_bytes(b"\0" * 8, bits=32, format_tag=3, extensible=True)
+    assert parse_wav_header(extensible)[5] == 3
+
+
+def test_decode_float_and_24bit_wav():
+    pytest.importorskip("torch")
+    from lipsync_bfa import decode_wav_bytes
+
+    values = [0.5, -0.25, 1.0, -1.0]
+    for wav in (
+        _wav_bytes(struct.pack("<4f", *values), bits=32, format_tag=3),
+        _wav_bytes(struct.pack("<4f", *values), bits=32, format_tag=3, extensible=True),
+        _wav_bytes(
+            b"".join(int(v * (2 ** 23 - 1)).to_bytes(3, "little", signed=True) for v in values),
+            bits=24,
+        ),
+    ):
+        waveform, sample_rate = decode_wav_bytes(wav)
+        assert sample_rate == 24000
+        assert waveform.squeeze(0).tolist() == pytest.approx(values, abs=1e-6)
+
+
+def test_decode_rejects_unknown_wav_format():
+    pytest.importorskip("torch")
+    from lipsync_bfa import decode_wav_bytes
+
+    with pytest.raises(ValueError, match="no soportado"):
+        decode_wav_bytes(_wav_bytes(b"\0" * 8, bits=8, format_tag=7))  # mu-law
@@ -0,0 +1,170 @@
+# backend/tts_cache.py
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+# --- Configuración (vía .env) ---
+
+# Presupuesto de la caché en RAM (bytes de audio + timeline aprox.)
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Carpeta para la caché en disco (vacío = solo RAM)
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "")
+
+# Coste aproximado en bytes de cada segmento del timeline
+_TIMELINE_SEG_BYTES = 64
+
+
+@dataclass
+class CachedSpeech:
+    audio: bytes
+    timeline: List[Dict]
+
+    @property
+    def size(self) -> int:
+        return len(self.audio) + len(self.timeline) * _TIMELINE_SEG_BYTES
+
+
+def normalize_cache_text(text: str) -> str:
+    """
+    Normaliza el texto para la clave: Unicode NFC y espacios colapsados.
+    No tocamos mayúsculas ni puntuación porque cambian la entonación del TTS.
+    """
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def make_cache_key(text: str, voice: str, model: str, fmt: str) -> str:
+    raw = json.dumps(
+        [normalize_cache_text(text), voice, model, fmt],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Caché direccionada por contenido de (audio TTS + timeline de visemas):
+
+    - Nivel 1: LRU en RAM con presupuesto en bytes.
+    - Nivel 2 (opcional): ficheros en disco, <dir>/<ab>/<clave>.audio + .json
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str = "") -> None:
+        self.max_bytes = max(0, max_bytes)
+        self.disk_dir = disk_dir
+
+        self._entries: "OrderedDict[str, CachedSpeech]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # --- RAM ---
+
+    def _get_memory(self, key: str) -> Optional[CachedSpeech]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _put_memory(self, key: str, entry: CachedSpeech) -> None:
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    # --- Disco ---
+
+    def _disk_paths(self, key: str):
+        folder = os.path.join(self.disk_dir, key[:2])
+        return folder, os.path.join(folder, f"{key}.audio"), os.path.join(folder, f"{key}.json")
+
+    def _get_disk(self, key: str) -> Optional[CachedSpeech]:
+        _, audio_path, timeline_path = self._disk_paths(key)
+        try:
+            with open(audio_path, "rb") as f:
+                audio = f.read()
+            with open(timeline_path, "r", encoding="utf-8") as f:
+                timeline = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return CachedSpeech(audio=audio, timeline=timeline)
+
+    def _put_disk(self, key: str, entry: CachedSpeech) -> None:
+        folder, audio_path, timeline_path = self._disk_paths(key)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            # Escritura atómica: primero el audio, el .json al final marca la entrada como completa
+            tmp = f"{audio_path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(entry.audio)
+            os.replace(tmp, audio_path)
+
+            tmp = f"{timeline_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry.timeline, f, separators=(",", ":"))
+            os.replace(tmp, timeline_path)
+        except OSError as e:
+            print(f"[TTS_CACHE] No se pudo escribir en disco {folder}: {e}")
+
+    # --- API ---
+
+    async def get(self, key: str) -> Optional[CachedSpeech]:
+        entry = self._get_memory(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._get_disk, key)
+            if entry is not None:
+                self.disk_hits += 1
+                self._put_memory(key, entry)
+                return entry
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, entry: CachedSpeech) -> None:
+        self._put_memory(key, entry)
+        if self.disk_dir:
+            await asyncio.to_thread(self._put_disk, key, entry)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+TTS_CACHE = TTSCache(max_bytes=TTS_CACHE_MAX_BYTES, disk_dir=TTS_CACHE_DIR)
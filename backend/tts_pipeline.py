@@ -0,0 +1,279 @@
+# backend/tts_pipeline.py
+from __future__ import annotations
+
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+# --- Troceado del texto en frases/cláusulas para TTS incremental ---
+
+# Longitud máxima aproximada de cada trozo (si una frase es más larga,
+# se parte por comas / punto y coma / dos puntos).
+TTS_CHUNK_MAX_CHARS = int(os.getenv("TTS_CHUNK_MAX_CHARS", "160"))
+
+# Trozos más cortos que esto se fusionan con el siguiente
+# ("Sí." sola no merece una llamada de TTS + alineado propia).
+TTS_CHUNK_MIN_CHARS = int(os.getenv("TTS_CHUNK_MIN_CHARS", "12"))
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+_CLAUSE_END_RE = re.compile(r"(?<=[,;:])\s+")
+
+
+def split_into_speech_chunks(
+    text: str,
+    max_chars: int = TTS_CHUNK_MAX_CHARS,
+    min_chars: int = TTS_CHUNK_MIN_CHARS,
+) -> List[str]:
+    """
+    Divide una respuesta en trozos pronunciables por separado:
+
+    - Primero por final de frase (. ! ? …).
+    - Si una frase supera max_chars, por cláusulas (, ; :).
+    - Los trozos muy cortos se pegan al siguiente.
+
+    Concatenar los trozos con espacios reproduce el texto original.
+    """
+    pieces: List[str] = []
+    for sentence in _SENTENCE_END_RE.split((text or "").strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+
+        current = ""
+        for clause in _CLAUSE_END_RE.split(sentence):
+            if current and len(current) + 1 + len(clause) > max_chars:
+                pieces.append(current)
+                current = clause
+            else:
+                current = f"{current} {clause}".strip()
+        if current:
+            pieces.append(current)
+
+    chunks: List[str] = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) < min_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+
+    # Un último trozo muy corto se pega al anterior
+    if len(chunks) > 1 and len(chunks[-1]) < min_chars:
+        last = chunks.pop()
+        chunks[-1] = f"{chunks[-1]} {last}"
+    return chunks
+
+
+# --- Utilidades WAV (sin tocar disco) ---
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def parse_wav_header(audio_bytes: bytes) -> Optional[Tuple[int, int, int, int, int, int]]:
+    """
+    Lee la cabecera RIFF/WAVE y devuelve:
+
+        (channels, sample_rate, bits_per_sample, data_offset, data_len, format_tag)
+
+    format_tag es WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT u otro código;
+    en WAVE_FORMAT_EXTENSIBLE se devuelve el del subformato.
+
+    o None si no es un WAV válido. Si el chunk "data" declara un tamaño
+    mayor que lo recibido (OpenAI lo deja a 0xFFFFFFFF al generar en
+    streaming), se usa la longitud real disponible.
+    """
+    view = memoryview(audio_bytes)
+    if len(view) < 12 or view[0:4] != b"RIFF" or view[8:12] != b"WAVE":
+        return None
+
+    channels = sample_rate = bits = format_tag = 0
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = view[pos:pos + 4]
+        size = int.from_bytes(view[pos + 4:pos + 8], "little")
+        body = pos + 8
+
+        if chunk_id == b"fmt ":
+            format_tag = int.from_bytes(view[body:body + 2], "little")
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                # Los 2 primeros bytes del GUID del subformato son el código
+                format_tag = int.from_bytes(view[body + 24:body + 26], "little")
+            channels = int.from_bytes(view[body + 2:body + 4], "little")
+            sample_rate = int.from_bytes(view[body + 4:body + 8], "little")
+            bits = int.from_bytes(view[body + 14:body + 16], "little")
+        elif chunk_id == b"data":
+            if not (channels and sample_rate and bits):
+                return None
+            data_len = min(size, len(view) - body)
+            return channels, sample_rate, bits, body, data_len, format_tag
+
+        pos = body + size + (size & 1)
+
+    return None
+
+
+def wav_duration_seconds(audio_bytes: bytes) -> float:
+    """
+    Duración en segundos de un WAV PCM (0.0 si no se puede leer).
+    """
+    header = parse_wav_header(audio_bytes)
+    if header is None:
+        return 0.0
+    channels, sample_rate, bits, _, data_len, _ = header
+    bytes_per_second = channels * sample_rate * (bits // 8)
+    return data_len / bytes_per_second if bytes_per_second else 0.0
+
+
+# --- Formatos de audio para el endpoint de visemas ---
+
+AUDIO_MIME_TYPES: Dict[str, str] = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",  # OpenAI entrega Opus dentro de un contenedor Ogg
+}
+
+# Formatos que sabemos entregar Y decodificar a PCM para alinear
+VISEME_AUDIO_FORMATS = tuple(AUDIO_MIME_TYPES)
+
+# Formato por defecto si el cliente no pide ninguno (WAV = compatibilidad)
+DEFAULT_VISEME_FORMAT = os.getenv("OPENAI_TTS_VISEME_FORMAT", "wav")
+
+
+def negotiate_audio_format(requested: Optional[str]) -> str:
+    """
+    El cliente indica sus formatos por orden de preferencia, p. ej.
+    "opus,mp3,wav". Devolvemos el primero que soportamos o el de por defecto.
+    """
+    for fmt in (requested or "").lower().split(","):
+        fmt = fmt.strip()
+        if fmt in VISEME_AUDIO_FORMATS:
+            return fmt
+    return DEFAULT_VISEME_FORMAT
+
+
+def _ogg_opus_duration_seconds(audio_bytes: bytes) -> Optional[float]:
+    """
+    Duración de un Ogg/Opus: granule position de la última página
+    (muestras a 48 kHz) menos el pre-skip de la cabecera OpusHead.
+    """
+    view = memoryview(audio_bytes)
+    head = audio_bytes.find(b"OpusHead")
+    last_page = audio_bytes.rfind(b"OggS")
+    if head == -1 or last_page == -1 or last_page + 14 > len(view):
+        return None
+    pre_skip = int.from_bytes(view[head + 10:head + 12], "little")
+    granule = int.from_bytes(view[last_page + 6:last_page + 14], "little")
+    return max(0, granule - pre_skip) / 48000.0
+
+
+# Tablas de cabecera de frame MP3 (MPEG-1/2/2.5, capas I-III)
+_MP3_BITRATES_KBPS = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),   # MPEG-2.5
+}
+
+
+def _mp3_duration_seconds(audio_bytes: bytes) -> Optional[float]:
+    """
+    Duración de un MP3 sumando las muestras de cada frame (leyendo solo
+    las cabeceras, sin decodificar). Sirve para CBR y VBR; el frame
+    Xing/Info inicial (sin audio) no cuenta.
+    """
+    view = memoryview(audio_bytes)
+    pos = 0
+    # Etiqueta ID3v2 al principio: tamaño "synchsafe" (7 bits por byte)
+    if len(view) >= 10 and view[0:3] == b"ID3":
+        size = 0
+        for b in view[6:10]:
+            size = (size << 7) | (b & 0x7F)
+        pos = 10 + size
+
+    samples = 0
+    sample_rate = 0
+    first = True
+    while pos + 4 <= len(view):
+        b1, b2 = view[pos + 1], view[pos + 2]
+        if view[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+            pos += 1  # basura entre frames: buscamos la siguiente sincronía
+            continue
+
+        version_bits = (b1 >> 3) & 0x3
+        layer = 4 - ((b1 >> 1) & 0x3)
+        bitrate_idx = b2 >> 4
+        rate_idx = (b2 >> 2) & 0x3
+        if version_bits == 1 or layer == 4 or bitrate_idx in (0, 15) or rate_idx == 3:
+            pos += 1
+            continue
+
+        version = 1 if version_bits == 3 else 2
+        bitrate = _MP3_BITRATES_KBPS[(version, layer)][bitrate_idx] * 1000
+        rate = _MP3_SAMPLE_RATES[version_bits][rate_idx]
+        padding = (b2 >> 1) & 0x1
+        if layer == 1:
+            frame_samples = 384
+            frame_len = (12 * bitrate // rate + padding) * 4
+        else:
+            frame_samples = 576 if layer == 3 and version == 2 else 1152
+            frame_len = frame_samples // 8 * bitrate // rate + padding
+
+        frame = bytes(view[pos:pos + min(frame_len, 64)])
+        if not (first and (b"Xing" in frame or b"Info" in frame)):
+            samples += frame_samples
+            sample_rate = rate
+        first = False
+        pos += frame_len
+
+    return samples / sample_rate if sample_rate else None
+
+
+def audio_duration_seconds(audio_bytes: bytes, audio_format: str) -> Optional[float]:
+    """
+    Duración del audio sin decodificarlo, leyendo cabeceras
+    (None si no se reconoce el formato o el audio está corrupto).
+    """
+    if audio_format == "wav":
+        return wav_duration_seconds(audio_bytes)
+    if audio_format == "opus":
+        return _ogg_opus_duration_seconds(audio_bytes)
+    if audio_format == "mp3":
+        return _mp3_duration_seconds(audio_bytes)
+    return None
+
+
+# --- Formato binario "viseme frames" (audio sin base64) ---
+
+# Cada trozo de audio viaja como un frame:
+#
+#   [u32 big-endian: longitud de la cabecera][cabecera JSON utf-8][audio]
+#
+# La cabecera lleva "audio_length" (bytes de audio que siguen),
+# "audio_mime_type" y "timeline", más los campos del trozo si aplica.
+VISEME_FRAMES_MEDIA_TYPE = "application/x-viseme-frames"
+
+
+def encode_frame_header(header: Dict, audio_length: int) -> bytes:
+    """
+    Prefijo de un frame (longitud + cabecera JSON). El audio se envía
+    justo detrás tal cual, sin copiarlo ni codificarlo.
+    """
+    body = json.dumps(
+        {**header, "audio_length": audio_length},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return len(body).to_bytes(4, "big") + body